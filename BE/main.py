@@ -6,24 +6,154 @@ FastAPI backend for the AD-AI Streamlit application.
 Provides endpoints for image upload, color recommendation, and ad generation.
 """
 
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-import shutil
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response, RedirectResponse
+from pydantic import BaseModel
+import base64
+import logging
 import os
+import re
+import json
+from email.utils import formatdate, parsedate_to_datetime
 import tempfile
 from typing import Optional, List
 import uuid
+import time
 import asyncio
+from contextlib import asynccontextmanager
 from typing import Dict
 
-from src.ad_generator import configure_logging, generate_ad_image
+from src.ad_generator import (
+    configure_logging,
+    async_generate_ad_image,
+    async_get_smart_colors,
+    async_generate_ads_batch,
+    async_generate_ad_variants,
+    create_ads_archive,
+    build_batch_item_result,
+    resolve_render_options,
+    FALLBACK_ENABLED,
+    COLOR_MODE_VISION,
+    COLOR_MODES,
+    MAX_VARIANTS,
+    OUTPUT_EXTENSIONS,
+    RENDER_MODE_FINAL
+)
+from src.client_manager import init_client_manager, async_shutdown_client_manager
+from src.jobs import JobManager, QueueFullError, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED
+from src.result_cache import get_result_cache
+from src.color_cache import get_color_cache
+from src.uploads import UploadRejected, store_upload, release_upload
+from src.upload_index import UploadIndex, UploadRecord
+from src.rate_limit import RateLimitExceeded, rate_limiter_stats
+from src.circuit_breaker import BREAKER_CLOSED, BREAKER_OPEN, CircuitOpen, circuit_breaker_stats
+from src.deadlines import DeadlineExceeded, deadline_settings
+from src.coalesce import SingleFlight, request_fingerprint
+from src.cancellation import cancellation_stats
+from src.derivatives import PARTIAL_PREVIEW, DERIVATIVES, detect_media_type, get_derivative, available_derivatives
+from src.storage import get_storage, output_key, batch_archive_key
+from src.generation_registry import GenerationRegistry, KIND_JOB
+from src.metrics import BytesMetricsMiddleware, observe_stage, register_gauge, render_metrics
+from src.logging_setup import CorrelationIdMiddleware
+from src.prewarm import Prewarmer
+from src.fallback_render import warm_fallback_pool, shutdown_fallback_pool
+
+
+# Identical in-flight generations share one pipeline run
+generation_flights = SingleFlight()
+
+
+# Speculative preprocessing and color analysis started at upload time
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "true").lower() not in ("0", "false", "no")
+prewarmer = Prewarmer(
+    analyses=[analysis.strip() for analysis in os.getenv("PREWARM_ANALYSES", "local,vision").split(",")],
+    max_concurrency=int(os.getenv("PREWARM_MAX_CONCURRENCY", "2")),
+    max_pending=int(os.getenv("PREWARM_MAX_PENDING", "32")),
+    vision_per_minute=int(os.getenv("PREWARM_VISION_PER_MINUTE", "10")),
+    timeout=float(os.getenv("PREWARM_TIMEOUT", "60"))
+)
+
+
+async def after_prewarm(file_id: str, params: dict, generate):
+    """Wait for the upload's prewarm so the generation reuses its work, then run generate()"""
+    smart_product = params["product_name"] if params["use_smart_colors"] and not params["colors"] else None
+    await prewarmer.wait(file_id, smart_product)
+    return await generate()
+
+
+async def run_generation_job(params, progress_callback):
+    """Run one queued generation job, joining an identical generation already in flight"""
+    params = dict(params)
+    key = params.pop("fingerprint")
+    file_id = params.pop("file_id")
+    result, coalesced = await generation_flights.run(
+        key,
+        lambda progress, _preview: after_prewarm(
+            file_id, params, lambda: async_generate_ad_image(**params, progress_callback=progress)
+        ),
+        progress_callback=progress_callback
+    )
+    return {**result, "coalesced": coalesced}
+
+
+# Background job queue for /jobs/generate-ad
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+
+def sync_job_state(job):
+    """Mirror a job's status and stage into the shared generation registry"""
+    if job.finished:
+        generation_registry.write_behind(generation_registry.finish, job.job_id)
+    else:
+        generation_registry.write_behind(
+            generation_registry.register,
+            job.job_id, job.file_id, kind=KIND_JOB, stage=job.stage, started_at=job.started_at or job.created_at
+        )
+
+
+job_manager = JobManager(
+    run_generation_job,
+    num_workers=JOB_WORKERS,
+    max_queue_size=JOB_QUEUE_SIZE,
+    retention_seconds=JOB_RETENTION_SECONDS,
+    on_update=sync_job_state
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build shared resources once at startup and release them on shutdown"""
+    init_client_manager()
+    logger.info("Shared OpenAI client ready")
+    await asyncio.to_thread(upload_index.reconcile, UPLOAD_DIR, storage)
+    await job_manager.start()
+    if FALLBACK_ENABLED:
+        # Spawn the local renderer's processes now, not during an upstream outage
+        warm_fallback_pool()
+    cancel_watcher = asyncio.create_task(
+        generation_registry.watch(cancel_local_generation, interval=GENERATION_POLL_INTERVAL)
+    )
+    try:
+        yield
+    finally:
+        cancel_watcher.cancel()
+        await asyncio.gather(cancel_watcher, return_exceptions=True)
+        await job_manager.stop()
+        await prewarmer.stop()
+        await async_shutdown_client_manager()
+        await asyncio.to_thread(shutdown_fallback_pool)
+        await asyncio.to_thread(upload_index.close)
+        await asyncio.to_thread(generation_registry.close)
+
 
 # Initialize FastAPI app
-app = FastAPI(title="AD-AI API", description="AI-powered advertisement generator")
+app = FastAPI(title="AD-AI API", description="AI-powered advertisement generator", lifespan=lifespan)
 
-# Store active generation tasks
-active_generations: Dict[str, asyncio.Task] = {}
+# Generation request tasks running in this worker, by generation id
+local_generations: Dict[str, asyncio.Task] = {}
 
 # Configure CORS
 app.add_middleware(
@@ -33,16 +163,55 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(BytesMetricsMiddleware)
+# Outermost, so every log line of a request carries its correlation id
+app.add_middleware(CorrelationIdMiddleware)
 
 # Configure logging
-logger = configure_logging()
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # Create uploads directory if it doesn't exist
 UPLOAD_DIR = "temp_uploads"
 OUTPUT_DIR = "generated_ads"
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_MAX_PIXELS = int(os.getenv("UPLOAD_MAX_PIXELS", str(40_000_000)))
+BATCH_DIR = os.path.join(OUTPUT_DIR, "batches")
+DERIVATIVE_CACHE_DIR = os.getenv("DERIVATIVE_CACHE_DIR", "cache/derivatives")
+# Generated ads never change once written, so clients may cache them for a year
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Uploads and outputs shared by every worker (STORAGE_BACKEND=local or s3)
+storage = get_storage()
+
+# Persistent file_id -> upload index
+upload_index = UploadIndex(os.getenv("UPLOAD_INDEX_PATH", os.path.join(UPLOAD_DIR, "index.sqlite3")))
+
+# In-flight generations of every worker: owner, stage, start time and cancel flag
+GENERATION_POLL_INTERVAL = float(os.getenv("GENERATION_POLL_INTERVAL", "0.5"))
+generation_registry = GenerationRegistry(
+    os.getenv("GENERATION_REGISTRY_PATH", os.path.join(UPLOAD_DIR, "generations.sqlite3")),
+    stale_seconds=float(os.getenv("GENERATION_STALE_SECONDS", "30"))
+)
+
+
+def cancel_local_generation(generation_id: str) -> bool:
+    """Cancel a request or job running in this worker; used for cancellations requested on any worker"""
+    task = local_generations.get(generation_id)
+    if task is not None:
+        if not task.cancelling():
+            task.cancel()
+        return True
+    if job_manager.get(generation_id) is not None:
+        return job_manager.cancel(generation_id)
+    # Finished before the cancellation arrived
+    generation_registry.write_behind(generation_registry.finish, generation_id)
+    return False
+
 
 @app.get("/")
 async def root():
@@ -50,39 +219,303 @@ async def root():
     return {"message": "AD-AI API is running"}
 
 
+@app.get("/health")
+async def health():
+    """Report the OpenAI circuit breakers and stage deadlines; degraded while any breaker is not closed"""
+    breakers = circuit_breaker_stats()
+    healthy = all(breaker["state"] == BREAKER_CLOSED for breaker in breakers.values())
+    return {
+        "status": "ok" if healthy else "degraded",
+        "circuit_breakers": breakers,
+        "deadlines": deadline_settings(),
+        "fallback_enabled": FALLBACK_ENABLED
+    }
+
+
 @app.post("/upload-image")
-async def upload_image(file: UploadFile = File(...)):
-    """Upload an image file and return the file path"""
+async def upload_image(file: UploadFile = File(...), product_name: Optional[str] = Form(None)):
+    """Stream an image upload to disk, start pre-warming it and return its file id"""
     try:
         # Validate file type
-        if not file.content_type.startswith('image/'):
+        if not file.content_type or not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Generate unique filename
-        file_id = str(uuid.uuid4())
-        file_extension = os.path.splitext(file.filename)[1]
-        temp_filename = f"{file_id}{file_extension}"
-        temp_filepath = os.path.join(UPLOAD_DIR, temp_filename)
-        
-        # Save uploaded file
-        with open(temp_filepath, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        upload_started = time.monotonic()
+        stored = await store_upload(
+            file, UPLOAD_DIR, max_bytes=UPLOAD_MAX_BYTES, max_pixels=UPLOAD_MAX_PIXELS, storage=storage
+        )
+        observe_stage("upload", time.monotonic() - upload_started)
+        await asyncio.to_thread(upload_index.add, UploadRecord.from_stored_upload(stored))
         
-        logger.info(f"Image uploaded: {temp_filepath}")
+        logger.info(f"Image uploaded: {stored.path}")
+        prewarm = prewarmer.schedule(stored.file_id, stored.path, product_name) if PREWARM_ENABLED else None
         
         return {
             "success": True,
-            "file_id": file_id,
-            "filename": temp_filename,
-            "filepath": temp_filepath,
+            "file_id": stored.file_id,
+            "filename": os.path.basename(stored.path),
+            "filepath": stored.path,
+            "size": stored.size,
+            "sha256": stored.sha256,
+            "mime_type": stored.mime_type,
+            "width": stored.width,
+            "height": stored.height,
+            "deduplicated": stored.deduplicated,
+            "prewarm": prewarm.status if prewarm else "skipped",
             "message": "Image uploaded successfully"
         }
         
+    except HTTPException:
+        raise
+    except UploadRejected as e:
+        logger.warning(f"Image upload rejected: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         logger.error(f"Image upload failed: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to upload image: {str(e)}")
 
 
+@app.post("/recommend-colors")
+async def recommend_colors(
+    product_name: str = Form(...),
+    file_id: str = Form(...),
+    color_mode: str = Form(COLOR_MODE_VISION)
+):
+    """Recommend advertisement colors for an uploaded product image"""
+    try:
+        validate_color_mode(color_mode)
+        image_path = await find_uploaded_image(file_id)
+        await prewarmer.wait(file_id, product_name)
+        
+        number_of_colors, recommended_colors = await async_get_smart_colors(
+            product_name, image_path, color_mode=color_mode
+        )
+        if not recommended_colors:
+            raise HTTPException(status_code=502, detail="Color recommendation returned no colors")
+        
+        return {
+            "success": True,
+            "product_name": product_name,
+            "file_id": file_id,
+            "recommended_colors": recommended_colors,
+            "number_of_colors": number_of_colors,
+            "color_mode": color_mode,
+            "message": "Colors recommended successfully"
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Color recommendation failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to recommend colors: {str(e)}")
+
+
+@app.post("/prewarm/{file_id}", status_code=202)
+async def prewarm_upload(file_id: str, product_name: Optional[str] = Form(None)):
+    """Start pre-warming an upload, e.g. again once its product name is known"""
+    if not PREWARM_ENABLED:
+        raise HTTPException(status_code=503, detail="Prewarming is disabled")
+    image_path = await find_uploaded_image(file_id)
+    
+    prewarm = prewarmer.schedule(file_id, image_path, product_name)
+    if prewarm is None:
+        raise HTTPException(status_code=503, detail="Too many uploads are being prewarmed, try again later")
+    return prewarm.to_dict()
+
+
+@app.get("/prewarm/{file_id}")
+async def prewarm_status(file_id: str):
+    """Report the speculative work done for an upload"""
+    prewarm = prewarmer.get(file_id)
+    if prewarm is None:
+        raise HTTPException(status_code=404, detail="No prewarm for this upload")
+    return prewarm.to_dict()
+
+
+def validate_color_mode(color_mode: str):
+    """Reject unknown smart color modes with a 400"""
+    if color_mode not in COLOR_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"color_mode must be one of: {', '.join(COLOR_MODES)}"
+        )
+
+
+async def find_uploaded_image(file_id: str) -> str:
+    """Return the local path of an uploaded image, fetching it from storage if needed, or raise 404"""
+    record = await asyncio.to_thread(upload_index.get, file_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Uploaded image not found")
+    
+    if not os.path.exists(record.path):
+        # Uploaded through another worker: pull a local copy from shared storage
+        try:
+            await asyncio.to_thread(storage.fetch, record.storage_key, record.path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Uploaded image not found")
+        logger.info(f"Fetched upload {file_id} from {storage.backend} storage")
+    
+    return record.path
+
+
+async def generation_key(file_id: str, params: dict) -> str:
+    """Fingerprint a generation request by upload content and generator arguments"""
+    record = await asyncio.to_thread(upload_index.get, file_id)
+    return request_fingerprint(record.sha256 if record else file_id, params)
+
+
+async def run_tracked_generation(file_id: str, key: str, factory, progress_callback=None, preview_callback=None):
+    """
+    Run a generation through the coalescer, tracked for /cancel-generation.
+    
+    Each request gets its own task holding one reference to the shared
+    generation, so cancelling a request never cancels work other requests wait for.
+    The request is registered in the shared registry so any worker can cancel it.
+    progress_callback and preview_callback receive the generation's stages and
+    partial image previews, see SingleFlight.run.
+    """
+    generation_id = str(uuid.uuid4())
+    # Visible to other workers before the generation starts
+    await asyncio.wrap_future(generation_registry.write_behind(generation_registry.register, generation_id, file_id))
+    
+    def report_progress(stage):
+        generation_registry.write_behind(generation_registry.update_stage, generation_id, stage)
+        if progress_callback is not None:
+            progress_callback(stage)
+    
+    task = asyncio.create_task(generation_flights.run(
+        key, factory, progress_callback=report_progress, preview_callback=preview_callback
+    ))
+    local_generations[generation_id] = task
+    try:
+        return await task
+    finally:
+        local_generations.pop(generation_id, None)
+        generation_registry.write_behind(generation_registry.finish, generation_id)
+
+
+def build_output_filename(product_name: str, brand_name: str, extension: str = ".jpg") -> str:
+    """Generate a unique output path for a new advertisement"""
+    output_id = str(uuid.uuid4())
+    return os.path.join(OUTPUT_DIR, f"{product_name}_{brand_name}_{output_id}{extension}")
+
+
+def parse_colors(colors: Optional[str], use_smart_colors: bool) -> Optional[List[str]]:
+    """Parse the comma-separated colors form field"""
+    if colors and not use_smart_colors:
+        return [color.strip() for color in colors.split(',') if color.strip()]
+    return None
+
+
+async def build_generation_params(
+    product_name: str,
+    brand_name: str,
+    file_id: str,
+    use_smart_colors: bool,
+    number_of_colors: Optional[int],
+    colors: Optional[str],
+    color_mode: str = COLOR_MODE_VISION,
+    render: Optional[dict] = None
+) -> dict:
+    """
+    Resolve the form fields of a generation request into generator arguments.
+    
+    render holds the mode, quality, size and output_format fields of requests
+    that choose how the image is rendered.
+    """
+    validate_color_mode(color_mode)
+    render = {name: value for name, value in (render or {}).items() if value}
+    try:
+        render_options = resolve_render_options(**render)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    image_path = await find_uploaded_image(file_id)
+    colors_list = parse_colors(colors, use_smart_colors)
+    
+    logger.info(f"Generating ad for {product_name} by {brand_name}")
+    logger.info(f"Use smart colors: {use_smart_colors}, Manual colors: {colors_list}")
+    
+    extension = OUTPUT_EXTENSIONS.get(render_options.get("output_format"), ".jpg")
+    return {
+        "product_name": product_name,
+        "brand_name": brand_name,
+        "image_path": image_path,
+        "output_filename": build_output_filename(product_name, brand_name, extension),
+        "number_of_colors": number_of_colors,
+        "colors": colors_list,
+        "use_smart_colors": use_smart_colors,
+        "color_mode": color_mode,
+        **render
+    }
+
+
+def parse_color_variants(color_variants: Optional[str]) -> Optional[List[List[str]]]:
+    """Parse the color_variants form field: colorways separated by ';', colors by ','"""
+    if not color_variants:
+        return None
+    
+    variants = [parse_colors(colorway, False) for colorway in color_variants.split(';') if colorway.strip()]
+    if not variants or len(variants) > MAX_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"color_variants must list 1-{MAX_VARIANTS} colorways")
+    return variants
+
+
+def rate_limited_exception(error: RateLimitExceeded) -> HTTPException:
+    """Translate an exhausted OpenAI rate limit into a 429 for the caller"""
+    retry_after = max(1, round(error.retry_after)) if error.retry_after else 30
+    return HTTPException(
+        status_code=429,
+        detail="OpenAI rate limit reached, please retry later",
+        headers={"Retry-After": str(retry_after)}
+    )
+
+
+def upstream_unavailable_exception(error: Exception) -> HTTPException:
+    """Translate an open circuit breaker into a 503 and a missed stage deadline into a 504"""
+    if isinstance(error, CircuitOpen):
+        return HTTPException(
+            status_code=503,
+            detail="OpenAI is currently unavailable, please retry later",
+            headers={"Retry-After": str(max(1, round(error.retry_after)))}
+        )
+    return HTTPException(status_code=504, detail=f"OpenAI did not answer in time: {error}")
+
+
+def build_generation_response(result, params: dict) -> dict:
+    """Build the API response for a finished generation"""
+    if isinstance(result, dict):
+        result_file = result["output_filename"]
+        colors_used = result["colors_used"]
+        num_colors = result["number_of_colors"]
+    else:
+        # Backward compatibility
+        result_file = result
+        colors_used = params["colors"] if params["colors"] else []
+        num_colors = params["number_of_colors"] if params["number_of_colors"] else 0
+    
+    download_url = f"/download/{os.path.basename(result_file)}"
+    return {
+        "success": True,
+        "product_name": params["product_name"],
+        "brand_name": params["brand_name"],
+        "output_file": result_file,
+        "download_url": download_url,
+        "preview_url": f"{download_url}?variant=preview",
+        "thumbnail_url": f"{download_url}?variant=thumb",
+        "colors_used": colors_used,
+        "number_of_colors": num_colors,
+        "use_smart_colors": params["use_smart_colors"],
+        "color_mode": params["color_mode"],
+        "cache_hit": result.get("cache_hit", False) if isinstance(result, dict) else False,
+        "coalesced": result.get("coalesced", False) if isinstance(result, dict) else False,
+        "fallback": result.get("fallback", False) if isinstance(result, dict) else False,
+        "output_size": result.get("output_size") if isinstance(result, dict) else None,
+        "output_sha256": result.get("output_sha256") if isinstance(result, dict) else None,
+        "render": result.get("render") if isinstance(result, dict) else None,
+        "message": "Advertisement generated successfully"
+    }
+
+
 @app.post("/generate-ad")
 async def generate_ad(
     product_name: str = Form(...),
@@ -90,123 +523,738 @@ async def generate_ad(
     file_id: str = Form(...),
     use_smart_colors: bool = Form(False),
     number_of_colors: Optional[int] = Form(None),
-    colors: Optional[str] = Form(None)
+    colors: Optional[str] = Form(None),
+    color_mode: str = Form(COLOR_MODE_VISION),
+    mode: Optional[str] = Form(None),
+    quality: Optional[str] = Form(None),
+    size: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None)
 ):
-    """Generate advertisement image"""
+    """
+    Generate advertisement image
+    
+    mode=draft returns a quick low quality render; /generate-ad/finalize then
+    re-renders the chosen draft at high quality. quality, size and output_format
+    override the preset of the mode.
+    """
     try:
-        # Find uploaded file
-        uploaded_files = [f for f in os.listdir(UPLOAD_DIR) if f.startswith(file_id)]
-        if not uploaded_files:
-            raise HTTPException(status_code=404, detail="Uploaded image not found")
+        params = await build_generation_params(
+            product_name, brand_name, file_id, use_smart_colors, number_of_colors, colors, color_mode,
+            render={"mode": mode, "quality": quality, "size": size, "output_format": output_format}
+        )
         
-        image_path = os.path.join(UPLOAD_DIR, uploaded_files[0])
-        
-        # Generate unique output filename
-        output_id = str(uuid.uuid4())
-        output_filename = os.path.join(OUTPUT_DIR, f"{product_name}_{brand_name}_{output_id}.jpg")
-        
-        # Parse colors if provided
-        colors_list = None
-        if colors and not use_smart_colors:
-            colors_list = [color.strip() for color in colors.split(',') if color.strip()]
-        
-        logger.info(f"Generating ad for {product_name} by {brand_name}")
-        logger.info(f"Use smart colors: {use_smart_colors}, Manual colors: {colors_list}")
-        
-        # Create async wrapper for the generation function
-        async def async_generate_ad():
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(
-                None,
-                lambda: generate_ad_image(
-                    product_name=product_name,
-                    brand_name=brand_name,
-                    image_path=image_path,
-                    output_filename=output_filename,
-                    number_of_colors=number_of_colors,
-                    colors=colors_list,
-                    use_smart_colors=use_smart_colors
+        # Run the async pipeline on the event loop, sharing it with identical in-flight requests
+        try:
+            result, coalesced = await run_tracked_generation(
+                file_id,
+                await generation_key(file_id, params),
+                lambda progress, _preview: after_prewarm(
+                    file_id, params, lambda: async_generate_ad_image(**params, progress_callback=progress)
                 )
             )
+        except asyncio.CancelledError:
+            logger.info(f"Generation cancelled for {file_id}")
+            raise HTTPException(status_code=499, detail="Generation cancelled by user")
+        
+        return build_generation_response({**result, "coalesced": coalesced}, params)
         
-        # Create and store the task
-        task = asyncio.create_task(async_generate_ad())
-        active_generations[file_id] = task
+    except HTTPException:
+        # Re-raise HTTP exceptions
+        raise
+    except RateLimitExceeded as e:
+        logger.warning(f"Ad generation rate limited: {e}")
+        raise rate_limited_exception(e)
+    except (CircuitOpen, DeadlineExceeded) as e:
+        logger.warning(f"Ad generation failed fast: {e}")
+        raise upstream_unavailable_exception(e)
+    except Exception as e:
+        logger.error(f"Ad generation failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to generate advertisement: {str(e)}")
+
+
+@app.post("/generate-ad/finalize")
+async def finalize_ad(
+    product_name: str = Form(...),
+    brand_name: str = Form(...),
+    file_id: str = Form(...),
+    colors: str = Form(...),
+    number_of_colors: Optional[int] = Form(None),
+    quality: Optional[str] = Form(None),
+    size: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None)
+):
+    """
+    Re-render a chosen draft at final quality
+    
+    Takes the draft's product, brand and upload with its colors_used and
+    number_of_colors, so the final image is rendered from the same prompt.
+    quality, size and output_format override the final preset.
+    """
+    if not parse_colors(colors, False):
+        raise HTTPException(status_code=400, detail="colors must list the draft's colors_used")
+    
+    return await generate_ad(
+        product_name=product_name,
+        brand_name=brand_name,
+        file_id=file_id,
+        use_smart_colors=False,
+        number_of_colors=number_of_colors,
+        colors=colors,
+        color_mode=COLOR_MODE_VISION,
+        mode=RENDER_MODE_FINAL,
+        quality=quality,
+        size=size,
+        output_format=output_format
+    )
+
+
+# Seconds between SSE comments keeping idle generation streams open through proxies
+SSE_KEEPALIVE_SECONDS = 15
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Serialize one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def generation_error_event(error: BaseException) -> str:
+    """Describe a failed streamed generation with the status /generate-ad would answer"""
+    if isinstance(error, asyncio.CancelledError):
+        return sse_event("error", {"status": 499, "detail": "Generation cancelled by user"})
+    if isinstance(error, (RateLimitExceeded, CircuitOpen, DeadlineExceeded)):
+        if isinstance(error, RateLimitExceeded):
+            http_error = rate_limited_exception(error)
+        else:
+            http_error = upstream_unavailable_exception(error)
+        data = {"status": http_error.status_code, "detail": http_error.detail}
+        if http_error.headers:
+            data["retry_after"] = int(http_error.headers["Retry-After"])
+        return sse_event("error", data)
+    return sse_event("error", {"status": 500, "detail": f"Failed to generate advertisement: {str(error)}"})
+
+
+async def stream_generation(file_id: str, params: dict):
+    """Run a generation and yield its stages, partial previews and result as server-sent events"""
+    events = asyncio.Queue()
+    preview_media_type = PARTIAL_PREVIEW.media_type
+    
+    def on_preview(preview: bytes):
+        data_url = f"data:{preview_media_type};base64,{base64.b64encode(preview).decode('ascii')}"
+        events.put_nowait(("preview", {"image": data_url}))
+    
+    generation = asyncio.create_task(run_tracked_generation(
+        file_id,
+        await generation_key(file_id, params),
+        lambda progress, preview: after_prewarm(
+            file_id, params,
+            lambda: async_generate_ad_image(**params, progress_callback=progress, preview_callback=preview)
+        ),
+        progress_callback=lambda stage: events.put_nowait(("stage", {"stage": stage})),
+        preview_callback=on_preview
+    ))
+    generation.add_done_callback(lambda _: events.put_nowait(None))
+    
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                break
+            yield sse_event(*event)
         
         try:
-            # Wait for the generation to complete
-            result = await task
-        except asyncio.CancelledError:
+            result, coalesced = generation.result()
+        except asyncio.CancelledError as e:
             logger.info(f"Generation cancelled for {file_id}")
-            raise HTTPException(status_code=499, detail="Generation cancelled by user")
-        finally:
-            # Clean up the task from active generations
-            active_generations.pop(file_id, None)
-        
-        # Extract result data
-        if isinstance(result, dict):
-            result_file = result["output_filename"]
-            colors_used = result["colors_used"]
-            num_colors = result["number_of_colors"]
+            yield generation_error_event(e)
+            return
+        except Exception as e:
+            logger.error(f"Streamed generation failed for {file_id}: {e}")
+            yield generation_error_event(e)
+            return
+        yield sse_event("result", build_generation_response({**result, "coalesced": coalesced}, params))
+    finally:
+        # The client went away: drop this request's reference to the generation
+        if not generation.done():
+            generation.cancel()
+            await asyncio.gather(generation, return_exceptions=True)
+
+
+@app.post("/generate-ad/stream")
+async def generate_ad_stream(
+    product_name: str = Form(...),
+    brand_name: str = Form(...),
+    file_id: str = Form(...),
+    use_smart_colors: bool = Form(False),
+    number_of_colors: Optional[int] = Form(None),
+    colors: Optional[str] = Form(None),
+    color_mode: str = Form(COLOR_MODE_VISION),
+    mode: Optional[str] = Form(None),
+    quality: Optional[str] = Form(None),
+    size: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None)
+):
+    """
+    Generate an advertisement image, streaming progress as server-sent events.
+    
+    Emits a "stage" event per pipeline stage, "preview" events with downscaled
+    partial images while the image is rendered, then a "result" event carrying
+    the /generate-ad response or an "error" event.
+    """
+    params = await build_generation_params(
+        product_name, brand_name, file_id, use_smart_colors, number_of_colors, colors, color_mode,
+        render={"mode": mode, "quality": quality, "size": size, "output_format": output_format}
+    )
+    return StreamingResponse(
+        stream_generation(file_id, params),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+class BatchItem(BaseModel):
+    """One advertisement of a batch request"""
+    file_id: str
+    product_name: str
+    brand_name: str
+    colors: Optional[List[str]] = None
+    number_of_colors: Optional[int] = None
+    use_smart_colors: bool = False
+    color_mode: str = COLOR_MODE_VISION
+
+
+class BatchRequest(BaseModel):
+    """Body of a batch generation request"""
+    items: List[BatchItem]
+    max_concurrency: Optional[int] = None
+
+
+async def build_batch_params(item: BatchItem) -> dict:
+    """Resolve one batch item into generator arguments"""
+    colors = ",".join(item.colors) if item.colors else None
+    return await build_generation_params(
+        item.product_name, item.brand_name, item.file_id, item.use_smart_colors,
+        item.number_of_colors, colors, item.color_mode
+    )
+
+
+def batch_line(record: dict) -> str:
+    """Serialize one NDJSON line of a batch stream"""
+    return json.dumps(record) + "\n"
+
+
+async def stream_batch(batch_id: str, items: List[BatchItem], max_concurrency: int):
+    """Run a batch and yield one NDJSON line per finished item, then a summary"""
+    resolved = []
+    succeeded = []
+    failed = 0
+    
+    for index, item in enumerate(items):
+        try:
+            resolved.append((index, await build_batch_params(item)))
+        except HTTPException as e:
+            failed += 1
+            yield batch_line({**build_batch_item_result(index, error=e.detail), "file_id": item.file_id})
+    
+    batch_items = [params for _, params in resolved]
+    async for record in async_generate_ads_batch(batch_items, max_concurrency=max_concurrency):
+        index, params = resolved[record["index"]]
+        if record["success"]:
+            succeeded.append(record["result"]["output_filename"])
+            yield batch_line({"index": index, "success": True, "file_id": items[index].file_id,
+                              "result": build_generation_response(record["result"], params)})
         else:
-            # Backward compatibility
-            result_file = result
-            colors_used = colors_list if colors_list else []
-            num_colors = number_of_colors if number_of_colors else 0
+            failed += 1
+            yield batch_line({**record, "index": index, "file_id": items[index].file_id})
+    
+    archive_url = None
+    if succeeded:
+        archive_path = os.path.join(BATCH_DIR, f"{batch_id}.zip")
+        try:
+            await asyncio.to_thread(create_ads_archive, succeeded, archive_path)
+            await asyncio.to_thread(storage.put_file, batch_archive_key(batch_id), archive_path, "application/zip")
+            archive_url = f"/batches/{batch_id}/archive"
+        except Exception as e:
+            logger.error(f"Failed to archive batch {batch_id}: {e}")
+    
+    logger.info(f"Batch {batch_id} finished: {len(succeeded)} succeeded, {failed} failed")
+    yield batch_line({
+        "batch_id": batch_id,
+        "done": True,
+        "total": len(items),
+        "succeeded": len(succeeded),
+        "failed": failed,
+        "archive_url": archive_url
+    })
+
+
+@app.post("/generate-ads/batch")
+async def generate_ads_batch(request: BatchRequest):
+    """Generate many advertisements concurrently, streaming NDJSON results as they finish"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one item")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds the limit of {BATCH_MAX_ITEMS} items")
+    
+    max_concurrency = min(request.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    if max_concurrency < 1:
+        raise HTTPException(status_code=400, detail="max_concurrency must be at least 1")
+    
+    batch_id = str(uuid.uuid4())
+    logger.info(f"Starting batch {batch_id} with {len(request.items)} items, concurrency {max_concurrency}")
+    
+    return StreamingResponse(
+        stream_batch(batch_id, request.items, max_concurrency),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": batch_id}
+    )
+
+
+@app.get("/batches/{batch_id}/archive")
+async def download_batch_archive(request: Request, batch_id: str):
+    """Download all advertisements of a finished batch as a zip archive"""
+    try:
+        batch_id = str(uuid.UUID(batch_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Batch archive not found")
+    
+    response = await stored_file_response(
+        request,
+        batch_archive_key(batch_id),
+        f"ads_{batch_id}.zip",
+        media_type="application/zip",
+        fallback_path=os.path.join(BATCH_DIR, f"{batch_id}.zip")
+    )
+    if response is None:
+        raise HTTPException(status_code=404, detail="Batch archive not found")
+    return response
+
+
+@app.post("/generate-ad/variants")
+async def generate_ad_variants(
+    product_name: str = Form(...),
+    brand_name: str = Form(...),
+    file_id: str = Form(...),
+    variants: int = Form(2),
+    color_variants: Optional[str] = Form(None),
+    use_smart_colors: bool = Form(False),
+    number_of_colors: Optional[int] = Form(None),
+    colors: Optional[str] = Form(None),
+    color_mode: str = Form(COLOR_MODE_VISION)
+):
+    """Generate several advertisement variants of one product from a single upload"""
+    try:
+        colorways = parse_color_variants(color_variants)
+        if colorways is None and not 1 <= variants <= MAX_VARIANTS:
+            raise HTTPException(status_code=400, detail=f"variants must be between 1 and {MAX_VARIANTS}")
+        
+        params = await build_generation_params(
+            product_name, brand_name, file_id, use_smart_colors, number_of_colors, colors, color_mode
+        )
+        count = len(colorways) if colorways else variants
+        output_filenames = [build_output_filename(product_name, brand_name) for _ in range(count)]
+        del params["output_filename"]
+        variant_params = {**params, "output_filenames": output_filenames, "color_variants": colorways}
+        
+        try:
+            results, coalesced = await run_tracked_generation(
+                file_id,
+                await generation_key(file_id, {**variant_params, "variants": count}),
+                lambda progress, _preview: after_prewarm(
+                    file_id, variant_params,
+                    lambda: async_generate_ad_variants(**variant_params, progress_callback=progress)
+                )
+            )
+        except asyncio.CancelledError:
+            logger.info(f"Variant generation cancelled for {file_id}")
+            raise HTTPException(status_code=499, detail="Generation cancelled by user")
         
         return {
             "success": True,
             "product_name": product_name,
             "brand_name": brand_name,
-            "output_file": result_file,
-            "download_url": f"/download/{os.path.basename(result_file)}",
-            "colors_used": colors_used,
-            "number_of_colors": num_colors,
-            "use_smart_colors": use_smart_colors,
-            "message": "Advertisement generated successfully"
+            "variants": [build_generation_response({**result, "coalesced": coalesced}, params) for result in results],
+            "message": f"{len(results)} advertisement variants generated successfully"
         }
         
     except HTTPException:
-        # Re-raise HTTP exceptions
         raise
+    except RateLimitExceeded as e:
+        logger.warning(f"Variant generation rate limited: {e}")
+        raise rate_limited_exception(e)
+    except (CircuitOpen, DeadlineExceeded) as e:
+        logger.warning(f"Variant generation failed fast: {e}")
+        raise upstream_unavailable_exception(e)
     except Exception as e:
-        logger.error(f"Ad generation failed: {e}")
-        # Clean up the task from active generations on error
-        active_generations.pop(file_id, None)
-        raise HTTPException(status_code=500, detail=f"Failed to generate advertisement: {str(e)}")
+        logger.error(f"Variant generation failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to generate advertisement variants: {str(e)}")
 
 
-@app.get("/download/{filename}")
-async def download_file(filename: str):
-    """Download generated advertisement file"""
+@app.post("/jobs/generate-ad", status_code=202)
+async def submit_generation_job(
+    product_name: str = Form(...),
+    brand_name: str = Form(...),
+    file_id: str = Form(...),
+    use_smart_colors: bool = Form(False),
+    number_of_colors: Optional[int] = Form(None),
+    colors: Optional[str] = Form(None),
+    color_mode: str = Form(COLOR_MODE_VISION),
+    mode: Optional[str] = Form(None),
+    quality: Optional[str] = Form(None),
+    size: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None)
+):
+    """Queue an advertisement generation and return its job id immediately"""
     try:
-        file_path = os.path.join(OUTPUT_DIR, filename)
+        params = await build_generation_params(
+            product_name, brand_name, file_id, use_smart_colors, number_of_colors, colors, color_mode,
+            render={"mode": mode, "quality": quality, "size": size, "output_format": output_format}
+        )
+        job = job_manager.submit(
+            {**params, "fingerprint": await generation_key(file_id, params), "file_id": file_id}, file_id=file_id
+        )
         
-        if not os.path.exists(file_path):
+        return {
+            "success": True,
+            "job_id": job.job_id,
+            "status": job.status,
+            "status_url": f"/jobs/{job.job_id}",
+            "result_url": f"/jobs/{job.job_id}/result",
+            "message": "Advertisement generation queued"
+        }
+        
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        logger.warning(f"Rejected generation job: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Job submission failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to queue advertisement generation: {str(e)}")
+
+
+async def remote_job_status(job_id: str) -> dict:
+    """Report a job running in another worker from the shared registry, or raise 404"""
+    state = await asyncio.to_thread(generation_registry.get, job_id)
+    if state is None or state.kind != KIND_JOB:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return {
+        "job_id": job_id,
+        "file_id": state.file_id,
+        "status": JOB_QUEUED if state.stage == JOB_QUEUED else JOB_RUNNING,
+        "stage": state.stage,
+        "started_at": state.started_at,
+        "owner": state.owner,
+        "cancel_requested": state.cancel_requested
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Report the status and current pipeline stage of a generation job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return await remote_job_status(job_id)
+    
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Return the result of a finished generation job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=202, content=await remote_job_status(job_id))
+    
+    if job.status == JOB_SUCCEEDED:
+        return build_generation_response(job.result, job.params)
+    if job.status == JOB_FAILED:
+        raise HTTPException(status_code=500, detail=f"Failed to generate advertisement: {job.error}")
+    if job.status == JOB_CANCELLED:
+        raise HTTPException(status_code=499, detail="Generation cancelled by user")
+    
+    return JSONResponse(status_code=202, content=job.to_dict())
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running generation job"""
+    if job_manager.get(job_id) is None:
+        # Owned by another worker, which picks up the flag on its next poll
+        if not await asyncio.to_thread(generation_registry.request_cancel, generation_id=job_id):
+            raise HTTPException(status_code=404, detail="Job not found")
+        return {"success": True, "message": f"Cancellation of job {job_id} requested"}
+    
+    cancelled = job_manager.cancel(job_id)
+    return {
+        "success": cancelled,
+        "message": f"Job {job_id} cancelled" if cancelled else "Job already finished"
+    }
+
+
+def build_etag(size: int, mtime_ns: int, variant: Optional[str] = None) -> str:
+    """Build a strong ETag for an immutable file and rendition"""
+    suffix = f"-{variant}" if variant else ""
+    return f'"{size:x}-{mtime_ns:x}{suffix}"'
+
+
+def is_not_modified(request: Request, etag: str, modified: float) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since against the current file"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cache_headers(etag: str, modified: float) -> dict:
+    """Validator and caching headers of an immutable download"""
+    return {
+        "ETag": etag,
+        "Last-Modified": formatdate(modified, usegmt=True),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+    }
+
+
+async def local_file_response(
+    request: Request,
+    path: str,
+    filename: str,
+    media_type: Optional[str] = None,
+    variant: Optional[str] = None
+) -> Response:
+    """Serve a file on local disk with caching headers; Range requests get 206 partial content"""
+    if media_type is None:
+        media_type = await asyncio.to_thread(detect_media_type, path, "image/jpeg")
+    
+    stat_result = await asyncio.to_thread(os.stat, path)
+    headers = cache_headers(build_etag(stat_result.st_size, stat_result.st_mtime_ns, variant), stat_result.st_mtime)
+    if is_not_modified(request, headers["ETag"], stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+    
+    return FileResponse(
+        path=path,
+        filename=filename,
+        media_type=media_type,
+        headers=headers,
+        stat_result=stat_result,
+        content_disposition_type="inline" if variant else "attachment"
+    )
+
+
+BYTE_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_byte_range(request: Request, etag: str, size: int):
+    """
+    Parse a single-range Range header for a streamed object.
+    
+    Returns (start, end) inclusive, or None to send the whole object (no Range,
+    a stale If-Range, or a multi-range request).
+    """
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if not range_header or (if_range is not None and if_range != etag):
+        return None
+    
+    match = BYTE_RANGE_PATTERN.match(range_header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(0, size - int(last)), size - 1
+    
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+
+async def stored_file_response(
+    request: Request,
+    key: str,
+    filename: str,
+    media_type: Optional[str] = None,
+    fallback_path: Optional[str] = None
+) -> Optional[Response]:
+    """
+    Serve an object from storage, or return None if it does not exist.
+    
+    Local storage is served from disk. Object storage is redirected to a
+    presigned URL when enabled, otherwise streamed through the API.
+    fallback_path serves files written before they were kept in storage.
+    """
+    path = await asyncio.to_thread(storage.local_path, key)
+    if path is not None:
+        return await local_file_response(request, path, filename, media_type)
+    
+    stored = await asyncio.to_thread(storage.stat, key)
+    if stored is None:
+        if fallback_path and os.path.isfile(fallback_path):
+            return await local_file_response(request, fallback_path, filename, media_type)
+        return None
+    
+    presigned_url = await asyncio.to_thread(storage.presigned_url, key, filename)
+    if presigned_url:
+        return RedirectResponse(presigned_url, status_code=307)
+    
+    headers = cache_headers(f'"{stored.etag}"', stored.modified)
+    if is_not_modified(request, headers["ETag"], stored.modified):
+        return Response(status_code=304, headers=headers)
+    
+    headers["Accept-Ranges"] = "bytes"
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    byte_range = parse_byte_range(request, headers["ETag"], stored.size)
+    if byte_range is None:
+        start, end, status_code = None, None, 200
+        headers["Content-Length"] = str(stored.size)
+    else:
+        (start, end), status_code = byte_range, 206
+        headers["Content-Length"] = str(end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{stored.size}"
+    
+    return StreamingResponse(
+        storage.iter_bytes(key, start, end),
+        status_code=status_code,
+        media_type=media_type or stored.content_type or "application/octet-stream",
+        headers=headers
+    )
+
+
+def local_output_copy(filename: str) -> Optional[str]:
+    """Return a local path of a generated ad, fetching it from storage if needed"""
+    key = output_key(filename)
+    path = storage.local_path(key)
+    if path is not None:
+        return path
+    
+    path = os.path.join(OUTPUT_DIR, filename)
+    if os.path.isfile(path):
+        return path
+    try:
+        return storage.fetch(key, path)
+    except FileNotFoundError:
+        return None
+
+
+@app.get("/download/{filename}")
+async def download_file(request: Request, filename: str, variant: Optional[str] = None):
+    """Download a generated advertisement, or a cached thumb/preview/webp/avif rendition of it"""
+    try:
+        # Only plain file names of generated ads can be served
+        if os.path.basename(filename) != filename or filename.startswith("."):
             raise HTTPException(status_code=404, detail="File not found")
         
-        return FileResponse(
-            path=file_path,
-            filename=filename,
-            media_type='image/jpeg'
+        if variant is None:
+            response = await stored_file_response(
+                request, output_key(filename), filename, fallback_path=os.path.join(OUTPUT_DIR, filename)
+            )
+            if response is None:
+                raise HTTPException(status_code=404, detail="File not found")
+            return response
+        
+        if variant not in available_derivatives():
+            raise HTTPException(
+                status_code=400,
+                detail=f"variant must be one of: {', '.join(available_derivatives())}"
+            )
+        
+        # Renditions are rendered from a local copy and cached on this worker
+        source_path = await asyncio.to_thread(local_output_copy, filename)
+        if source_path is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        file_path = await asyncio.to_thread(get_derivative, source_path, variant, DERIVATIVE_CACHE_DIR)
+        return await local_file_response(
+            request, file_path, os.path.basename(file_path), DERIVATIVES[variant].media_type, variant
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"File download failed: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to download file: {str(e)}")
 
 
+# Live values read on every /metrics scrape
+register_gauge(
+    "adai_job_queue_depth",
+    "Generation jobs waiting for a worker",
+    lambda: job_manager.stats()["queue_depth"]
+)
+register_gauge(
+    "adai_coalesced_flights_in_flight",
+    "Distinct generations shared by coalesced requests",
+    generation_flights.in_flight
+)
+register_gauge(
+    "adai_registry_generations_in_flight",
+    "In-flight generations of all workers in the shared registry",
+    lambda: generation_registry.stats()["in_flight"]
+)
+register_gauge(
+    "adai_circuit_breakers_open",
+    "OpenAI endpoints whose circuit breaker is open",
+    lambda: sum(1 for breaker in circuit_breaker_stats().values() if breaker["state"] == BREAKER_OPEN)
+)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms, OpenAI errors, queue depth, caches and bytes in/out"""
+    payload, content_type = await asyncio.to_thread(render_metrics)
+    return Response(content=payload, media_type=content_type)
+
+
+@app.get("/stats")
+async def get_stats():
+    """Report cache, job queue, rate limiter, circuit breaker, coalescing, prewarm, in-flight generation and cancellation statistics"""
+    result_cache = get_result_cache()
+    return {
+        "result_cache": result_cache.stats() if result_cache is not None else None,
+        "color_cache": get_color_cache().stats(),
+        "jobs": job_manager.stats(),
+        "rate_limits": rate_limiter_stats(),
+        "circuit_breakers": circuit_breaker_stats(),
+        "coalescing": generation_flights.stats(),
+        "prewarm": prewarmer.stats(),
+        "generations": await asyncio.to_thread(generation_registry.stats),
+        "cancellations": cancellation_stats()
+    }
+
+
 @app.delete("/cleanup/{file_id}")
 async def cleanup_files(file_id: str):
     """Clean up temporary files"""
     try:
-        # Clean up uploaded file
-        uploaded_files = [f for f in os.listdir(UPLOAD_DIR) if f.startswith(file_id)]
-        for file in uploaded_files:
-            file_path = os.path.join(UPLOAD_DIR, file)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f"Cleaned up: {file_path}")
+        # Stop speculative work nobody will use
+        if prewarmer.cancel(file_id):
+            logger.info(f"Cancelled prewarm of {file_id}")
+        
+        # Clean up uploaded file (and its blob once no other upload shares it)
+        record = await asyncio.to_thread(upload_index.remove, file_id)
+        if record is not None:
+            # The stored content is shared by every file_id with the same bytes
+            references = await asyncio.to_thread(upload_index.references, record.sha256)
+            shared_copy = storage if references == 0 else None
+            await asyncio.to_thread(release_upload, record.path, UPLOAD_DIR, record.sha256, shared_copy)
         
         return {
             "success": True,
@@ -222,10 +1270,16 @@ async def cleanup_files(file_id: str):
 async def cancel_generation(file_id: str):
     """Cancel an ongoing ad generation"""
     try:
-        if file_id in active_generations:
-            task = active_generations[file_id]
-            task.cancel()
-            del active_generations[file_id]
+        # Flag every request and job for this upload on every worker; shared
+        # generations stop once no request waits for them
+        cancelled = await asyncio.to_thread(generation_registry.request_cancel, file_id=file_id) > 0
+        
+        # Cancel the ones running here right away instead of waiting for the next poll
+        for state in await asyncio.to_thread(generation_registry.for_file, file_id):
+            if state.owner == generation_registry.owner:
+                cancel_local_generation(state.generation_id)
+        
+        if cancelled:
             logger.info(f"Generation cancelled for {file_id}")
             return {
                 "success": True,
@@ -7,12 +7,31 @@ using OpenAI's image editing capabilities.
 Features:
 - Random color selection (1-3 colors) when not specified
 - AI-powered smart color recommendations using computer vision
-- Comprehensive logging throughout the process
+- Offline palette analysis for instant color recommendations
+- Upload preprocessing (orient, downscale, re-encode) to shrink API payloads
+- Comprehensive, non-blocking JSON or text logging with per-request correlation ids
 - Modular function design for easy customization
+- Shared, pooled OpenAI client reused across requests
+- Async generation pipeline built on AsyncOpenAI for high concurrency
+- Background job queue with status polling
+- Batch generation with bounded concurrency and zip archives
+- Multi-variant generation from one prepared upload
+- Per-model OpenAI rate limiting with adaptive concurrency and retries
+- Per-stage deadlines and per-endpoint circuit breakers around OpenAI calls
+- Coalescing of identical in-flight generation requests
+- Cached thumbnail, preview and WEBP/AVIF renditions of generated ads
+- Server-sent generation progress with live partial-image previews
+- Quick low quality drafts re-rendered at final quality from the same prompt
+- Local Pillow/NumPy fallback renderer when the image API is slow or unavailable
+- Speculative preprocessing and color analysis of uploads
+- Content-addressed result cache for repeated generations
+- Streaming, deduplicated uploads resolved through a SQLite file_id index
+- Pluggable storage (sharded local disk or S3-compatible) shared by all workers
+- Shared registry of in-flight generations for cross-worker progress and cancellation
+- Prometheus metrics with per-stage latency histograms
 """
 
 from .ad_generator import (
-    configure_logging,
     load_environment,
     initialize_openai_client,
     create_template_prompt,
@@ -20,17 +39,84 @@ from .ad_generator import (
     edit_image_with_openai,
     process_api_response,
     save_image,
+    save_api_response,
     colors_recommendation,
     get_smart_colors,
+    local_colors_recommendation,
+    validate_color_mode,
+    COLOR_MODE_VISION,
+    COLOR_MODE_LOCAL,
+    COLOR_MODE_HYBRID,
+    COLOR_MODES,
+    resolve_render_options,
+    RENDER_MODE_DRAFT,
+    RENDER_MODE_FINAL,
+    RENDER_MODES,
+    RENDER_PRESETS,
     generate_ad_image,
+    build_vision_messages,
+    parse_color_recommendations,
+    async_edit_image_with_openai,
+    async_stream_image_edit,
+    async_process_api_response,
+    async_save_image,
+    async_save_api_response,
+    async_colors_recommendation,
+    async_get_smart_colors,
+    async_generate_ad_image,
+    generate_ad_variants,
+    async_generate_ad_variants,
+    generate_ads_batch,
+    async_generate_ads_batch,
+    create_ads_archive,
     main
 )
+from .client_manager import (
+    ClientSettings,
+    OpenAIClientManager,
+    get_client_manager,
+    init_client_manager,
+    shutdown_client_manager,
+    async_shutdown_client_manager,
+    get_openai_client,
+    get_async_openai_client
+)
+from .jobs import Job, JobManager, QueueFullError
+from .result_cache import ResultCache, get_result_cache, hash_file, make_cache_key
+from .color_cache import ColorRecommendationCache, get_color_cache
+from .palette import NAMED_COLORS, extract_palette, recommend_colors_local
+from .preprocess import PreparedImage, prepare_image, get_prepared_image
+from .uploads import StoredUpload, UploadRejected, store_upload, release_upload
+from .upload_index import UploadIndex, UploadRecord
+from .coalesce import SingleFlight, request_fingerprint
+from .generation_registry import GenerationRegistry, GenerationState
+from .logging_setup import configure_logging, shutdown_logging, bind_correlation_id, get_correlation_id
+from .prewarm import Prewarmer, PrewarmState
+from .fallback_render import render_fallback_ad, async_render_fallback_ad, shutdown_fallback_pool
+from .metrics import observe_stage, observe_openai_call, register_gauge, render_metrics
+from .storage import Storage, LocalStorage, S3Storage, StoredObject, get_storage, publish_output
+from .derivatives import (
+    DERIVATIVES,
+    PARTIAL_PREVIEW,
+    detect_media_type,
+    get_derivative,
+    available_derivatives,
+    render_partial_preview,
+)
+from .outputs import SavedImage, write_base64_image
+from .cancellation import GenerationCancelled, StageTracker, cancellation_stats
+from .rate_limit import ModelRateLimiter, RateLimitExceeded, get_rate_limiter, rate_limiter_stats
+from .circuit_breaker import CircuitBreaker, CircuitOpen, get_circuit_breaker, circuit_breaker_stats
+from .deadlines import Deadline, DeadlineExceeded, stage_deadline
 
 __version__ = "1.2.0"
 __author__ = "AD-AI Team"
 
 __all__ = [
     "configure_logging",
+    "shutdown_logging",
+    "bind_correlation_id",
+    "get_correlation_id",
     "load_environment", 
     "initialize_openai_client",
     "create_template_prompt",
@@ -38,8 +124,105 @@ __all__ = [
     "edit_image_with_openai",
     "process_api_response",
     "save_image",
+    "save_api_response",
     "colors_recommendation",
     "get_smart_colors",
+    "local_colors_recommendation",
+    "validate_color_mode",
+    "COLOR_MODE_VISION",
+    "COLOR_MODE_LOCAL",
+    "COLOR_MODE_HYBRID",
+    "COLOR_MODES",
+    "resolve_render_options",
+    "RENDER_MODE_DRAFT",
+    "RENDER_MODE_FINAL",
+    "RENDER_MODES",
+    "RENDER_PRESETS",
     "generate_ad_image",
-    "main"
+    "build_vision_messages",
+    "parse_color_recommendations",
+    "async_edit_image_with_openai",
+    "async_stream_image_edit",
+    "async_process_api_response",
+    "async_save_image",
+    "async_save_api_response",
+    "async_colors_recommendation",
+    "async_get_smart_colors",
+    "async_generate_ad_image",
+    "generate_ad_variants",
+    "async_generate_ad_variants",
+    "generate_ads_batch",
+    "async_generate_ads_batch",
+    "create_ads_archive",
+    "main",
+    "ClientSettings",
+    "OpenAIClientManager",
+    "get_client_manager",
+    "init_client_manager",
+    "shutdown_client_manager",
+    "async_shutdown_client_manager",
+    "get_openai_client",
+    "get_async_openai_client",
+    "Job",
+    "JobManager",
+    "QueueFullError",
+    "ResultCache",
+    "get_result_cache",
+    "hash_file",
+    "make_cache_key",
+    "ColorRecommendationCache",
+    "get_color_cache",
+    "NAMED_COLORS",
+    "extract_palette",
+    "recommend_colors_local",
+    "PreparedImage",
+    "prepare_image",
+    "get_prepared_image",
+    "StoredUpload",
+    "UploadRejected",
+    "UploadIndex",
+    "UploadRecord",
+    "GenerationRegistry",
+    "GenerationState",
+    "Prewarmer",
+    "PrewarmState",
+    "render_fallback_ad",
+    "async_render_fallback_ad",
+    "shutdown_fallback_pool",
+    "observe_stage",
+    "observe_openai_call",
+    "register_gauge",
+    "render_metrics",
+    "Storage",
+    "LocalStorage",
+    "S3Storage",
+    "StoredObject",
+    "get_storage",
+    "publish_output",
+    "DERIVATIVES",
+    "detect_media_type",
+    "get_derivative",
+    "available_derivatives",
+    "PARTIAL_PREVIEW",
+    "render_partial_preview",
+    "SavedImage",
+    "write_base64_image",
+    "GenerationCancelled",
+    "StageTracker",
+    "cancellation_stats",
+    "SingleFlight",
+    "request_fingerprint",
+    "ModelRateLimiter",
+    "RateLimitExceeded",
+    "get_rate_limiter",
+    "rate_limiter_stats",
+    "CircuitBreaker",
+    "CircuitOpen",
+    "get_circuit_breaker",
+    "circuit_breaker_stats",
+    "Deadline",
+    "DeadlineExceeded",
+    "stage_deadline",
+    "store_upload",
+    "release_upload"
 ] 
\ No newline at end of file
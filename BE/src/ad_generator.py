@@ -1,26 +1,91 @@
+import asyncio
 import base64
+import contextvars
+import functools
+import json
 import logging
+import mimetypes
 import os
 import time
 import random
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import anyio
+import openai
 from openai import OpenAI
+from openai.types import Image, ImagesResponse
 from dotenv import load_dotenv
 
+from .client_manager import get_openai_client, get_async_openai_client
+from .result_cache import get_result_cache, make_cache_key
+from .color_cache import get_color_cache
+from .palette import NAMED_COLORS, recommend_colors_local
+from .preprocess import get_prepared_image
+from .rate_limit import RateLimitExceeded, get_rate_limiter, call_with_rate_limit, async_call_with_rate_limit
+from .circuit_breaker import CircuitOpen, get_circuit_breaker
+from .deadlines import DeadlineExceeded, STAGE_COLORS, STAGE_EDIT, stage_deadline
+from .cancellation import GenerationCancelled, StageTracker
+from .outputs import write_base64_image
+from .storage import publish_output
+from .derivatives import render_partial_preview
+from .fallback_render import async_render_fallback_ad, render_fallback_ad_in_pool
+from .metrics import observe_stage, record_bytes_received, record_bytes_sent
+from .logging_setup import configure_logging, bind_correlation_id, reset_correlation_id
 
-def configure_logging():
-    """Configure logging for the application."""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('ad_ai.log'),
-            logging.StreamHandler()
-        ]
-    )
-    
-    logger = logging.getLogger(__name__)
-    logger.info("Logging configured successfully")
-    return logger
+IMAGE_MODEL = "gpt-image-1"
+VISION_MODEL = "gpt-4o"
+DEFAULT_RECOMMENDED_COLORS = ["electric blue", "sunset orange", "deep purple"]
+FALLBACK_COLORS = ["electric blue", "hot pink", "golden yellow"]
+
+# Smart color modes: gpt-4o vision, offline palette analysis, or local first with vision fallback
+COLOR_MODE_VISION = "vision"
+COLOR_MODE_LOCAL = "local"
+COLOR_MODE_HYBRID = "hybrid"
+COLOR_MODES = (COLOR_MODE_VISION, COLOR_MODE_LOCAL, COLOR_MODE_HYBRID)
+
+# Default number of generations a batch runs at the same time
+DEFAULT_BATCH_CONCURRENCY = 4
+# Most images a single images.edit call can return
+MAX_VARIANTS = 10
+# Partial images requested for live previews when a caller wants them (0-3, each costs extra output tokens)
+PARTIAL_IMAGES = min(max(int(os.getenv("OPENAI_PARTIAL_IMAGES", "2")), 0), 3)
+
+# Local fallback renderer, used when the image API is too slow or unavailable
+FALLBACK_ENABLED = os.getenv("FALLBACK_ENABLED", "true").lower() not in ("0", "false", "no")
+
+# Errors meaning an OpenAI endpoint is unhealthy or out of time, rather than the request being wrong
+UPSTREAM_UNAVAILABLE_ERRORS = (
+    CircuitOpen,
+    DeadlineExceeded,
+    RateLimitExceeded,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+# Render settings accepted by the image model
+IMAGE_QUALITIES = ("low", "medium", "high", "auto")
+IMAGE_SIZES = ("1024x1024", "1536x1024", "1024x1536", "auto")
+OUTPUT_FORMATS = ("png", "jpeg", "webp")
+OUTPUT_EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+
+# Render modes: a quick, cheap draft to judge the concept, then the final render of the chosen draft
+RENDER_MODE_DRAFT = "draft"
+RENDER_MODE_FINAL = "final"
+RENDER_MODES = (RENDER_MODE_DRAFT, RENDER_MODE_FINAL)
+RENDER_PRESETS = {
+    RENDER_MODE_DRAFT: {
+        "quality": os.getenv("DRAFT_QUALITY", "low"),
+        "size": os.getenv("DRAFT_SIZE", "1024x1024"),
+        "output_format": os.getenv("DRAFT_OUTPUT_FORMAT", "jpeg"),
+    },
+    RENDER_MODE_FINAL: {
+        "quality": os.getenv("FINAL_QUALITY", "high"),
+        "size": os.getenv("FINAL_SIZE", "1024x1024"),
+        "output_format": os.getenv("FINAL_OUTPUT_FORMAT", "png"),
+    },
+}
 
 
 def load_environment():
@@ -62,26 +127,21 @@ def create_template_prompt(product_name, brand_name, number_of_colors=None, colo
     """Create the template prompt for image generation."""
     logger = logging.getLogger(__name__)
     
-    logger.info("Creating template prompt...")
+    logger.debug("Creating template prompt...")
     
     # Randomly select number of colors if not provided (1-3)
     if number_of_colors is None:
         number_of_colors = random.randint(1, 3)
-        logger.info(f"Randomly selected number of colors: {number_of_colors}")
+        logger.debug("Randomly selected number of colors: %s", number_of_colors)
     
     # Define a list of vibrant colors to choose from
-    # color_options = [
-    #     "electric blue", "neon green", "hot pink", "bright orange", "deep purple",
-    #     "crimson red", "golden yellow", "turquoise", "magenta", "lime green",
-    #     "coral", "royal blue", "emerald green", "sunset orange", "violet",
-    #     "teal", "ruby red", "amber", "indigo", "chartreuse"
-    # ]
+    color_options = list(NAMED_COLORS)
     
     # Randomly select colors if not provided
     if colors is None:
         selected_colors = random.sample(color_options, number_of_colors)
         colors = ", ".join(selected_colors)
-        logger.info(f"Randomly selected colors: {colors}")
+        logger.debug("Randomly selected colors: %s", colors)
     elif isinstance(colors, list):
         colors = ", ".join(colors)
     
@@ -99,39 +159,128 @@ Add the real logo clearly and integrate a short 3–4 word slogan at the bottom.
 Style: surreal, high-resolution, minimal, cinematic lighting, 1:1 aspect ratio.
 """
     logger.info(f"Template prompt created with {number_of_colors} colors: {colors}")
-    logger.info(f"Template prompt preview: {template_prompt[:100]}...")
+    logger.debug("Template prompt preview: %.100s...", template_prompt)
     return template_prompt
 
 
+def resolve_prompt_colors(number_of_colors=None, colors=None):
+    """
+    Pick the colors of a prompt up front, so a result records exactly what was rendered.
+    
+    Args:
+        number_of_colors (int, optional): Number of colors (1-3). Defaults to the number of
+            colors given, or a random count.
+        colors (str or list, optional): Colors to use. If None, randomly selected.
+        
+    Returns:
+        tuple: (number_of_colors, list of colors)
+    """
+    if isinstance(colors, str):
+        colors = [color.strip() for color in colors.split(",") if color.strip()]
+    if colors:
+        return number_of_colors or len(colors), list(colors)
+    
+    if number_of_colors is None:
+        number_of_colors = random.randint(1, 3)
+    return number_of_colors, random.sample(list(NAMED_COLORS), number_of_colors)
+
+
+def resolve_render_options(mode=None, quality=None, size=None, output_format=None):
+    """
+    Resolve the image model settings of a generation.
+    
+    Settings given explicitly override the preset of the mode; settings left
+    unset use the model's defaults.
+    
+    Args:
+        mode (str, optional): "draft" or "final" (see RENDER_PRESETS)
+        quality (str, optional): Rendering quality, one of IMAGE_QUALITIES
+        size (str, optional): Output size, one of IMAGE_SIZES
+        output_format (str, optional): Output format, one of OUTPUT_FORMATS
+        
+    Returns:
+        dict: The settings to pass to images.edit
+        
+    Raises:
+        ValueError: If a mode or setting is not supported
+    """
+    if mode is not None and mode not in RENDER_MODES:
+        raise ValueError(f"Invalid render mode '{mode}', expected one of: {', '.join(RENDER_MODES)}")
+    
+    options = dict(RENDER_PRESETS[mode]) if mode else {}
+    for name, value, allowed in (
+        ("quality", quality, IMAGE_QUALITIES),
+        ("size", size, IMAGE_SIZES),
+        ("output_format", output_format, OUTPUT_FORMATS),
+    ):
+        if value is not None:
+            options[name] = value
+        if name in options and options[name] not in allowed:
+            raise ValueError(f"Invalid {name} '{options[name]}', expected one of: {', '.join(allowed)}")
+    return options
+
+
+def describe_render(mode, render, response=None):
+    """Record the render settings of a generation, preferring those reported by the API."""
+    described = {"mode": mode}
+    for name in ("quality", "size", "output_format"):
+        described[name] = getattr(response, name, None) or render.get(name)
+    return described
+
+
+def should_fall_back(error):
+    """Return True if a failed image edit should be replaced by the local renderer."""
+    return FALLBACK_ENABLED and isinstance(error, UPSTREAM_UNAVAILABLE_ERRORS)
+
+
 def validate_image_file(image_path):
     """Validate that the input image file exists and is accessible."""
     logger = logging.getLogger(__name__)
     
-    logger.info(f"Checking if image file exists: {image_path}")
+    logger.debug("Checking if image file exists: %s", image_path)
     if not os.path.exists(image_path):
         logger.error(f"Image file not found: {image_path}")
         raise FileNotFoundError(f"Image file not found: {image_path}")
     
     file_size = os.path.getsize(image_path)
-    logger.info(f"Image file found, size: {file_size} bytes")
+    logger.debug("Image file found, size: %d bytes", file_size)
     return file_size
 
 
-def edit_image_with_openai(client, image_path, prompt):
-    """Call OpenAI API to edit the image."""
+def edit_image_with_openai(client, image_path, prompt, n=1, render=None, deadline=None):
+    """Call OpenAI API to edit the image, returning n images.
+
+    render holds quality, size and output_format settings (see resolve_render_options).
+    deadline (a Deadline, by default the "edit" stage deadline starting now)
+    bounds every attempt by the time left, raising DeadlineExceeded once it
+    has passed.
+    """
     logger = logging.getLogger(__name__)
     
     try:
-        logger.info("Calling OpenAI image edit API...")
+        logger.info(f"Calling OpenAI image edit API for {n} image(s)...")
         start_time = time.time()
+        if deadline is None:
+            deadline = stage_deadline(STAGE_EDIT)
         
-        result = client.images.edit(
-            model="gpt-image-1",
-            image=[
-                open(image_path, "rb"),
-            ],
-            prompt=prompt
-        )
+        with open(image_path, "rb") as image_file:
+            def call():
+                # Retries re-send the whole file
+                image_file.seek(0)
+                return client.with_options(max_retries=0, **deadline.client_options()).images.edit(
+                    model=IMAGE_MODEL,
+                    image=[
+                        image_file,
+                    ],
+                    prompt=prompt,
+                    n=n,
+                    **(render or {})
+                )
+            
+            record_bytes_sent("openai", os.path.getsize(image_path))
+            result = call_with_rate_limit(
+                image_rate_limiter(), call, images=n, breaker=image_breaker(), deadline=deadline
+            )
         
         end_time = time.time()
         logger.info(f"OpenAI API call completed successfully in {end_time - start_time:.2f} seconds")
@@ -143,31 +292,75 @@ def edit_image_with_openai(client, image_path, prompt):
 
 
 def process_api_response(result):
-    """Process the API response and decode the image data."""
+    """Process the API response and decode every image it contains, in order."""
     logger = logging.getLogger(__name__)
     
     try:
-        logger.info("Processing API response...")
-        image_base64 = result.data[0].b64_json
-        logger.info(f"Received base64 image data, length: {len(image_base64)} characters")
-        
-        logger.info("Decoding base64 image data...")
-        image_bytes = base64.b64decode(image_base64)
-        logger.info(f"Decoded image size: {len(image_bytes)} bytes")
+        logger.debug("Processing API response with %d image(s)...", len(result.data))
+        images = []
+        for image in result.data:
+            image_base64 = image.b64_json
+            logger.debug("Received base64 image data, length: %d characters", len(image_base64))
+            
+            image_bytes = base64.b64decode(image_base64)
+            logger.debug("Decoded image size: %d bytes", len(image_bytes))
+            images.append(image_bytes)
         
-        return image_bytes
+        if not images:
+            raise ValueError("API response contained no images")
+        return images
         
     except Exception as e:
         logger.error(f"Failed to process API response: {e}")
         raise
 
 
+def save_api_response(result, output_filenames, cancel_event=None):
+    """
+    Stream every image of an API response into its output file.
+    
+    Unlike process_api_response followed by save_image, the decoded images
+    are never held in memory as a whole; each file appears atomically.
+    
+    Args:
+        result: Response of an images API call
+        output_filenames (list): Output path for each image, in order
+        cancel_event (threading.Event, optional): When set, remaining writes are abandoned
+        
+    Returns:
+        list: SavedImage for each image written
+    """
+    logger = logging.getLogger(__name__)
+    
+    try:
+        logger.info(f"Streaming {len(result.data)} image(s) from API response to disk...")
+        if not result.data:
+            raise ValueError("API response contained no images")
+        if len(result.data) < len(output_filenames):
+            logger.warning(f"Requested {len(output_filenames)} images but received {len(result.data)}")
+        
+        saved_images = [
+            write_base64_image(image.b64_json, output_filename, cancel_event)
+            for image, output_filename in zip(result.data, output_filenames)
+        ]
+        record_bytes_received("openai", sum(saved.size for saved in saved_images))
+        for saved in saved_images:
+            publish_output(saved.path)
+        return saved_images
+        
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to save API response: {e}")
+        raise
+
+
 def save_image(image_bytes, output_filename):
     """Save the processed image to a file."""
     logger = logging.getLogger(__name__)
     
     try:
-        logger.info(f"Saving image to file: {output_filename}")
+        logger.debug("Saving image to file: %s", output_filename)
         with open(output_filename, "wb") as f:
             f.write(image_bytes)
         
@@ -175,6 +368,7 @@ def save_image(image_bytes, output_filename):
         if os.path.exists(output_filename):
             file_size = os.path.getsize(output_filename)
             logger.info(f"Image saved successfully: {output_filename} ({file_size} bytes)")
+            publish_output(output_filename)
             return file_size
         else:
             logger.error(f"Failed to create output file: {output_filename}")
@@ -188,10 +382,20 @@ def save_image(image_bytes, output_filename):
 def generate_ad_image(product_name="perfume", brand_name="FROM INDEXES", 
                      image_path="images/28a42a6d609f4c9aab116d92057b3367-goods.webp", 
                      output_filename="gift-basket.webp", number_of_colors=None, colors=None,
-                     use_smart_colors=False):
+                     use_smart_colors=False, client=None, progress_callback=None, use_cache=True,
+                     color_mode=COLOR_MODE_VISION, cancel_event=None, correlation_id=None,
+                     mode=None, quality=None, size=None, output_format=None):
     """
     Main function to generate an advertisement image.
     
+    mode="draft" renders a quick low quality image to judge the concept; calling
+    again with mode="final" and the draft's colors_used and number_of_colors
+    re-renders it at high quality from the same prompt.
+    
+    If the image edit outlives its deadline or the API is unavailable,
+    the ad is composited locally instead (see fallback_render) and the result
+    has fallback set.
+    
     Args:
         product_name (str): Name of the product
         brand_name (str): Name of the brand
@@ -200,24 +404,41 @@ def generate_ad_image(product_name="perfume", brand_name="FROM INDEXES",
         number_of_colors (int, optional): Number of colors to use (1-3). If None, randomly selected.
         colors (str or list, optional): Colors to use. If None, randomly selected.
         use_smart_colors (bool): If True, uses AI vision to recommend colors based on the product image
+        client (OpenAI, optional): Client to use. Defaults to the shared pooled client.
+        progress_callback (callable, optional): Called with the name of each pipeline stage
+        use_cache (bool): If True, identical requests are served from the result cache
+        color_mode (str): Smart color mode: "vision", "local" or "hybrid" (see get_smart_colors)
+        cancel_event (threading.Event, optional): When set, the generation stops at the next stage
+        correlation_id (str, optional): Id tagging this generation's log records; defaults to
+            the id of the calling request, or a new one
+        mode (str, optional): Render preset, "draft" or "final" (see RENDER_PRESETS)
+        quality (str, optional): Rendering quality, overrides the preset of mode
+        size (str, optional): Output size, overrides the preset of mode
+        output_format (str, optional): "png", "jpeg" or "webp", overrides the preset of mode
         
     Returns:
         str: Path to the generated image file
     """
     logger = logging.getLogger(__name__)
+    correlation_token = bind_correlation_id(correlation_id)
+    stages = StageTracker(progress_callback, cancel_event)
     
     try:
         logger.info("Starting AD image generation process...")
         logger.info(f"Product: {product_name}, Brand: {brand_name}")
+        render = resolve_render_options(mode, quality, size, output_format)
         
-        # Load environment and initialize client
-        api_key = load_environment()
-        client = initialize_openai_client(api_key)
+        # Reuse the shared pooled client unless one was passed in
+        if client is None:
+            client = get_openai_client()
         
         # Get smart color recommendations if requested
         if use_smart_colors and colors is None:
+            stages.enter("colors")
             logger.info("Using smart color recommendations based on product image...")
-            smart_num_colors, smart_colors = get_smart_colors(product_name, image_path)
+            smart_num_colors, smart_colors = get_smart_colors(
+                product_name, image_path, client=client, color_mode=color_mode
+            )
             if smart_colors:
                 number_of_colors = smart_num_colors
                 colors = smart_colors
@@ -226,58 +447,371 @@ def generate_ad_image(product_name="perfume", brand_name="FROM INDEXES",
                 logger.info("Smart color recommendation failed, using random selection")
         
         # Create prompt and validate input
+        stages.enter("prompt")
+        number_of_colors, colors = resolve_prompt_colors(number_of_colors, colors)
         prompt = create_template_prompt(product_name, brand_name, number_of_colors, colors)
+        stages.enter("validate")
         validate_image_file(image_path)
         
-        # Generate the image
-        result = edit_image_with_openai(client, image_path, prompt)
-        image_bytes = process_api_response(result)
-        save_image(image_bytes, output_filename)
+        # Downscale and re-encode the upload once for the API
+        stages.enter("preprocess")
+        prepared = get_prepared_image(image_path)
+        
+        # Serve identical requests straight from the result cache
+        cache_key = None
+        if use_cache:
+            cache_key, cache_hit = lookup_cached_result(
+                prepared.source_hash, prompt, output_filename, render=render
+            )
+            if cache_hit:
+                return build_generation_result(
+                    output_filename, colors, number_of_colors, cache_hit=True, render=describe_render(mode, render)
+                )
+        
+        # Generate the image, or render it locally if the API is too slow or unavailable
+        stages.enter("edit")
+        try:
+            result = edit_image_with_openai(client, prepared.edit_path, prompt, render=render)
+        except Exception as e:
+            if not should_fall_back(e):
+                raise
+            logger.warning(f"Image API unavailable ({str(e) or type(e).__name__}), rendering the ad locally")
+            stages.enter("fallback")
+            stages.fell_back()
+            saved = render_fallback_ad_in_pool(
+                prepared.edit_path, output_filename, product_name, brand_name, colors, render.get("size")
+            )
+            publish_output(output_filename)
+            return build_generation_result(
+                output_filename, colors, number_of_colors, saved=saved, render=describe_render(mode, render),
+                fallback=True
+            )
+        stages.enter("save")
+        saved = save_api_response(result, [output_filename], cancel_event)[0]
+        store_cached_result(cache_key, output_filename)
         
         logger.info("AD image generation completed successfully")
         
-        # Return both the filename and the colors used
-        return {
-            "output_filename": output_filename,
-            "colors_used": colors if colors else [],
-            "number_of_colors": number_of_colors if number_of_colors else 0
-        }
+        # Return the filename, the colors used and the render settings
+        return build_generation_result(
+            output_filename, colors, number_of_colors, saved=saved, render=describe_render(mode, render, result)
+        )
         
+    except GenerationCancelled:
+        stages.cancelled()
+        raise
     except Exception as e:
+        stages.failed()
         logger.error(f"AD image generation failed: {e}")
         raise
+    finally:
+        stages.close()
+        reset_correlation_id(correlation_token)
 
 
-def colors_recommendation(product_name, image_path):
+def validate_variant_request(output_filenames, color_variants=None):
+    """Check that a variants request is well formed before any work is done."""
+    if not output_filenames:
+        raise ValueError("At least one variant output filename is required")
+    if color_variants is None and len(output_filenames) > MAX_VARIANTS:
+        raise ValueError(f"At most {MAX_VARIANTS} variants can share one prompt")
+    if color_variants is not None:
+        if len(color_variants) != len(output_filenames):
+            raise ValueError("color_variants must have one entry per output filename")
+        if any(not variant_colors for variant_colors in color_variants):
+            raise ValueError("Every color variant needs at least one color")
+
+
+def render_fallback_variants(stages, error, prepared, output_filenames, product_name, brand_name, colors,
+                             number_of_colors):
+    """Render variants locally after their image edit failed with error, returning their results."""
+    logging.getLogger(__name__).warning(
+        f"Image API unavailable ({str(error) or type(error).__name__}), rendering {len(output_filenames)} "
+        f"AD variant(s) locally"
+    )
+    stages.enter("fallback")
+    stages.fell_back()
+    results = []
+    for output_filename in output_filenames:
+        saved = render_fallback_ad_in_pool(prepared.edit_path, output_filename, product_name, brand_name, colors)
+        publish_output(output_filename)
+        results.append(build_generation_result(
+            output_filename, colors, number_of_colors, saved=saved, fallback=True
+        ))
+    return results
+
+
+async def async_render_fallback_variants(stages, error, prepared, output_filenames, product_name, brand_name,
+                                         colors, number_of_colors):
+    """Async version of render_fallback_variants; the renders run in the process pool side by side."""
+    logging.getLogger(__name__).warning(
+        f"Image API unavailable ({str(error) or type(error).__name__}), rendering {len(output_filenames)} "
+        f"AD variant(s) locally"
+    )
+    stages.enter("fallback")
+    stages.fell_back()
+    saved_images = await asyncio.gather(*(
+        async_render_fallback_ad(prepared.edit_path, output_filename, product_name, brand_name, colors)
+        for output_filename in output_filenames
+    ))
+    results = []
+    for output_filename, saved in zip(output_filenames, saved_images):
+        await anyio.to_thread.run_sync(publish_output, output_filename)
+        results.append(build_generation_result(
+            output_filename, colors, number_of_colors, saved=saved, fallback=True
+        ))
+    return results
+
+
+def generate_ad_variants(product_name, brand_name, image_path, output_filenames,
+                         color_variants=None, number_of_colors=None, colors=None,
+                         use_smart_colors=False, client=None, progress_callback=None,
+                         use_cache=True, color_mode=COLOR_MODE_VISION, cancel_event=None,
+                         correlation_id=None):
     """
-    Recommend 3 colors for the product by analyzing the image.
+    Generate several advertisement variants of one product.
+    
+    The upload is validated and preprocessed once for all variants. Without
+    color_variants every variant shares one prompt, and all of them come back
+    from a single images.edit call using n. With color_variants each colorway
+    gets its own prompt and API call, reusing the prepared upload. Variants
+    whose image edit is too slow or unavailable are composited locally
+    instead (see fallback_render) and have fallback set.
     
     Args:
-        product_name (str): Name of the product for context
-        image_path (str): Path to the product image
+        product_name (str): Name of the product
+        brand_name (str): Name of the brand
+        image_path (str): Path to the input image
+        output_filenames (list): One output path per variant
+        color_variants (list, optional): One list of colors per variant
+        number_of_colors (int, optional): Number of colors for a shared prompt (1-3)
+        colors (str or list, optional): Colors for a shared prompt
+        use_smart_colors (bool): If True, a shared prompt uses recommended colors
+        client (OpenAI, optional): Client to use. Defaults to the shared pooled client.
+        progress_callback (callable, optional): Called with the name of each pipeline stage
+        use_cache (bool): If True, identical requests are served from the result cache
+        color_mode (str): Smart color mode: "vision", "local" or "hybrid" (see get_smart_colors)
+        cancel_event (threading.Event, optional): When set, the generation stops at the next stage
+        correlation_id (str, optional): Id tagging this generation's log records; defaults to
+            the id of the calling request, or a new one
         
     Returns:
-        list: List of 3 recommended color names
+        list: One result dict (as returned by generate_ad_image) per variant
     """
     logger = logging.getLogger(__name__)
+    correlation_token = bind_correlation_id(correlation_id)
+    edit_calls = 1 if color_variants is None else len(color_variants)
+    stages = StageTracker(progress_callback, cancel_event, edit_calls=edit_calls)
     
     try:
-        logger.info(f"Analyzing image to recommend colors for {product_name}...")
+        validate_variant_request(output_filenames, color_variants)
+        logger.info(f"Starting generation of {len(output_filenames)} AD variants...")
+        logger.info(f"Product: {product_name}, Brand: {brand_name}")
         
-        # Validate image file exists
+        if client is None:
+            client = get_openai_client()
+        
+        if color_variants is None and use_smart_colors and colors is None:
+            stages.enter("colors")
+            smart_num_colors, smart_colors = get_smart_colors(
+                product_name, image_path, client=client, color_mode=color_mode
+            )
+            if smart_colors:
+                number_of_colors, colors = smart_num_colors, smart_colors
+                logger.info(f"Smart colors recommended: {colors}")
+        
+        stages.enter("validate")
         validate_image_file(image_path)
+        stages.enter("preprocess")
+        prepared = get_prepared_image(image_path)
         
-        # Load environment and initialize client
-        api_key = load_environment()
-        client = initialize_openai_client(api_key)
+        if color_variants is None:
+            stages.enter("prompt")
+            number_of_colors, colors = resolve_prompt_colors(number_of_colors, colors)
+            prompt = create_template_prompt(product_name, brand_name, number_of_colors, colors)
+            
+            n = len(output_filenames)
+            lookups = [
+                lookup_cached_result(prepared.source_hash, prompt, output_filename, variant=(index, n))
+                if use_cache else (None, False)
+                for index, output_filename in enumerate(output_filenames)
+            ]
+            if all(hit for _, hit in lookups):
+                return [build_generation_result(output_filename, colors, number_of_colors, cache_hit=True)
+                        for output_filename in output_filenames]
+            
+            stages.enter("edit")
+            try:
+                result = edit_image_with_openai(client, prepared.edit_path, prompt, n=n)
+            except Exception as e:
+                if not should_fall_back(e):
+                    raise
+                return render_fallback_variants(
+                    stages, e, prepared, output_filenames, product_name, brand_name, colors, number_of_colors
+                )
+            stages.enter("save")
+            results = []
+            for saved, (cache_key, _) in zip(save_api_response(result, output_filenames, cancel_event), lookups):
+                store_cached_result(cache_key, saved.path)
+                results.append(build_generation_result(saved.path, colors, number_of_colors, saved=saved))
+        else:
+            results = []
+            for variant_colors, output_filename in zip(color_variants, output_filenames):
+                stages.enter("prompt")
+                prompt = create_template_prompt(product_name, brand_name, len(variant_colors), variant_colors)
+                
+                cache_key = None
+                if use_cache:
+                    cache_key, cache_hit = lookup_cached_result(prepared.source_hash, prompt, output_filename)
+                    if cache_hit:
+                        results.append(build_generation_result(
+                            output_filename, variant_colors, len(variant_colors), cache_hit=True
+                        ))
+                        continue
+                
+                stages.enter("edit")
+                try:
+                    result = edit_image_with_openai(client, prepared.edit_path, prompt)
+                except Exception as e:
+                    if not should_fall_back(e):
+                        raise
+                    results.extend(render_fallback_variants(
+                        stages, e, prepared, [output_filename], product_name, brand_name, variant_colors,
+                        len(variant_colors)
+                    ))
+                    continue
+                stages.enter("save")
+                saved = save_api_response(result, [output_filename], cancel_event)[0]
+                store_cached_result(cache_key, output_filename)
+                results.append(build_generation_result(
+                    output_filename, variant_colors, len(variant_colors), saved=saved
+                ))
         
-        # Encode image to base64
-        logger.info("Encoding image to base64 for vision analysis...")
-        with open(image_path, "rb") as image_file:
-            image_data = base64.b64encode(image_file.read()).decode('utf-8')
+        logger.info(f"Generated {len(results)} AD variants successfully")
+        return results
         
-        # Create vision prompt
-        vision_prompt = f"""
+    except GenerationCancelled:
+        stages.cancelled()
+        raise
+    except Exception as e:
+        stages.failed()
+        logger.error(f"AD variant generation failed: {e}")
+        raise
+    finally:
+        stages.close()
+        reset_correlation_id(correlation_token)
+
+
+def image_rate_limiter():
+    """Return the shared limiter of the image model (OPENAI_IMAGE_* settings)."""
+    return get_rate_limiter(IMAGE_MODEL, "OPENAI_IMAGE")
+
+
+def vision_rate_limiter():
+    """Return the shared limiter of the vision model (OPENAI_VISION_* settings)."""
+    return get_rate_limiter(VISION_MODEL, "OPENAI_VISION")
+
+
+def image_breaker():
+    """Return the shared circuit breaker of the image edit endpoint."""
+    return get_circuit_breaker(f"{IMAGE_MODEL} images.edit")
+
+
+def vision_breaker():
+    """Return the shared circuit breaker of the vision chat completions endpoint."""
+    return get_circuit_breaker(f"{VISION_MODEL} chat.completions")
+
+
+def image_model_params(render=None):
+    """Return the image model parameters that determine a generation's output."""
+    return {"model": IMAGE_MODEL, **(render or {})}
+
+
+def build_generation_result(output_filename, colors, number_of_colors, cache_hit=False, saved=None, render=None,
+                            fallback=False):
+    """Build the dict returned by the generation functions."""
+    result = {
+        "output_filename": output_filename,
+        "colors_used": colors if colors else [],
+        "number_of_colors": number_of_colors if number_of_colors else 0,
+        "cache_hit": cache_hit,
+        "fallback": fallback
+    }
+    if saved is not None:
+        result["output_size"] = saved.size
+        result["output_sha256"] = saved.sha256
+    if render is not None:
+        result["render"] = render
+    return result
+
+
+def lookup_cached_result(image_hash, prompt, output_filename, variant=None, render=None):
+    """
+    Check the result cache for an identical generation.
+    
+    Args:
+        image_hash (str): SHA-256 of the input image bytes
+        prompt (str): Final prompt for the image model
+        output_filename (str): Where to place the cached image on a hit
+        variant (tuple, optional): (index, n) of an image from a multi-image call
+        render (dict, optional): Render settings of the generation (see resolve_render_options)
+        
+    Returns:
+        tuple: (cache_key, hit). cache_key is None when caching is disabled.
+    """
+    logger = logging.getLogger(__name__)
+    
+    cache = get_result_cache()
+    if cache is None:
+        return None, False
+    
+    model_params = image_model_params(render)
+    if variant is not None:
+        model_params["variant"] = list(variant)
+    cache_key = make_cache_key(image_hash, prompt, model_params)
+    hit = cache.copy_to(cache_key, output_filename)
+    if hit:
+        logger.info(f"Result cache hit for {cache_key[:12]}, skipping image generation")
+        publish_output(output_filename)
+    return cache_key, hit
+
+
+def store_cached_result(cache_key, output_filename):
+    """Store a freshly generated image in the result cache, never failing the generation."""
+    logger = logging.getLogger(__name__)
+    
+    cache = get_result_cache()
+    if cache is None or cache_key is None:
+        return
+    try:
+        cache.put(cache_key, output_filename)
+    except Exception as e:
+        logger.warning(f"Failed to cache generated image: {e}")
+
+
+def report_progress(progress_callback, stage):
+    """Notify a progress callback of a pipeline stage, ignoring callback errors."""
+    if progress_callback is None:
+        return
+    try:
+        progress_callback(stage)
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Progress callback failed at stage {stage}: {e}")
+
+
+def build_vision_messages(product_name, image_data, mime_type="image/jpeg"):
+    """
+    Build the chat messages for the color recommendation vision call.
+    
+    Args:
+        product_name (str): Name of the product for context
+        image_data (str): Base64-encoded image
+        mime_type (str): MIME type of the encoded image
+        
+    Returns:
+        list: Messages for client.chat.completions.create
+    """
+    vision_prompt = f"""
         Analyze this image of a {product_name} and recommend exactly 3 colors that would work best for creating an eye-catching advertisement.
 
         Consider:
@@ -291,82 +825,206 @@ def colors_recommendation(product_name, image_path):
 
         Focus on bold, vibrant colors that would work well for advertising purposes.
         """
+    
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": vision_prompt
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{image_data}"
+                    }
+                }
+            ]
+        }
+    ]
+
+
+def parse_color_recommendations(colors_text):
+    """
+    Parse the vision model's reply into exactly 3 color names.
+    
+    Args:
+        colors_text (str): Raw comma-separated reply
+        
+    Returns:
+        list: List of 3 color names
+    """
+    logger = logging.getLogger(__name__)
+    
+    colors_text = colors_text.strip()
+    logger.debug("Raw color recommendations: %s", colors_text)
+    
+    # Parse colors from the response
+    colors = [color.strip() for color in colors_text.split(',')]
+    
+    # Ensure we have exactly 3 colors
+    if len(colors) < 3:
+        logger.warning(f"Only received {len(colors)} colors, padding with defaults")
+        colors.extend(DEFAULT_RECOMMENDED_COLORS[len(colors):3])
+    elif len(colors) > 3:
+        logger.debug("Received %d colors, taking first 3", len(colors))
+        colors = colors[:3]
+    
+    return colors
+
+
+def colors_recommendation(product_name, image_path, client=None, use_cache=True):
+    """
+    Recommend 3 colors for the product by analyzing the image.
+    
+    Recommendations are cached per image fingerprint and product name, so
+    repeated calls for the same upload only pay for one vision call. The call
+    is bounded by the "colors" stage deadline; while the vision endpoint is
+    unavailable (breaker open, deadline passed, connection or server errors)
+    the offline palette, or the default colors, are returned at once and not
+    cached. Other errors are raised.
+    
+    Args:
+        product_name (str): Name of the product for context
+        image_path (str): Path to the product image
+        client (OpenAI, optional): Client to use. Defaults to the shared pooled client.
+        use_cache (bool): If True, reuse and store recommendations in the color cache
+        
+    Returns:
+        list: List of 3 recommended color names
+    """
+    logger = logging.getLogger(__name__)
+    
+    try:
+        logger.info(f"Analyzing image to recommend colors for {product_name}...")
+        
+        # Validate image file exists
+        validate_image_file(image_path)
+        prepared = get_prepared_image(image_path)
+        
+        # Reuse a recommendation already computed for this image and product
+        color_cache = get_color_cache() if use_cache else None
+        fingerprint = prepared.source_hash
+        if color_cache is not None:
+            cached_colors = color_cache.get(fingerprint, product_name)
+            if cached_colors:
+                logger.info(f"Using cached color recommendations for {product_name}: {cached_colors}")
+                return cached_colors
+        
+        # Reuse the shared pooled client unless one was passed in
+        if client is None:
+            client = get_openai_client()
+        
+        # Encode the downscaled vision variant to base64
+        logger.debug("Encoding image to base64 for vision analysis...")
+        with open(prepared.vision_path, "rb") as image_file:
+            image_data = base64.b64encode(image_file.read()).decode('utf-8')
         
         logger.info("Calling OpenAI Vision API for color recommendations...")
+        record_bytes_sent("openai", len(image_data))
         start_time = time.time()
         
-        response = client.chat.completions.create(
-            model="gpt-4o",  # Using GPT-4 with vision capabilities
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": vision_prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_data}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=100,
-            temperature=0.7
+        deadline = stage_deadline(STAGE_COLORS)
+        response = call_with_rate_limit(
+            vision_rate_limiter(),
+            lambda: client.with_options(max_retries=0, **deadline.client_options()).chat.completions.create(
+                model=VISION_MODEL,  # Using GPT-4 with vision capabilities
+                messages=build_vision_messages(product_name, image_data, prepared.vision_mime),
+                max_tokens=100,
+                temperature=0.7
+            ),
+            breaker=vision_breaker(),
+            deadline=deadline
         )
         
         end_time = time.time()
         logger.info(f"Vision API call completed in {end_time - start_time:.2f} seconds")
+        observe_stage("vision", end_time - start_time)
         
-        # Extract and parse the color recommendations
-        colors_text = response.choices[0].message.content.strip()
-        logger.info(f"Raw color recommendations: {colors_text}")
-        
-        # Parse colors from the response
-        colors = [color.strip() for color in colors_text.split(',')]
-        
-        # Ensure we have exactly 3 colors
-        if len(colors) < 3:
-            logger.warning(f"Only received {len(colors)} colors, padding with defaults")
-            default_colors = ["electric blue", "sunset orange", "deep purple"]
-            colors.extend(default_colors[len(colors):3])
-        elif len(colors) > 3:
-            logger.info(f"Received {len(colors)} colors, taking first 3")
-            colors = colors[:3]
+        colors = parse_color_recommendations(response.choices[0].message.content)
+        if color_cache is not None:
+            color_cache.put(fingerprint, product_name, colors)
         
         logger.info(f"Final recommended colors for {product_name}: {colors}")
         return colors
         
+    except UPSTREAM_UNAVAILABLE_ERRORS as e:
+        logger.warning(f"Vision API unavailable ({e}), using offline color recommendations")
+        return local_colors_recommendation(product_name, image_path, use_cache=use_cache) or list(FALLBACK_COLORS)
     except Exception as e:
         logger.error(f"Failed to get color recommendations: {e}")
-        logger.info("Falling back to default color recommendations")
-        # Fallback to default colors if vision analysis fails
-        fallback_colors = ["electric blue", "hot pink", "golden yellow"]
-        return fallback_colors
+        raise
+
 
+def validate_color_mode(color_mode):
+    """Raise ValueError for an unknown smart color mode."""
+    if color_mode not in COLOR_MODES:
+        raise ValueError(f"Unknown color mode '{color_mode}', expected one of: {', '.join(COLOR_MODES)}")
 
-def get_smart_colors(product_name, image_path):
+
+def local_colors_recommendation(product_name, image_path, use_cache=True):
+    """
+    Recommend colors with the offline palette engine (no API call).
+    
+    Args:
+        product_name (str): Name of the product for context
+        image_path (str): Path to the product image
+        use_cache (bool): If True, reuse and store the result in the color cache
+        
+    Returns:
+        list or None: Recommended color names, or None if local analysis failed
+    """
+    logger = logging.getLogger(__name__)
+    
+    try:
+        logger.info(f"Analyzing image locally to recommend colors for {product_name}...")
+        prepared = get_prepared_image(image_path)
+        # The palette depends on the image only, so it is cached without the product name
+        color_cache = get_color_cache() if use_cache else None
+        if color_cache is not None:
+            cached_colors = color_cache.get(prepared.source_hash, "", mode=COLOR_MODE_LOCAL)
+            if cached_colors:
+                return cached_colors
+        colors = recommend_colors_local(prepared.vision_path)
+        if color_cache is not None and colors:
+            color_cache.put(prepared.source_hash, "", colors, mode=COLOR_MODE_LOCAL)
+        return colors
+    except Exception as e:
+        logger.error(f"Local color analysis failed: {e}")
+        return None
+
+
+def get_smart_colors(product_name, image_path, client=None, color_mode=COLOR_MODE_VISION):
     """
     Get intelligent color recommendations and return both colors and count.
     
     Args:
         product_name (str): Name of the product
         image_path (str): Path to the product image
+        client (OpenAI, optional): Client to use. Defaults to the shared pooled client.
+        color_mode (str): "vision" (gpt-4o), "local" (offline palette analysis) or
+            "hybrid" (local first, vision if local analysis fails)
         
     Returns:
         tuple: (number_of_colors, colors_list)
     """
     logger = logging.getLogger(__name__)
+    validate_color_mode(color_mode)
     
     try:
-        logger.info("Getting smart color recommendations...")
-        recommended_colors = colors_recommendation(product_name, image_path)
+        logger.info(f"Getting smart color recommendations (mode: {color_mode})...")
         
-        # Always return 3 colors as recommended by the vision analysis
-        return 3, recommended_colors
+        if color_mode in (COLOR_MODE_LOCAL, COLOR_MODE_HYBRID):
+            local_colors = local_colors_recommendation(product_name, image_path)
+            if local_colors:
+                return len(local_colors), local_colors
+            if color_mode == COLOR_MODE_LOCAL:
+                return None, None
+            logger.info("Local color analysis inconclusive, falling back to vision")
+        
+        recommended_colors = colors_recommendation(product_name, image_path, client=client)
+        return len(recommended_colors), recommended_colors
         
     except Exception as e:
         logger.error(f"Smart color recommendation failed: {e}")
@@ -375,9 +1033,706 @@ def get_smart_colors(product_name, image_path):
         return None, None
 
 
+def guess_image_mime_type(image_path):
+    """Return the MIME type for an image path, defaulting to JPEG."""
+    mime_type, _ = mimetypes.guess_type(image_path)
+    return mime_type if mime_type and mime_type.startswith("image/") else "image/jpeg"
+
+
+async def async_read_file(path):
+    """Read a file's bytes without blocking the event loop."""
+    async with await anyio.open_file(path, "rb") as f:
+        return await f.read()
+
+
+async def async_edit_image_with_openai(client, image_path, prompt, n=1, image_bytes=None, on_partial_image=None,
+                                       render=None, deadline=None):
+    """Call OpenAI API to edit the image, returning n images (async).
+
+    image_bytes can be passed to reuse an upload already read into memory.
+    render holds quality, size and output_format settings (see resolve_render_options).
+    When on_partial_image is given, a single image is requested in streaming
+    mode and on_partial_image is awaited with each partial image (base64) and
+    its index while the model is still rendering.
+    deadline (a Deadline, by default the "edit" stage deadline starting now)
+    bounds the whole edit, raising DeadlineExceeded once it has passed.
+    """
+    logger = logging.getLogger(__name__)
+    
+    try:
+        logger.info(f"Calling OpenAI image edit API for {n} image(s) (async)...")
+        start_time = time.time()
+        if deadline is None:
+            deadline = stage_deadline(STAGE_EDIT)
+        
+        if image_bytes is None:
+            image_bytes = await async_read_file(image_path)
+        image = (os.path.basename(image_path), image_bytes, guess_image_mime_type(image_path))
+        record_bytes_sent("openai", len(image_bytes))
+        if on_partial_image is not None and n == 1 and PARTIAL_IMAGES > 0:
+            call = lambda: async_stream_image_edit(client, image, prompt, on_partial_image, render, deadline)
+        else:
+            call = lambda: client.with_options(max_retries=0, **deadline.client_options()).images.edit(
+                model=IMAGE_MODEL,
+                image=[
+                    image,
+                ],
+                prompt=prompt,
+                n=n,
+                **(render or {})
+            )
+        result = await async_call_with_rate_limit(
+            image_rate_limiter(), call, images=n, breaker=image_breaker(), deadline=deadline
+        )
+        
+        end_time = time.time()
+        logger.info(f"OpenAI API call completed successfully in {end_time - start_time:.2f} seconds")
+        return result
+        
+    except Exception as e:
+        logger.error(f"Failed during OpenAI API call: {e}")
+        raise
+
+
+async def async_stream_image_edit(client, image, prompt, on_partial_image, render=None, deadline=None):
+    """
+    Run one image edit in streaming mode, forwarding partial images as they arrive.
+    
+    The pinned SDK has no typed streaming support for images yet, so the
+    request asks for it through extra_body and the server-sent events are read
+    from the raw response.
+    
+    Args:
+        client (AsyncOpenAI): Client to use
+        image (tuple): (filename, bytes, MIME type) of the input image
+        prompt (str): Edit prompt
+        on_partial_image (callable): ``async on_partial_image(image_base64, index)``
+        render (dict, optional): quality, size and output_format settings
+        deadline (Deadline, optional): Bounds the request by the time left (see Deadline.client_options)
+        
+    Returns:
+        ImagesResponse: The final image, as returned by a non-streaming call
+    """
+    logger = logging.getLogger(__name__)
+    
+    final_images = []
+    completed = {}
+    options = deadline.client_options() if deadline is not None else {}
+    async with client.with_options(max_retries=0, **options).images.with_streaming_response.edit(
+        model=IMAGE_MODEL,
+        image=[
+            image,
+        ],
+        prompt=prompt,
+        extra_body={"stream": True, "partial_images": PARTIAL_IMAGES},
+        **(render or {})
+    ) as response:
+        async for line in response.iter_lines():
+            if not line.startswith("data:"):
+                continue
+            event = json.loads(line[len("data:"):])
+            if event.get("type") == "image_edit.partial_image":
+                index = event.get("partial_image_index", 0)
+                logger.debug("Received partial image %d (%d characters)", index, len(event["b64_json"]))
+                await on_partial_image(event["b64_json"], index)
+            elif event.get("type") == "image_edit.completed":
+                final_images.append(event["b64_json"])
+                completed = event
+            elif event.get("type") == "error":
+                raise RuntimeError(f"Image stream failed: {event.get('error') or event}")
+    
+    if not final_images:
+        raise ValueError("Image stream ended without a final image")
+    return ImagesResponse(
+        created=completed.get("created_at") or int(time.time()),
+        data=[Image(b64_json=data) for data in final_images],
+        quality=completed.get("quality"),
+        size=completed.get("size"),
+        output_format=completed.get("output_format"),
+    )
+
+
+async def async_process_api_response(result):
+    """Process the API response off the event loop and return the decoded images.
+
+    Decoding is pure computation, so a cancelled caller does not wait for it to finish.
+    """
+    return await anyio.to_thread.run_sync(process_api_response, result, abandon_on_cancel=True)
+
+
+async def async_save_api_response(result, output_filenames):
+    """Stream every image of an API response into its output file (async).
+
+    The write runs in a worker thread; if the caller is cancelled it returns
+    at once and the thread stops at its next chunk without leaving files behind.
+    """
+    cancel_event = threading.Event()
+    try:
+        return await anyio.to_thread.run_sync(
+            save_api_response, result, output_filenames, cancel_event, abandon_on_cancel=True
+        )
+    except asyncio.CancelledError:
+        cancel_event.set()
+        raise
+
+
+async def async_save_image(image_bytes, output_filename):
+    """Save the processed image to a file (async)."""
+    logger = logging.getLogger(__name__)
+    
+    try:
+        logger.debug("Saving image to file: %s", output_filename)
+        try:
+            async with await anyio.open_file(output_filename, "wb") as f:
+                await f.write(image_bytes)
+        except asyncio.CancelledError:
+            # Never leave a partial image behind for a cancelled generation
+            if os.path.exists(output_filename):
+                os.remove(output_filename)
+            raise
+        
+        output_path = anyio.Path(output_filename)
+        if await output_path.exists():
+            file_size = (await output_path.stat()).st_size
+            logger.info(f"Image saved successfully: {output_filename} ({file_size} bytes)")
+            await anyio.to_thread.run_sync(publish_output, output_filename)
+            return file_size
+        else:
+            logger.error(f"Failed to create output file: {output_filename}")
+            raise FileNotFoundError(f"Failed to create output file: {output_filename}")
+            
+    except Exception as e:
+        logger.error(f"Failed to save image: {e}")
+        raise
+
+
+async def async_colors_recommendation(product_name, image_path, client=None, use_cache=True):
+    """
+    Recommend 3 colors for the product by analyzing the image (async).
+    
+    Same deadline, caching and degradation as colors_recommendation.
+    
+    Args:
+        product_name (str): Name of the product for context
+        image_path (str): Path to the product image
+        client (AsyncOpenAI, optional): Client to use. Defaults to the shared pooled async client.
+        use_cache (bool): If True, reuse and store recommendations in the color cache
+        
+    Returns:
+        list: List of 3 recommended color names
+    """
+    logger = logging.getLogger(__name__)
+    
+    try:
+        logger.info(f"Analyzing image to recommend colors for {product_name}...")
+        
+        prepared = await anyio.to_thread.run_sync(get_prepared_image, image_path)
+        
+        color_cache = get_color_cache() if use_cache else None
+        fingerprint = prepared.source_hash
+        if color_cache is not None:
+            cached_colors = color_cache.get(fingerprint, product_name)
+            if cached_colors:
+                logger.info(f"Using cached color recommendations for {product_name}: {cached_colors}")
+                return cached_colors
+        
+        if client is None:
+            client = get_async_openai_client()
+        
+        image_data = base64.b64encode(await async_read_file(prepared.vision_path)).decode('utf-8')
+        
+        logger.info("Calling OpenAI Vision API for color recommendations (async)...")
+        record_bytes_sent("openai", len(image_data))
+        start_time = time.time()
+        
+        deadline = stage_deadline(STAGE_COLORS)
+        response = await async_call_with_rate_limit(
+            vision_rate_limiter(),
+            lambda: client.with_options(max_retries=0, **deadline.client_options()).chat.completions.create(
+                model=VISION_MODEL,
+                messages=build_vision_messages(product_name, image_data, prepared.vision_mime),
+                max_tokens=100,
+                temperature=0.7
+            ),
+            breaker=vision_breaker(),
+            deadline=deadline
+        )
+        
+        end_time = time.time()
+        logger.info(f"Vision API call completed in {end_time - start_time:.2f} seconds")
+        observe_stage("vision", end_time - start_time)
+        
+        colors = parse_color_recommendations(response.choices[0].message.content)
+        if color_cache is not None:
+            color_cache.put(fingerprint, product_name, colors)
+        
+        logger.info(f"Final recommended colors for {product_name}: {colors}")
+        return colors
+        
+    except asyncio.CancelledError:
+        raise
+    except UPSTREAM_UNAVAILABLE_ERRORS as e:
+        logger.warning(f"Vision API unavailable ({e}), using offline color recommendations")
+        colors = await anyio.to_thread.run_sync(local_colors_recommendation, product_name, image_path, use_cache)
+        return colors or list(FALLBACK_COLORS)
+    except Exception as e:
+        logger.error(f"Failed to get color recommendations: {e}")
+        raise
+
+
+async def async_get_smart_colors(product_name, image_path, client=None, color_mode=COLOR_MODE_VISION):
+    """
+    Get intelligent color recommendations and return both colors and count (async).
+    
+    Args:
+        product_name (str): Name of the product
+        image_path (str): Path to the product image
+        client (AsyncOpenAI, optional): Client to use. Defaults to the shared pooled async client.
+        color_mode (str): "vision", "local" or "hybrid" (see get_smart_colors)
+        
+    Returns:
+        tuple: (number_of_colors, colors_list)
+    """
+    logger = logging.getLogger(__name__)
+    validate_color_mode(color_mode)
+    
+    try:
+        logger.info(f"Getting smart color recommendations (mode: {color_mode})...")
+        
+        if color_mode in (COLOR_MODE_LOCAL, COLOR_MODE_HYBRID):
+            local_colors = await anyio.to_thread.run_sync(local_colors_recommendation, product_name, image_path)
+            if local_colors:
+                return len(local_colors), local_colors
+            if color_mode == COLOR_MODE_LOCAL:
+                return None, None
+            logger.info("Local color analysis inconclusive, falling back to vision")
+        
+        recommended_colors = await async_colors_recommendation(product_name, image_path, client=client)
+        return len(recommended_colors), recommended_colors
+        
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Smart color recommendation failed: {e}")
+        logger.info("Falling back to random color selection")
+        return None, None
+
+
+async def async_generate_ad_image(product_name, brand_name, image_path, output_filename,
+                                  number_of_colors=None, colors=None, use_smart_colors=False,
+                                  client=None, progress_callback=None, use_cache=True,
+                                  color_mode=COLOR_MODE_VISION, correlation_id=None, preview_callback=None,
+                                  mode=None, quality=None, size=None, output_format=None):
+    """
+    Generate an advertisement image without blocking the event loop.
+    
+    Same contract as generate_ad_image, but built on AsyncOpenAI and async file I/O
+    so that many generations can be in flight per worker without holding threads.
+    
+    If the image edit outlives its deadline or the API is unavailable,
+    the ad is composited locally instead (see fallback_render) and the result
+    has fallback set.
+    
+    Args:
+        product_name (str): Name of the product
+        brand_name (str): Name of the brand
+        image_path (str): Path to the input image
+        output_filename (str): Name of the output file
+        number_of_colors (int, optional): Number of colors to use (1-3). If None, randomly selected.
+        colors (str or list, optional): Colors to use. If None, randomly selected.
+        use_smart_colors (bool): If True, uses AI vision to recommend colors based on the product image
+        client (AsyncOpenAI, optional): Client to use. Defaults to the shared pooled async client.
+        progress_callback (callable, optional): Called with the name of each pipeline stage
+        use_cache (bool): If True, identical requests are served from the result cache
+        color_mode (str): Smart color mode: "vision", "local" or "hybrid" (see get_smart_colors)
+        correlation_id (str, optional): Id tagging this generation's log records; defaults to
+            the id of the calling request, or a new one
+        preview_callback (callable, optional): Called with a downscaled preview (bytes, see
+            derivatives.PARTIAL_PREVIEW) of each partial image while the edit is rendering
+        mode (str, optional): Render preset, "draft" or "final" (see RENDER_PRESETS)
+        quality (str, optional): Rendering quality, overrides the preset of mode
+        size (str, optional): Output size, overrides the preset of mode
+        output_format (str, optional): "png", "jpeg" or "webp", overrides the preset of mode
+        
+    Returns:
+        dict: output_filename, colors_used, number_of_colors, cache_hit, fallback and render
+    """
+    logger = logging.getLogger(__name__)
+    correlation_token = bind_correlation_id(correlation_id)
+    stages = StageTracker(progress_callback)
+    
+    try:
+        logger.info("Starting AD image generation process (async)...")
+        logger.info(f"Product: {product_name}, Brand: {brand_name}")
+        render = resolve_render_options(mode, quality, size, output_format)
+        
+        if client is None:
+            client = get_async_openai_client()
+        
+        if use_smart_colors and colors is None:
+            stages.enter("colors")
+            logger.info("Using smart color recommendations based on product image...")
+            smart_num_colors, smart_colors = await async_get_smart_colors(
+                product_name, image_path, client=client, color_mode=color_mode
+            )
+            if smart_colors:
+                number_of_colors = smart_num_colors
+                colors = smart_colors
+                logger.info(f"Smart colors recommended: {colors}")
+            else:
+                logger.info("Smart color recommendation failed, using random selection")
+        
+        stages.enter("prompt")
+        number_of_colors, colors = resolve_prompt_colors(number_of_colors, colors)
+        prompt = create_template_prompt(product_name, brand_name, number_of_colors, colors)
+        stages.enter("validate")
+        if not await anyio.Path(image_path).exists():
+            logger.error(f"Image file not found: {image_path}")
+            raise FileNotFoundError(f"Image file not found: {image_path}")
+        
+        stages.enter("preprocess")
+        prepared = await anyio.to_thread.run_sync(get_prepared_image, image_path, abandon_on_cancel=True)
+        
+        cache_key = None
+        if use_cache:
+            cache_key, cache_hit = await anyio.to_thread.run_sync(
+                functools.partial(lookup_cached_result, prepared.source_hash, prompt, output_filename, render=render)
+            )
+            if cache_hit:
+                return build_generation_result(
+                    output_filename, colors, number_of_colors, cache_hit=True, render=describe_render(mode, render)
+                )
+        
+        stages.enter("edit")
+        on_partial_image = None
+        if preview_callback is not None:
+            async def on_partial_image(image_base64, index):
+                try:
+                    preview = await anyio.to_thread.run_sync(render_partial_preview, image_base64)
+                except Exception as e:
+                    # Previews are best effort, the final image still arrives
+                    logger.warning(f"Could not render partial image {index}: {e}")
+                    return
+                preview_callback(preview)
+        try:
+            result = await async_edit_image_with_openai(
+                client, prepared.edit_path, prompt, on_partial_image=on_partial_image, render=render
+            )
+        except Exception as e:
+            if not should_fall_back(e):
+                raise
+            logger.warning(f"Image API unavailable ({str(e) or type(e).__name__}), rendering the ad locally")
+            stages.enter("fallback")
+            stages.fell_back()
+            saved = await async_render_fallback_ad(
+                prepared.edit_path, output_filename, product_name, brand_name, colors, render.get("size")
+            )
+            await anyio.to_thread.run_sync(publish_output, output_filename)
+            return build_generation_result(
+                output_filename, colors, number_of_colors, saved=saved, render=describe_render(mode, render),
+                fallback=True
+            )
+        stages.enter("save")
+        saved = (await async_save_api_response(result, [output_filename]))[0]
+        await anyio.to_thread.run_sync(store_cached_result, cache_key, output_filename)
+        
+        logger.info("AD image generation completed successfully")
+        
+        return build_generation_result(
+            output_filename, colors, number_of_colors, saved=saved, render=describe_render(mode, render, result)
+        )
+        
+    except asyncio.CancelledError:
+        logger.info("AD image generation cancelled")
+        stages.cancelled()
+        raise
+    except Exception as e:
+        stages.failed()
+        logger.error(f"AD image generation failed: {e}")
+        raise
+    finally:
+        stages.close()
+        reset_correlation_id(correlation_token)
+
+
+async def async_generate_ad_variants(product_name, brand_name, image_path, output_filenames,
+                                     color_variants=None, number_of_colors=None, colors=None,
+                                     use_smart_colors=False, client=None, progress_callback=None,
+                                     use_cache=True, color_mode=COLOR_MODE_VISION, correlation_id=None):
+    """
+    Generate several advertisement variants of one product without blocking the event loop.
+    
+    Same contract as generate_ad_variants. The prepared upload is read into
+    memory once; colorway variants then run concurrently and share those bytes.
+    
+    Args:
+        product_name (str): Name of the product
+        brand_name (str): Name of the brand
+        image_path (str): Path to the input image
+        output_filenames (list): One output path per variant
+        color_variants (list, optional): One list of colors per variant
+        number_of_colors (int, optional): Number of colors for a shared prompt (1-3)
+        colors (str or list, optional): Colors for a shared prompt
+        use_smart_colors (bool): If True, a shared prompt uses recommended colors
+        client (AsyncOpenAI, optional): Client to use. Defaults to the shared pooled async client.
+        progress_callback (callable, optional): Called with the name of each pipeline stage
+        use_cache (bool): If True, identical requests are served from the result cache
+        color_mode (str): Smart color mode: "vision", "local" or "hybrid" (see get_smart_colors)
+        correlation_id (str, optional): Id tagging this generation's log records; defaults to
+            the id of the calling request, or a new one
+        
+    Returns:
+        list: One result dict (as returned by async_generate_ad_image) per variant
+    """
+    logger = logging.getLogger(__name__)
+    correlation_token = bind_correlation_id(correlation_id)
+    edit_calls = 1 if color_variants is None else len(color_variants)
+    stages = StageTracker(progress_callback, edit_calls=edit_calls)
+    
+    try:
+        validate_variant_request(output_filenames, color_variants)
+        logger.info(f"Starting generation of {len(output_filenames)} AD variants (async)...")
+        logger.info(f"Product: {product_name}, Brand: {brand_name}")
+        
+        if client is None:
+            client = get_async_openai_client()
+        
+        if color_variants is None and use_smart_colors and colors is None:
+            stages.enter("colors")
+            smart_num_colors, smart_colors = await async_get_smart_colors(
+                product_name, image_path, client=client, color_mode=color_mode
+            )
+            if smart_colors:
+                number_of_colors, colors = smart_num_colors, smart_colors
+                logger.info(f"Smart colors recommended: {colors}")
+        
+        stages.enter("validate")
+        if not await anyio.Path(image_path).exists():
+            logger.error(f"Image file not found: {image_path}")
+            raise FileNotFoundError(f"Image file not found: {image_path}")
+        stages.enter("preprocess")
+        prepared = await anyio.to_thread.run_sync(get_prepared_image, image_path, abandon_on_cancel=True)
+        image_bytes = await async_read_file(prepared.edit_path)
+        
+        if color_variants is None:
+            stages.enter("prompt")
+            number_of_colors, colors = resolve_prompt_colors(number_of_colors, colors)
+            prompt = create_template_prompt(product_name, brand_name, number_of_colors, colors)
+            
+            n = len(output_filenames)
+            lookups = []
+            for index, output_filename in enumerate(output_filenames):
+                if use_cache:
+                    lookups.append(await anyio.to_thread.run_sync(
+                        lookup_cached_result, prepared.source_hash, prompt, output_filename, (index, n)
+                    ))
+                else:
+                    lookups.append((None, False))
+            if all(hit for _, hit in lookups):
+                return [build_generation_result(output_filename, colors, number_of_colors, cache_hit=True)
+                        for output_filename in output_filenames]
+            
+            stages.enter("edit")
+            try:
+                result = await async_edit_image_with_openai(
+                    client, prepared.edit_path, prompt, n=n, image_bytes=image_bytes
+                )
+            except Exception as e:
+                if not should_fall_back(e):
+                    raise
+                return await async_render_fallback_variants(
+                    stages, e, prepared, output_filenames, product_name, brand_name, colors, number_of_colors
+                )
+            stages.enter("save")
+            results = []
+            for saved, (cache_key, _) in zip(await async_save_api_response(result, output_filenames), lookups):
+                await anyio.to_thread.run_sync(store_cached_result, cache_key, saved.path)
+                results.append(build_generation_result(saved.path, colors, number_of_colors, saved=saved))
+        else:
+            async def render_colorway(variant_colors, output_filename):
+                prompt = create_template_prompt(product_name, brand_name, len(variant_colors), variant_colors)
+                cache_key = None
+                if use_cache:
+                    cache_key, cache_hit = await anyio.to_thread.run_sync(
+                        lookup_cached_result, prepared.source_hash, prompt, output_filename
+                    )
+                    if cache_hit:
+                        return build_generation_result(
+                            output_filename, variant_colors, len(variant_colors), cache_hit=True
+                        )
+                
+                try:
+                    result = await async_edit_image_with_openai(
+                        client, prepared.edit_path, prompt, image_bytes=image_bytes
+                    )
+                except Exception as e:
+                    if not should_fall_back(e):
+                        raise
+                    return (await async_render_fallback_variants(
+                        stages, e, prepared, [output_filename], product_name, brand_name, variant_colors,
+                        len(variant_colors)
+                    ))[0]
+                saved = (await async_save_api_response(result, [output_filename]))[0]
+                await anyio.to_thread.run_sync(store_cached_result, cache_key, output_filename)
+                return build_generation_result(output_filename, variant_colors, len(variant_colors), saved=saved)
+            
+            stages.enter("edit")
+            results = list(await asyncio.gather(*(
+                render_colorway(variant_colors, output_filename)
+                for variant_colors, output_filename in zip(color_variants, output_filenames)
+            )))
+        
+        logger.info(f"Generated {len(results)} AD variants successfully")
+        return results
+        
+    except asyncio.CancelledError:
+        logger.info("AD variant generation cancelled")
+        stages.cancelled()
+        raise
+    except Exception as e:
+        stages.failed()
+        logger.error(f"AD variant generation failed: {e}")
+        raise
+    finally:
+        stages.close()
+        reset_correlation_id(correlation_token)
+
+
+def build_batch_item_result(index, result=None, error=None):
+    """Build the per-item record produced by the batch generation functions."""
+    if error is not None:
+        return {"index": index, "success": False, "error": str(error)}
+    return {"index": index, "success": True, "result": result}
+
+
+def generate_ads_batch(items, max_concurrency=DEFAULT_BATCH_CONCURRENCY, client=None):
+    """
+    Generate many advertisements with bounded concurrency.
+    
+    Items run on a thread pool sharing one OpenAI client. Results are yielded
+    as soon as each item finishes, so callers can report progress; a failing
+    item is reported and never aborts the rest of the batch. Closing the
+    generator early cancels the unfinished items.
+    
+    Args:
+        items (list): Keyword arguments for generate_ad_image, one dict per ad
+        max_concurrency (int): Maximum number of generations in flight
+        client (OpenAI, optional): Client to use. Defaults to the shared pooled client.
+        
+    Yields:
+        dict: index of the item in items, success, and result or error
+    """
+    logger = logging.getLogger(__name__)
+    
+    if client is None:
+        client = get_openai_client()
+    
+    logger.info(f"Starting batch of {len(items)} ads with concurrency {max_concurrency}")
+    cancel_event = threading.Event()
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = {
+            # Run each item in a copy of this context so its logs keep the caller's correlation id
+            executor.submit(
+                contextvars.copy_context().run,
+                generate_ad_image, **item, client=client, cancel_event=cancel_event
+            ): index
+            for index, item in enumerate(items)
+        }
+        try:
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    yield build_batch_item_result(index, result=future.result())
+                except Exception as e:
+                    logger.error(f"Batch item {index} failed: {e}")
+                    yield build_batch_item_result(index, error=e)
+        finally:
+            pending = [future for future in futures if not future.done()]
+            if pending:
+                # Running items stop at their next stage, queued ones never start
+                cancel_event.set()
+                for future in pending:
+                    future.cancel()
+                logger.info(f"Batch stopped early, cancelled {len(pending)} unfinished items")
+
+
+async def async_generate_ads_batch(items, max_concurrency=DEFAULT_BATCH_CONCURRENCY, client=None):
+    """
+    Generate many advertisements concurrently on the event loop.
+    
+    Same contract as generate_ads_batch, built on async_generate_ad_image. At
+    most max_concurrency generations are in flight; if the consumer stops
+    iterating (e.g. the client disconnected), unfinished items are cancelled.
+    
+    Args:
+        items (list): Keyword arguments for async_generate_ad_image, one dict per ad
+        max_concurrency (int): Maximum number of generations in flight
+        client (AsyncOpenAI, optional): Client to use. Defaults to the shared pooled async client.
+        
+    Yields:
+        dict: index of the item in items, success, and result or error
+    """
+    logger = logging.getLogger(__name__)
+    
+    if client is None:
+        client = get_async_openai_client()
+    
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    
+    async def run_item(index, item):
+        async with semaphore:
+            try:
+                result = await async_generate_ad_image(**item, client=client)
+                return build_batch_item_result(index, result=result)
+            except Exception as e:
+                logger.error(f"Batch item {index} failed: {e}")
+                return build_batch_item_result(index, error=e)
+    
+    logger.info(f"Starting batch of {len(items)} ads with concurrency {max_concurrency}")
+    tasks = [asyncio.create_task(run_item(index, item)) for index, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.info(f"Batch stopped early, cancelled {len(pending)} unfinished items")
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def create_ads_archive(output_files, archive_path):
+    """
+    Bundle generated advertisements into one zip archive.
+    
+    Images are stored uncompressed since they are already compressed.
+    The archive is written to a temporary file and renamed into place.
+    
+    Args:
+        output_files (list): Paths of the generated images
+        archive_path (str): Where to write the archive
+        
+    Returns:
+        str: archive_path
+    """
+    logger = logging.getLogger(__name__)
+    
+    os.makedirs(os.path.dirname(archive_path) or ".", exist_ok=True)
+    tmp_path = f"{archive_path}.tmp"
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as archive:
+        for path in output_files:
+            archive.write(path, arcname=os.path.basename(path))
+    os.replace(tmp_path, archive_path)
+    
+    logger.info(f"Archived {len(output_files)} ads to {archive_path}")
+    return archive_path
+
+
 def main():
     """Main entry point for the ad generator."""
-    logger = configure_logging()
+    configure_logging()
+    logger = logging.getLogger(__name__)
     logger.info("Starting AD-AI application")
     
     try:
@@ -0,0 +1,173 @@
+"""
+Cooperative cancellation for the AD-AI generation pipeline.
+
+Generations report each pipeline stage through a StageTracker. When a
+generation is cancelled, the tracker records the stage it was in so we can
+tell how much work the cancellation saved: OpenAI calls never made or
+aborted mid-flight, and decodes and saves skipped. The sync pipeline polls a
+threading.Event between stages; the async pipeline is cancelled through its
+asyncio task, which also closes the in-flight HTTP request.
+
+The tracker also feeds the per-stage latency histograms and the in-flight
+and outcome metrics of every generation.
+"""
+
+import logging
+import threading
+import time
+
+from .metrics import GENERATIONS, GENERATIONS_IN_FLIGHT, observe_stage
+
+# Pipeline stages in execution order
+# "fallback" replaces the rest of the pipeline when the image API is too slow or unavailable
+PIPELINE_STAGES = ("colors", "prompt", "validate", "preprocess", "edit", "fallback", "save")
+EDIT_STAGE_INDEX = PIPELINE_STAGES.index("edit")
+# Used for savings estimates until a real edit call has been timed
+DEFAULT_EDIT_SECONDS = 60.0
+# Weight of the newest sample in the moving average of edit durations
+EDIT_DURATION_SMOOTHING = 0.2
+
+
+class GenerationCancelled(Exception):
+    """Raised by the sync pipeline when its cancel event is set."""
+
+
+_lock = threading.Lock()
+_average_edit_seconds = None
+_stats = {
+    "cancelled": 0,
+    "by_stage": {},
+    "edit_calls_skipped": 0,
+    "edit_calls_aborted": 0,
+    "decodes_skipped": 0,
+    "saves_skipped": 0,
+    "api_seconds_saved": 0.0,
+}
+
+
+def record_edit_duration(seconds):
+    """Feed the duration of a completed image edit call into the savings estimate."""
+    global _average_edit_seconds
+    with _lock:
+        if _average_edit_seconds is None:
+            _average_edit_seconds = seconds
+        else:
+            _average_edit_seconds += EDIT_DURATION_SMOOTHING * (seconds - _average_edit_seconds)
+
+
+def record_cancellation(stage, stage_elapsed, edit_calls=1):
+    """
+    Record what a cancellation at the given stage saved.
+
+    Args:
+        stage (str): Pipeline stage the generation was in, or None if it had not started
+        stage_elapsed (float): Seconds already spent in that stage
+        edit_calls (int): Image edit calls the generation would have made
+    """
+    logger = logging.getLogger(__name__)
+
+    index = PIPELINE_STAGES.index(stage) if stage in PIPELINE_STAGES else -1
+    with _lock:
+        average_edit = _average_edit_seconds or DEFAULT_EDIT_SECONDS
+        _stats["cancelled"] += 1
+        stage_name = stage or "queued"
+        _stats["by_stage"][stage_name] = _stats["by_stage"].get(stage_name, 0) + 1
+
+        if index < EDIT_STAGE_INDEX:
+            _stats["edit_calls_skipped"] += edit_calls
+            _stats["api_seconds_saved"] += average_edit * edit_calls
+        elif index == EDIT_STAGE_INDEX:
+            _stats["edit_calls_aborted"] += edit_calls
+            _stats["api_seconds_saved"] += max(0.0, average_edit - stage_elapsed) * edit_calls
+        if index <= EDIT_STAGE_INDEX:
+            _stats["decodes_skipped"] += 1
+        if index < PIPELINE_STAGES.index("save"):
+            _stats["saves_skipped"] += 1
+
+    logger.info(f"Generation cancelled during {stage_name} after {stage_elapsed:.2f}s in that stage")
+
+
+def cancellation_stats():
+    """Return what cancellations have saved so far."""
+    with _lock:
+        return {
+            **_stats,
+            "by_stage": dict(_stats["by_stage"]),
+            "api_seconds_saved": round(_stats["api_seconds_saved"], 2),
+            "average_edit_seconds": round(_average_edit_seconds, 2) if _average_edit_seconds else None,
+        }
+
+
+class StageTracker:
+    """
+    Follows one generation through the pipeline.
+
+    Call close() once the generation is over, whatever its outcome.
+
+    Args:
+        progress_callback (callable, optional): Notified of every stage
+        cancel_event (threading.Event, optional): Checked on every stage by the sync pipeline
+        edit_calls (int): Image edit calls the generation makes, for savings stats
+    """
+
+    def __init__(self, progress_callback=None, cancel_event=None, edit_calls=1):
+        self.progress_callback = progress_callback
+        self.cancel_event = cancel_event
+        self.edit_calls = edit_calls
+        self.stage = None
+        self.stage_started = time.monotonic()
+        self.outcome = None
+        self.fallback = False
+        self.closed = False
+        GENERATIONS_IN_FLIGHT.inc()
+
+    def enter(self, stage):
+        """
+        Move to the next stage.
+
+        Raises:
+            GenerationCancelled: If the cancel event has been set
+        """
+        now = time.monotonic()
+        if self.stage is not None:
+            observe_stage(self.stage, now - self.stage_started)
+        if self.stage == "edit" and stage != "fallback":
+            record_edit_duration(now - self.stage_started)
+        self.check()
+        self.stage = stage
+        self.stage_started = now
+        if self.progress_callback is not None:
+            try:
+                self.progress_callback(stage)
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Progress callback failed at stage {stage}: {e}")
+
+    def check(self):
+        """Raise GenerationCancelled if the cancel event has been set."""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise GenerationCancelled("Generation cancelled")
+
+    def cancelled(self):
+        """Record the cancellation of this generation at its current stage."""
+        self.outcome = "cancelled"
+        record_cancellation(self.stage, time.monotonic() - self.stage_started, self.edit_calls)
+
+    def failed(self):
+        """Record that this generation failed at its current stage."""
+        self.outcome = "failed"
+
+    def fell_back(self):
+        """Record that the image was rendered locally instead of by the image API."""
+        self.fallback = True
+
+    def close(self):
+        """Finish tracking: time the last stage of a successful generation and count the outcome."""
+        if self.closed:
+            return
+        self.closed = True
+        if self.outcome is None:
+            self.outcome = "fallback" if self.fallback else "succeeded"
+            if self.stage is not None:
+                observe_stage(self.stage, time.monotonic() - self.stage_started)
+        GENERATIONS.labels(outcome=self.outcome).inc()
+        GENERATIONS_IN_FLIGHT.dec()
@@ -0,0 +1,222 @@
+"""
+Circuit breakers for the OpenAI endpoints used by AD-AI.
+
+Every model endpoint (image edits, vision chat completions) gets one shared
+breaker. While it is closed, calls go through and their outcomes are kept
+for a sliding window; once at least minimum_calls were made in the window
+and the share of failures reaches failure_rate, the breaker opens and every
+call fails at once with CircuitOpen instead of waiting on an unhealthy
+upstream. After open_seconds it turns half-open and lets a few probe calls
+through: a success closes it again, a failure re-opens it.
+
+Only signs of an unhealthy upstream count as failures: connection errors,
+timeouts, missed deadlines and 5xx answers. 429s are handled by the rate
+limiter, and other client errors say nothing about the upstream's health.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+import openai
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an endpoint whose breaker is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit breaker for {name} is open, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_upstream_failure(error):
+    """Return True for errors that mean the upstream is unhealthy."""
+    return isinstance(error, (openai.APIConnectionError, openai.InternalServerError, TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open breaker for one endpoint.
+
+    Safe to use from threads and from the event loop at the same time.
+
+    Args:
+        name (str): Endpoint name, used in logs and stats
+        failure_rate (float): Share of failed calls in the window that opens the breaker
+        minimum_calls (int): Calls needed in the window before the failure rate is judged
+        window_seconds (float): Length of the sliding window of outcomes
+        open_seconds (float): How long the breaker stays open before probing
+        half_open_calls (int): Probe calls let through at a time while half-open
+    """
+
+    def __init__(self, name, failure_rate=0.5, minimum_calls=10, window_seconds=60.0, open_seconds=30.0,
+                 half_open_calls=1):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.minimum_calls = max(1, minimum_calls)
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(1, half_open_calls)
+        self._state = BREAKER_CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._outcomes = collections.deque()
+        self._lock = threading.Lock()
+        self._stats = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def _current_state(self, now):
+        if self._state == BREAKER_OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = BREAKER_HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def _trim(self, now):
+        while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+            self._outcomes.popleft()
+
+    def _open(self, now):
+        self._state = BREAKER_OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        self._stats["opened"] += 1
+        logging.getLogger(__name__).warning(
+            f"Circuit breaker for {self.name} opened, failing fast for {self.open_seconds:g}s"
+        )
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def acquire(self):
+        """
+        Let a call through, or raise CircuitOpen.
+
+        Every call let through must be reported with record_outcome(), or
+        with release() if it never reached the endpoint.
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == BREAKER_OPEN:
+                self._stats["rejected"] += 1
+                raise CircuitOpen(self.name, self.open_seconds - (now - self._opened_at))
+            if state == BREAKER_HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpen(self.name, 0.0)
+                self._probes += 1
+
+    def release(self):
+        """Free the slot of a call let through by acquire() that never reached the endpoint."""
+        with self._lock:
+            self._release_probe(self._current_state(time.monotonic()))
+
+    def _release_probe(self, state):
+        if state == BREAKER_HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+
+    def record_outcome(self, error=None):
+        """
+        Report how a call let through by acquire() ended.
+
+        Args:
+            error (BaseException, optional): The call's error, None if it succeeded
+        """
+        logger = logging.getLogger(__name__)
+
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if error is not None and not is_upstream_failure(error):
+                # Neither healthy nor unhealthy: just free a probe slot
+                self._release_probe(state)
+                return
+
+            failed = error is not None
+            self._stats["failures" if failed else "successes"] += 1
+            if state == BREAKER_OPEN:
+                # A call admitted before the breaker opened
+                return
+            if state == BREAKER_HALF_OPEN:
+                if failed:
+                    self._open(now)
+                else:
+                    self._state = BREAKER_CLOSED
+                    self._outcomes.clear()
+                    logger.info(f"Circuit breaker for {self.name} closed")
+                return
+
+            self._outcomes.append((now, failed))
+            self._trim(now)
+            failures = sum(1 for _, outcome in self._outcomes if outcome)
+            if len(self._outcomes) >= self.minimum_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open(now)
+
+    def stats(self):
+        """Return the state, the failure rate of the window and counters."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            self._trim(now)
+            calls = len(self._outcomes)
+            failures = sum(1 for _, outcome in self._outcomes if outcome)
+            retry_in = self.open_seconds - (now - self._opened_at) if state == BREAKER_OPEN else 0.0
+            return {
+                "state": state,
+                "window_calls": calls,
+                "failure_rate": round(failures / calls, 3) if calls else 0.0,
+                "retry_in_seconds": round(max(0.0, retry_in), 2),
+                **self._stats,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def _env_number(name, default, cast=float):
+    value = os.getenv(name)
+    return cast(value) if value not in (None, "") else default
+
+
+def get_circuit_breaker(name):
+    """
+    Return the process-wide breaker of an endpoint, creating it on first use.
+
+    Thresholds are read from BREAKER_FAILURE_RATE, BREAKER_MIN_CALLS,
+    BREAKER_WINDOW_SECONDS, BREAKER_OPEN_SECONDS and BREAKER_HALF_OPEN_CALLS.
+
+    Args:
+        name (str): Endpoint name, such as "gpt-image-1 images.edit"
+
+    Returns:
+        CircuitBreaker: The shared breaker
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_rate=_env_number("BREAKER_FAILURE_RATE", 0.5),
+                minimum_calls=_env_number("BREAKER_MIN_CALLS", 10, int),
+                window_seconds=_env_number("BREAKER_WINDOW_SECONDS", 60.0),
+                open_seconds=_env_number("BREAKER_OPEN_SECONDS", 30.0),
+                half_open_calls=_env_number("BREAKER_HALF_OPEN_CALLS", 1, int),
+            )
+            _breakers[name] = breaker
+        return breaker
+
+
+def circuit_breaker_stats():
+    """Return the stats of every breaker created so far, keyed by endpoint."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
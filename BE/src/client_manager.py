@@ -0,0 +1,249 @@
+"""
+OpenAI client management for AD-AI.
+
+Builds the application settings and a single pooled OpenAI client (plus an
+AsyncOpenAI counterpart) once per process so that every generation reuses the
+same HTTP connection pool instead of paying a fresh TCP+TLS handshake on each
+request.
+"""
+
+import logging
+import os
+import threading
+from dataclasses import dataclass
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+
+
+def _env_int(name, default):
+    """Read an integer setting from the environment."""
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name, default):
+    """Read a float setting from the environment."""
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+@dataclass(frozen=True)
+class ClientSettings:
+    """Connection settings for the shared OpenAI client."""
+
+    api_key: str
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 10.0
+    read_timeout: float = 180.0
+    write_timeout: float = 60.0
+    pool_timeout: float = 30.0
+    max_retries: int = 2
+
+    @classmethod
+    def from_env(cls):
+        """
+        Load settings from the environment (and the .env file, if present).
+
+        Returns:
+            ClientSettings: Settings populated from OPENAI_* variables
+        """
+        logger = logging.getLogger(__name__)
+
+        load_dotenv()
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            logger.error("OPENAI_API_KEY not found in environment variables")
+            raise ValueError("OPENAI_API_KEY is required")
+
+        return cls(
+            api_key=api_key,
+            max_connections=_env_int("OPENAI_MAX_CONNECTIONS", cls.max_connections),
+            max_keepalive_connections=_env_int("OPENAI_MAX_KEEPALIVE_CONNECTIONS", cls.max_keepalive_connections),
+            keepalive_expiry=_env_float("OPENAI_KEEPALIVE_EXPIRY", cls.keepalive_expiry),
+            connect_timeout=_env_float("OPENAI_CONNECT_TIMEOUT", cls.connect_timeout),
+            read_timeout=_env_float("OPENAI_READ_TIMEOUT", cls.read_timeout),
+            write_timeout=_env_float("OPENAI_WRITE_TIMEOUT", cls.write_timeout),
+            pool_timeout=_env_float("OPENAI_POOL_TIMEOUT", cls.pool_timeout),
+            max_retries=_env_int("OPENAI_MAX_RETRIES", cls.max_retries),
+        )
+
+    def timeout(self):
+        """Return the httpx timeout configuration."""
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.read_timeout,
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+    def limits(self):
+        """Return the httpx connection pool limits."""
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+
+class OpenAIClientManager:
+    """Owns the process-wide OpenAI clients (sync and async) and their connection pools."""
+
+    def __init__(self, settings=None):
+        self._settings = settings
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    @property
+    def settings(self):
+        """Settings used by the managed client, loaded on first access."""
+        if self._settings is None:
+            self._settings = ClientSettings.from_env()
+        return self._settings
+
+    def get_client(self):
+        """
+        Return the shared OpenAI client, creating it on first use.
+
+        Returns:
+            OpenAI: Client backed by a pooled httpx transport
+        """
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._build_client()
+        return self._client
+
+    def _build_client(self):
+        logger = logging.getLogger(__name__)
+
+        settings = self.settings
+        logger.info(
+            f"Initializing pooled OpenAI client (max_connections={settings.max_connections}, "
+            f"keepalive={settings.max_keepalive_connections}, read_timeout={settings.read_timeout}s)"
+        )
+        http_client = httpx.Client(limits=settings.limits(), timeout=settings.timeout())
+        return OpenAI(
+            api_key=settings.api_key,
+            http_client=http_client,
+            timeout=settings.timeout(),
+            max_retries=settings.max_retries,
+        )
+
+    def get_async_client(self):
+        """
+        Return the shared AsyncOpenAI client, creating it on first use.
+
+        The async client binds its pool to the running event loop, so it should
+        be created from the loop that serves requests (e.g. at app startup).
+
+        Returns:
+            AsyncOpenAI: Client backed by a pooled httpx async transport
+        """
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    self._async_client = self._build_async_client()
+        return self._async_client
+
+    def _build_async_client(self):
+        logger = logging.getLogger(__name__)
+
+        settings = self.settings
+        logger.info(f"Initializing pooled AsyncOpenAI client (max_connections={settings.max_connections})")
+        http_client = httpx.AsyncClient(limits=settings.limits(), timeout=settings.timeout())
+        return AsyncOpenAI(
+            api_key=settings.api_key,
+            http_client=http_client,
+            timeout=settings.timeout(),
+            max_retries=settings.max_retries,
+        )
+
+    def close(self):
+        """Close the shared sync client and release pooled connections."""
+        logger = logging.getLogger(__name__)
+
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+            logger.info("OpenAI client closed")
+
+    async def aclose(self):
+        """Close both shared clients and release pooled connections."""
+        logger = logging.getLogger(__name__)
+
+        self.close()
+        with self._lock:
+            async_client, self._async_client = self._async_client, None
+        if async_client is not None:
+            await async_client.close()
+            logger.info("AsyncOpenAI client closed")
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_client_manager():
+    """Return the process-wide client manager."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = OpenAIClientManager()
+    return _manager
+
+
+def init_client_manager(settings=None):
+    """
+    Build the process-wide client manager and its client eagerly.
+
+    Intended to be called once at application startup.
+
+    Args:
+        settings (ClientSettings, optional): Explicit settings. Loaded from the environment if None.
+
+    Returns:
+        OpenAIClientManager: The initialized manager
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.close()
+        _manager = OpenAIClientManager(settings)
+    _manager.get_client()
+    _manager.get_async_client()
+    return _manager
+
+
+def shutdown_client_manager():
+    """Close the process-wide client manager, if one was created."""
+    global _manager
+    with _manager_lock:
+        manager, _manager = _manager, None
+    if manager is not None:
+        manager.close()
+
+
+async def async_shutdown_client_manager():
+    """Close the process-wide client manager, including its async client."""
+    global _manager
+    with _manager_lock:
+        manager, _manager = _manager, None
+    if manager is not None:
+        await manager.aclose()
+
+
+def get_openai_client():
+    """Shortcut for the shared OpenAI client."""
+    return get_client_manager().get_client()
+
+
+def get_async_openai_client():
+    """Shortcut for the shared AsyncOpenAI client."""
+    return get_client_manager().get_async_client()
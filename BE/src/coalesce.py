@@ -0,0 +1,142 @@
+"""
+Request coalescing for AD-AI.
+
+Identical generation requests that arrive while one is already running share
+that in-flight generation instead of starting their own (and paying for
+their own OpenAI call). Every caller holds a reference to the shared
+generation; cancelling one caller only drops its reference, and the
+generation itself is cancelled once nobody is waiting for it anymore.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+
+
+def request_fingerprint(image_hash, params, ignore=("output_filename", "output_filenames", "image_path")):
+    """
+    Build the coalescing key of a generation request.
+
+    Args:
+        image_hash (str): SHA-256 of the uploaded image
+        params (dict): Generator arguments of the request
+        ignore (tuple): Per-request arguments that do not change the result
+
+    Returns:
+        str: Hex digest identifying identical requests
+    """
+    payload = json.dumps(
+        {"image": image_hash, "params": {key: value for key, value in params.items() if key not in ignore}},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """One shared in-flight call and the callers waiting for it."""
+
+    def __init__(self, key):
+        self.key = key
+        self.task = None
+        self.refs = 0
+        self.progress_callbacks = []
+        self.preview_callbacks = []
+        self.last_stage = None
+        self.last_preview = None
+
+    def report_progress(self, stage):
+        self.last_stage = stage
+        for callback in list(self.progress_callbacks):
+            try:
+                callback(stage)
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Progress callback failed at stage {stage}: {e}")
+
+    def report_preview(self, preview):
+        self.last_preview = preview
+        for callback in list(self.preview_callbacks):
+            try:
+                callback(preview)
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Preview callback failed: {e}")
+
+
+class SingleFlight:
+    """
+    Share one in-flight call between concurrent callers with the same key.
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._stats = {"started": 0, "coalesced": 0, "cancelled": 0}
+
+    async def run(self, key, factory, progress_callback=None, preview_callback=None):
+        """
+        Await the call for key, starting it only if none is in flight.
+
+        Args:
+            key (str): Request fingerprint
+            factory (callable): ``factory(progress_callback, preview_callback)`` returning the coroutine to run
+            progress_callback (callable, optional): Receives the shared call's pipeline stages
+            preview_callback (callable, optional): Receives the shared call's partial image previews
+
+        Returns:
+            tuple: (result, coalesced) where coalesced is True if the call was
+                already in flight for another caller
+        """
+        logger = logging.getLogger(__name__)
+
+        flight = self._flights.get(key)
+        coalesced = flight is not None
+        if flight is None:
+            flight = _Flight(key)
+            flight.task = asyncio.create_task(factory(flight.report_progress, flight.report_preview))
+            flight.task.add_done_callback(lambda _: self._forget(flight))
+            self._flights[key] = flight
+            self._stats["started"] += 1
+        else:
+            self._stats["coalesced"] += 1
+            logger.info(f"Joined in-flight generation {key[:12]} ({flight.refs + 1} callers)")
+
+        flight.refs += 1
+        if progress_callback is not None:
+            flight.progress_callbacks.append(progress_callback)
+            if flight.last_stage is not None:
+                progress_callback(flight.last_stage)
+        if preview_callback is not None:
+            flight.preview_callbacks.append(preview_callback)
+            if flight.last_preview is not None:
+                preview_callback(flight.last_preview)
+
+        try:
+            return await asyncio.shield(flight.task), coalesced
+        except asyncio.CancelledError:
+            if not flight.task.done() and flight.refs == 1:
+                # Last caller gave up: stop the shared call and let new callers start afresh
+                flight.task.cancel()
+                self._forget(flight)
+                self._stats["cancelled"] += 1
+                logger.info(f"Cancelled in-flight generation {key[:12]}, no callers left")
+            raise
+        finally:
+            flight.refs -= 1
+            if progress_callback is not None and progress_callback in flight.progress_callbacks:
+                flight.progress_callbacks.remove(progress_callback)
+            if preview_callback is not None and preview_callback in flight.preview_callbacks:
+                flight.preview_callbacks.remove(preview_callback)
+
+    def _forget(self, flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def in_flight(self):
+        """Return the number of distinct calls currently running."""
+        return len(self._flights)
+
+    def stats(self):
+        """Return flight counters and the number of calls in flight."""
+        return {"in_flight": len(self._flights), **self._stats}
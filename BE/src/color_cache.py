@@ -0,0 +1,100 @@
+"""
+Cache of color recommendations for AD-AI.
+
+Vision recommendations are keyed by a fingerprint of the image contents plus
+the normalized product name, so a recommendation computed for an upload
+(e.g. by /recommend-colors) is reused by the generation that follows instead
+of paying for a second vision call.
+"""
+
+import os
+import threading
+
+from cachetools import TTLCache
+
+
+def normalize_product_name(product_name):
+    """Normalize a product name for use in cache keys."""
+    return " ".join((product_name or "").lower().split())
+
+
+class ColorRecommendationCache:
+    """
+    In-memory TTL + LRU cache of color recommendations.
+
+    Args:
+        max_entries (int): Maximum number of cached recommendations
+        ttl_seconds (float): How long a recommendation stays valid
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600):
+        self._cache = TTLCache(maxsize=max_entries, ttl=ttl_seconds)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(fingerprint, product_name, mode="vision"):
+        """Build the cache key for an image fingerprint, product name and recommendation mode."""
+        return (fingerprint, normalize_product_name(product_name), mode)
+
+    def get(self, fingerprint, product_name, mode="vision"):
+        """
+        Look up a cached recommendation.
+
+        Returns:
+            list or None: Cached colors, or None on a miss
+        """
+        key = self.make_key(fingerprint, product_name, mode)
+        with self._lock:
+            colors = self._cache.get(key)
+            if colors is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(colors)
+
+    def put(self, fingerprint, product_name, colors, mode="vision"):
+        """Store a recommendation."""
+        key = self.make_key(fingerprint, product_name, mode)
+        with self._lock:
+            self._cache[key] = list(colors)
+
+    def clear(self):
+        """Drop every cached recommendation."""
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        """Return hit/miss counters and current usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._cache),
+                "max_entries": int(self._cache.maxsize),
+                "ttl_seconds": self._cache.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_color_cache():
+    """
+    Return the process-wide color recommendation cache.
+
+    Configured by COLOR_CACHE_MAX_ENTRIES and COLOR_CACHE_TTL_SECONDS.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ColorRecommendationCache(
+                    max_entries=int(os.getenv("COLOR_CACHE_MAX_ENTRIES", "1024")),
+                    ttl_seconds=float(os.getenv("COLOR_CACHE_TTL_SECONDS", "3600")),
+                )
+    return _cache
@@ -0,0 +1,98 @@
+"""
+Per-stage deadlines for the OpenAI calls of AD-AI.
+
+Every pipeline stage that waits on OpenAI gets a time budget read from
+DEADLINE_<STAGE>_SECONDS (0 disables it). A Deadline is started when the
+stage begins and covers all of its attempts: each attempt is given only the
+time left as its timeout, retries stop once the next backoff would overrun
+it, and a stage that runs out raises DeadlineExceeded instead of holding a
+worker for as long as the SDK defaults allow.
+"""
+
+import asyncio
+import os
+import time
+
+STAGE_COLORS = "colors"
+STAGE_EDIT = "edit"
+
+# Default budget of each stage in seconds
+STAGE_DEADLINES = {
+    STAGE_COLORS: 30.0,
+    STAGE_EDIT: 120.0,
+}
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a stage outlives its deadline."""
+
+    def __init__(self, stage, seconds):
+        super().__init__(f"Stage '{stage}' exceeded its {seconds:g} second deadline")
+        self.stage = stage
+        self.seconds = seconds
+
+
+class Deadline:
+    """
+    Time budget of one stage, started on creation.
+
+    Args:
+        stage (str): Stage name, used in errors
+        seconds (float): Budget in seconds, 0 or less for no deadline
+    """
+
+    def __init__(self, stage, seconds):
+        self.stage = stage
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds if seconds > 0 else None
+
+    @property
+    def bounded(self):
+        return self.expires_at is not None
+
+    def left(self):
+        """Return the seconds left (negative once expired), or None without a deadline."""
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def check(self):
+        """Raise DeadlineExceeded if the deadline has passed."""
+        left = self.left()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded(self.stage, self.seconds)
+
+    def client_options(self):
+        """Return OpenAI client options bounding a request by the time left."""
+        self.check()
+        left = self.left()
+        return {} if left is None else {"timeout": left}
+
+    async def run(self, awaitable):
+        """Await awaitable, cancelling it and raising DeadlineExceeded once the deadline passes."""
+        left = self.left()
+        if left is None:
+            return await awaitable
+        try:
+            async with asyncio.timeout(left) as scope:
+                return await awaitable
+        except TimeoutError:
+            if scope.expired():
+                raise DeadlineExceeded(self.stage, self.seconds) from None
+            raise
+
+
+def stage_deadline_seconds(stage):
+    """Return the configured budget of a stage (DEADLINE_<STAGE>_SECONDS)."""
+    value = os.getenv(f"DEADLINE_{stage.upper()}_SECONDS")
+    return float(value) if value not in (None, "") else STAGE_DEADLINES.get(stage, 0.0)
+
+
+def stage_deadline(stage):
+    """Start the deadline of a stage."""
+    return Deadline(stage, stage_deadline_seconds(stage))
+
+
+def deadline_settings():
+    """Return the budget of every stage, in seconds (0 = none)."""
+    return {stage: stage_deadline_seconds(stage) for stage in STAGE_DEADLINES}
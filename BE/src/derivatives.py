@@ -0,0 +1,200 @@
+"""
+Derived renditions of generated advertisements for AD-AI.
+
+Generated images are immutable, so smaller renditions (thumbnails, previews
+and WEBP/AVIF re-encodes) are produced once per output on first request and
+served from a disk cache afterwards. Content types are detected from the
+file's bytes, since the image model does not always return what the
+output's extension suggests. Partial images streamed by the image model
+while it is still rendering are downscaled in memory for live previews.
+"""
+
+import base64
+import contextlib
+import io
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from PIL import Image, features
+
+
+@dataclass(frozen=True)
+class DerivativeSpec:
+    """How to render one derivative."""
+
+    max_size: int
+    format: str
+    quality: int
+    extension: str
+    media_type: str
+
+
+DERIVATIVES = {
+    "thumb": DerivativeSpec(256, "WEBP", 75, ".webp", "image/webp"),
+    "preview": DerivativeSpec(768, "WEBP", 82, ".webp", "image/webp"),
+    "webp": DerivativeSpec(None, "WEBP", 90, ".webp", "image/webp"),
+    "avif": DerivativeSpec(None, "AVIF", 60, ".avif", "image/avif"),
+}
+
+# Rendition of partial images sent to clients while a generation is running
+PARTIAL_PREVIEW = DerivativeSpec(384, "WEBP", 60, ".webp", "image/webp")
+
+# Magic bytes of the formats the image model and the derivatives produce
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+)
+
+
+def detect_media_type(path, default="application/octet-stream"):
+    """
+    Detect an image's content type from its first bytes.
+
+    Args:
+        path (str): Image file
+        default (str): Returned when the format is not recognized
+
+    Returns:
+        str: MIME type
+    """
+    with open(path, "rb") as image_file:
+        header = image_file.read(32)
+
+    for signature, media_type in _SIGNATURES:
+        if header.startswith(signature):
+            return media_type
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header[4:8] == b"ftyp" and header[8:12] in (b"avif", b"avis"):
+        return "image/avif"
+    return default
+
+
+def available_derivatives():
+    """Return the derivative names this Pillow build can produce."""
+    return [
+        name for name, spec in DERIVATIVES.items()
+        if spec.format != "AVIF" or features.check("avif")
+    ]
+
+
+class _RenderLock:
+    """Lock of one derivative file, counting the threads holding or waiting on it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+
+
+_render_locks = {}
+_render_locks_guard = threading.Lock()
+
+
+@contextlib.contextmanager
+def _render_lock(path):
+    """
+    Serialize the rendering of one derivative file.
+
+    A path's lock is dropped once no thread holds or waits on it anymore, so
+    the table only holds the derivatives being rendered right now.
+    """
+    with _render_locks_guard:
+        render_lock = _render_locks.setdefault(path, _RenderLock())
+        render_lock.users += 1
+    try:
+        with render_lock.lock:
+            yield
+    finally:
+        with _render_locks_guard:
+            render_lock.users -= 1
+            if render_lock.users == 0:
+                del _render_locks[path]
+
+
+def _is_fresh(path, source_mtime):
+    """Return True if the derivative at path exists and is not older than its source."""
+    try:
+        return os.stat(path).st_mtime_ns >= source_mtime
+    except FileNotFoundError:
+        return False
+
+
+def get_derivative(source_path, name, cache_dir="cache/derivatives"):
+    """
+    Return the path of a derivative, rendering it on first use.
+
+    Concurrent requests for the same derivative render it only once. A
+    derivative older than its source is rendered again.
+
+    Args:
+        source_path (str): Generated image
+        name (str): One of DERIVATIVES
+        cache_dir (str): Directory holding rendered derivatives
+
+    Returns:
+        str: Path of the derivative file
+
+    Raises:
+        ValueError: If the derivative is unknown or not supported by this Pillow build
+    """
+    logger = logging.getLogger(__name__)
+
+    if name not in available_derivatives():
+        raise ValueError(f"Unsupported image variant {name}, expected one of: {', '.join(available_derivatives())}")
+    spec = DERIVATIVES[name]
+
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    path = os.path.join(cache_dir, f"{stem}_{name}{spec.extension}")
+    source_mtime = os.stat(source_path).st_mtime_ns
+
+    if _is_fresh(path, source_mtime):
+        return path
+
+    with _render_lock(path):
+        # Another thread may have rendered it while this one waited
+        if _is_fresh(path, source_mtime):
+            return path
+
+        start_time = time.time()
+        os.makedirs(cache_dir, exist_ok=True)
+        with Image.open(source_path) as image:
+            image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+            if spec.max_size:
+                image.thumbnail((spec.max_size, spec.max_size), Image.Resampling.LANCZOS)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                image.save(tmp_path, format=spec.format, quality=spec.quality)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    logger.info(
+        f"Rendered {name} of {source_path} in {time.time() - start_time:.2f}s "
+        f"({os.path.getsize(path)} bytes)"
+    )
+    return path
+
+
+def render_partial_preview(image_base64, spec=PARTIAL_PREVIEW):
+    """
+    Downscale a partial image returned by the streaming image API.
+
+    Args:
+        image_base64 (str): Base64-encoded partial image
+        spec (DerivativeSpec): Rendition to produce
+
+    Returns:
+        bytes: Encoded preview, of type spec.media_type
+    """
+    with Image.open(io.BytesIO(base64.b64decode(image_base64))) as image:
+        image = image.convert("RGB")
+        image.thumbnail((spec.max_size, spec.max_size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format=spec.format, quality=spec.quality)
+    return buffer.getvalue()
@@ -0,0 +1,435 @@
+"""
+Local fallback renderer for AD-AI.
+
+When the image API is too slow or unavailable, an advertisement is
+composited locally instead: the product is cut out from a plain background
+(or framed as a card when the background is busy), centered on a gradient in
+the prompt's colors, surrounded by abstract vector shapes in those colors,
+above a slogan band carrying the brand name. Shapes are drawn supersampled
+and downscaled so their edges are anti-aliased like vector art.
+
+Rendering is CPU bound, so it runs in a process pool and never holds the GIL
+of the API workers. The result is plainer than a model render, but it is
+ready in about a second whatever the state of the upstream API.
+"""
+
+import asyncio
+import functools
+import io
+import logging
+import math
+import multiprocessing
+import os
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFilter, ImageFont, ImageOps
+
+from .logging_setup import configure_logging
+from .outputs import write_image_bytes
+from .palette import NAMED_COLORS, NAMED_COLOR_NAMES, rgb_to_lab
+
+DEFAULT_CANVAS_SIZE = (1024, 1024)
+# Shapes are drawn at this multiple of the canvas size, then downscaled for anti-aliasing
+SUPERSAMPLE = 2
+# Largest share of the canvas the product may cover (width, height)
+PRODUCT_BOX = (0.62, 0.56)
+# Height of the slogan band as a share of the canvas height
+BAND_HEIGHT = 0.17
+# Lab distance from the border color beyond which a pixel belongs to the product
+CUTOUT_DISTANCE = 24.0
+# Border color spread below which the background counts as plain and is cut away
+PLAIN_BACKGROUND_SPREAD = 12.0
+# Font looked up in the system font directories when FALLBACK_FONT is not set
+DEFAULT_FONT = "DejaVuSans-Bold.ttf"
+# Short slogans, like the 3-4 word slogans the image model is asked for
+SLOGANS = (
+    "Made To Stand Out",
+    "Bold By Design",
+    "Feel The Difference",
+    "Own Every Moment",
+    "Crafted For You",
+    "Live It Loud",
+)
+
+
+def color_rgb(name):
+    """
+    Resolve a color name from a prompt to sRGB.
+
+    Palette names (NAMED_COLORS) are used as is, other names are looked up
+    in Pillow's CSS color table, and unknown names map to a stable palette color.
+
+    Args:
+        name (str): Color name, e.g. "electric blue"
+
+    Returns:
+        tuple: (r, g, b)
+    """
+    key = name.strip().lower()
+    if key in NAMED_COLORS:
+        return NAMED_COLORS[key]
+    try:
+        return ImageColor.getrgb(key.replace(" ", ""))[:3]
+    except ValueError:
+        return NAMED_COLORS[NAMED_COLOR_NAMES[zlib.crc32(key.encode("utf-8")) % len(NAMED_COLOR_NAMES)]]
+
+
+def shade(rgb, factor):
+    """Darken (factor < 1) or lighten toward white (factor > 1) an sRGB color."""
+    rgb = np.asarray(rgb, dtype=np.float64)
+    if factor <= 1:
+        return tuple(int(value) for value in rgb * factor)
+    return tuple(int(value) for value in rgb + (255 - rgb) * min(factor - 1, 1))
+
+
+def load_font(size):
+    """
+    Return the slogan font at a pixel size.
+
+    FALLBACK_FONT wins when set; otherwise DejaVu Sans (installed on most
+    Linux hosts, and covering accented brand names) or Pillow's bundled font.
+    """
+    for font_path in (os.getenv("FALLBACK_FONT"), DEFAULT_FONT):
+        if not font_path:
+            continue
+        try:
+            return ImageFont.truetype(font_path, size)
+        except OSError:
+            if font_path != DEFAULT_FONT:
+                logging.getLogger(__name__).warning(f"Could not load FALLBACK_FONT {font_path}, using the default font")
+    return ImageFont.load_default(size=size)
+
+
+def gradient_background(size, colors):
+    """
+    Paint a diagonal gradient between deep shades of the first and last color.
+
+    A soft light glow sits behind the product so it stands out from the background.
+
+    Args:
+        size (tuple): Canvas (width, height)
+        colors (list): sRGB colors of the ad
+
+    Returns:
+        PIL.Image.Image: RGBA background
+    """
+    width, height = size
+    start = np.array(shade(colors[0], 0.35), dtype=np.float64)
+    end = np.array(shade(colors[-1], 0.75), dtype=np.float64)
+
+    y, x = np.mgrid[0:height, 0:width]
+    t = ((x / max(width - 1, 1)) + (y / max(height - 1, 1))) / 2
+    pixels = start + (end - start) * t[..., None]
+
+    # Radial glow centered where the product goes
+    distance = np.hypot((x - width / 2) / width, (y - height * 0.42) / height)
+    glow = np.clip(1 - distance / 0.45, 0, 1) ** 2 * 0.45
+    pixels = pixels + (255 - pixels) * glow[..., None]
+
+    rgb = np.clip(pixels, 0, 255).astype(np.uint8)
+    return Image.fromarray(rgb, "RGB").convert("RGBA")
+
+
+def orbit_point(rng, size, min_radius=0.30, max_radius=0.52):
+    """Pick a point around the product, away from the center of the canvas."""
+    width, height = size
+    angle = rng.uniform(0, 2 * math.pi)
+    radius = rng.uniform(min_radius, max_radius)
+    return width / 2 + math.cos(angle) * radius * width, height * 0.42 + math.sin(angle) * radius * height
+
+
+def draw_shapes(size, colors, rng):
+    """
+    Draw abstract vector shapes (blobs, rings, arcs, zigzags, triangles, dots) orbiting the product.
+
+    Args:
+        size (tuple): Canvas (width, height)
+        colors (list): sRGB colors of the ad
+        rng (random.Random): Seeded generator, so the same ad gets the same shapes
+
+    Returns:
+        PIL.Image.Image: RGBA layer of the canvas size
+    """
+    big = (size[0] * SUPERSAMPLE, size[1] * SUPERSAMPLE)
+    unit = min(big) / 100
+    layer = Image.new("RGBA", big, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+
+    def color(alpha):
+        return (*rng.choice(colors), alpha)
+
+    for _ in range(5):
+        cx, cy = orbit_point(rng, big, 0.38, 0.6)
+        radius = rng.uniform(8, 16) * unit
+        draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), fill=color(90))
+    for _ in range(6):
+        cx, cy = orbit_point(rng, big)
+        radius = rng.uniform(3, 8) * unit
+        draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), outline=color(220), width=int(unit * 0.9))
+    for _ in range(4):
+        cx, cy = orbit_point(rng, big)
+        radius = rng.uniform(6, 12) * unit
+        start = rng.uniform(0, 360)
+        draw.arc((cx - radius, cy - radius, cx + radius, cy + radius), start, start + rng.uniform(90, 220),
+                 fill=color(230), width=int(unit * 1.2))
+    for _ in range(3):
+        x, y = orbit_point(rng, big)
+        step = rng.uniform(2.5, 4) * unit
+        angle = rng.uniform(0, 2 * math.pi)
+        points = []
+        for index in range(7):
+            offset = step * (1 if index % 2 else -1) * 0.8
+            points.append((
+                x + math.cos(angle) * step * index - math.sin(angle) * offset,
+                y + math.sin(angle) * step * index + math.cos(angle) * offset,
+            ))
+        draw.line(points, fill=color(230), width=int(unit * 0.8), joint="curve")
+    for _ in range(4):
+        cx, cy = orbit_point(rng, big)
+        radius = rng.uniform(3, 6) * unit
+        rotation = rng.uniform(0, 2 * math.pi)
+        triangle = [
+            (cx + radius * math.cos(rotation + k * 2 * math.pi / 3), cy + radius * math.sin(rotation + k * 2 * math.pi / 3))
+            for k in range(3)
+        ]
+        draw.polygon(triangle, outline=color(220), width=int(unit * 0.7))
+    for _ in range(14):
+        cx, cy = orbit_point(rng, big, 0.28, 0.55)
+        radius = rng.uniform(0.5, 1.3) * unit
+        draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), fill=color(240))
+
+    return layer.resize(size, Image.Resampling.LANCZOS)
+
+
+def cut_out_product(image):
+    """
+    Separate the product from its background.
+
+    Images with transparency are kept as they are. On a plain background
+    (typical studio shots) pixels close to the border color are made
+    transparent; a busy background is kept and framed as a rounded card.
+
+    Args:
+        image (PIL.Image.Image): RGBA product image
+
+    Returns:
+        PIL.Image.Image: RGBA product, cropped to its visible pixels
+    """
+    rgba = np.asarray(image, dtype=np.uint8)
+    if (rgba[..., 3] < 250).mean() > 0.01:
+        return image.crop(image.getbbox() or (0, 0, *image.size))
+
+    lab = rgb_to_lab(rgba[..., :3])
+    border = np.concatenate([lab[0], lab[-1], lab[:, 0], lab[:, -1]])
+    background = np.median(border, axis=0)
+    spread = np.median(np.linalg.norm(border - background, axis=1))
+    if spread < PLAIN_BACKGROUND_SPREAD:
+        foreground = np.linalg.norm(lab - background, axis=-1) >= CUTOUT_DISTANCE
+        if 0.02 <= foreground.mean() <= 0.98:
+            mask = Image.fromarray(foreground.astype(np.uint8) * 255, "L")
+            mask = mask.filter(ImageFilter.MedianFilter(5)).filter(ImageFilter.GaussianBlur(1.2))
+            product = image.copy()
+            product.putalpha(mask)
+            return product.crop(mask.getbbox() or (0, 0, *image.size))
+
+    # Busy background: keep the photo, with rounded corners
+    mask = Image.new("L", image.size, 0)
+    ImageDraw.Draw(mask).rounded_rectangle((0, 0, *image.size), radius=min(image.size) // 12, fill=255)
+    card = image.copy()
+    card.putalpha(mask)
+    return card
+
+
+def place_product(canvas, product):
+    """Scale the product into PRODUCT_BOX and paste it above the slogan band with a soft shadow."""
+    width, height = canvas.size
+    box = (int(width * PRODUCT_BOX[0]), int(height * PRODUCT_BOX[1]))
+    scale = min(box[0] / product.width, box[1] / product.height)
+    product = product.resize(
+        (max(1, round(product.width * scale)), max(1, round(product.height * scale))), Image.Resampling.LANCZOS
+    )
+
+    x = (width - product.width) // 2
+    y = int(height * 0.42 - product.height / 2)
+
+    shadow_alpha = product.getchannel("A").point(lambda value: value * 0.45)
+    shadow = Image.new("RGBA", product.size, (0, 0, 0, 0))
+    shadow.putalpha(shadow_alpha)
+    pad = max(8, width // 40)
+    shadow_layer = Image.new("RGBA", canvas.size, (0, 0, 0, 0))
+    shadow_layer.paste(shadow, (x, y + pad), shadow)
+    canvas.alpha_composite(shadow_layer.filter(ImageFilter.GaussianBlur(pad)))
+    canvas.alpha_composite(product, (x, y))
+
+
+def fit_font(draw, text, size, max_width):
+    """Return the largest font up to size whose rendering of text fits max_width."""
+    while True:
+        font = load_font(size)
+        if size <= 10 or draw.textlength(text, font=font) <= max_width:
+            return font
+        size = int(size * 0.9)
+
+
+def draw_slogan_band(canvas, colors, brand_name, slogan):
+    """Draw the bottom band with the brand name and the slogan."""
+    width, height = canvas.size
+    band_top = int(height * (1 - BAND_HEIGHT))
+    band_height = height - band_top
+    darkest = min(colors, key=lambda rgb: sum(rgb))
+    accent = max(colors, key=lambda rgb: sum(rgb))
+
+    band = Image.new("RGBA", canvas.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(band)
+    draw.rectangle((0, band_top, width, height), fill=(*shade(darkest, 0.22), 235))
+    draw.rectangle((0, band_top, width, band_top + max(3, height // 200)), fill=(*accent, 255))
+
+    max_text_width = width * 0.86
+    brand_font = fit_font(draw, brand_name.upper(), int(band_height * 0.36), max_text_width)
+    slogan_font = fit_font(draw, slogan, int(band_height * 0.22), max_text_width)
+    draw.text((width / 2, band_top + band_height * 0.38), brand_name.upper(), font=brand_font,
+              fill=(255, 255, 255, 255), anchor="mm")
+    draw.text((width / 2, band_top + band_height * 0.74), slogan, font=slogan_font,
+              fill=(*shade(accent, 1.5), 255), anchor="mm")
+    canvas.alpha_composite(band)
+
+
+def parse_canvas_size(size):
+    """Parse a render size like "1536x1024"; "auto" and None give the default canvas."""
+    if not size or size == "auto":
+        return DEFAULT_CANVAS_SIZE
+    width, height = (int(value) for value in size.lower().split("x"))
+    return width, height
+
+
+def save_canvas(canvas, output_filename):
+    """Encode the canvas in the format of the output extension and write it like API outputs (see outputs)."""
+    extension = os.path.splitext(output_filename)[1].lower()
+    image_format = Image.registered_extensions().get(extension, "JPEG")
+    image = canvas if image_format in ("PNG", "WEBP") else canvas.convert("RGB")
+
+    encoded = io.BytesIO()
+    image.save(encoded, image_format, quality=92)
+    return write_image_bytes(encoded.getvalue(), output_filename)
+
+
+def render_fallback_ad(image_path, output_filename, product_name, brand_name, colors, size=None):
+    """
+    Composite an advertisement locally from the product image.
+
+    Args:
+        image_path (str): Path to the product image
+        output_filename (str): Where to write the ad; the extension picks the format
+        product_name (str): Name of the product, seeds the layout
+        brand_name (str): Brand shown in the slogan band
+        colors (list): Color names of the prompt
+        size (str, optional): Render size like "1024x1024"
+
+    Returns:
+        SavedImage: Path, size and SHA-256 of the written ad
+    """
+    canvas_size = parse_canvas_size(size)
+    rgb_colors = [color_rgb(name) for name in colors] or [NAMED_COLORS[name] for name in NAMED_COLOR_NAMES[:3]]
+    seed = zlib.crc32("|".join([product_name, brand_name, *colors]).encode("utf-8"))
+    rng = random.Random(seed)
+
+    with Image.open(image_path) as opened:
+        product = ImageOps.exif_transpose(opened).convert("RGBA")
+    # Work at the size the product is shown at
+    product.thumbnail((canvas_size[0], canvas_size[1]), Image.Resampling.LANCZOS)
+
+    canvas = gradient_background(canvas_size, rgb_colors)
+    canvas.alpha_composite(draw_shapes(canvas_size, rgb_colors, rng))
+    place_product(canvas, cut_out_product(product))
+    draw_slogan_band(canvas, rgb_colors, brand_name, rng.choice(SLOGANS))
+    return save_canvas(canvas, output_filename)
+
+
+def fallback_workers():
+    """Return the number of fallback renderer processes (FALLBACK_WORKERS)."""
+    return max(1, int(os.getenv("FALLBACK_WORKERS", "2")))
+
+
+# Set once by get_fallback_pool
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    """Set up logging in a renderer process, which starts without the API process's handlers."""
+    configure_logging()
+
+
+def get_fallback_pool():
+    """
+    Return the shared process pool of the fallback renderer.
+
+    Workers are spawned rather than forked: by the time the pool starts, the
+    API process runs the log listener, registry writer and HTTP pool threads,
+    and a forked child would inherit their state without the threads (its
+    log records would land on a queue nobody reads). Spawned workers start
+    one per task while none is idle; warm_fallback_pool starts all of them at
+    startup, before the API process gets busy.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=fallback_workers(),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return _pool
+
+
+def warm_fallback_pool():
+    """Start the pool's workers ahead of time, so the first fallback does not pay for their startup."""
+    pool = get_fallback_pool()
+    return [pool.submit(time.time) for _ in range(fallback_workers())]
+
+
+def shutdown_fallback_pool():
+    """Stop the fallback renderer's worker processes once their running renders are done."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _discard_broken_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+
+def render_fallback_ad_in_pool(image_path, output_filename, product_name, brand_name, colors, size=None):
+    """Run render_fallback_ad in the process pool and wait for it (see render_fallback_ad)."""
+    pool = get_fallback_pool()
+    try:
+        return pool.submit(
+            render_fallback_ad, image_path, output_filename, product_name, brand_name, colors, size
+        ).result()
+    except BrokenProcessPool:
+        _discard_broken_pool(pool)
+        raise
+
+
+async def async_render_fallback_ad(image_path, output_filename, product_name, brand_name, colors, size=None):
+    """Run render_fallback_ad in the process pool without blocking the event loop (see render_fallback_ad)."""
+    pool = get_fallback_pool()
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, functools.partial(
+            render_fallback_ad, image_path, output_filename, product_name, brand_name, colors, size
+        ))
+    except BrokenProcessPool:
+        _discard_broken_pool(pool)
+        raise
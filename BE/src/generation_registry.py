@@ -0,0 +1,272 @@
+"""
+Shared registry of in-flight generations for AD-AI.
+
+Every running generation (direct request or queued job) has a row in a
+SQLite database that all workers share: which worker owns it, its current
+pipeline stage, when it started and whether cancellation was requested. Any
+worker can therefore report progress for, or cancel, a generation running on
+another worker. Owners poll the registry for cancel flags and refresh a
+heartbeat, so rows left behind by a crashed worker expire on their own.
+
+SQLite waits up to 10 seconds for another worker's write lock, so callers on
+the event loop hand their writes to write_behind(), which applies them in
+order on a dedicated thread.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    generation_id TEXT PRIMARY KEY,
+    file_id TEXT,
+    kind TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS generations_file_id ON generations (file_id);
+CREATE INDEX IF NOT EXISTS generations_owner ON generations (owner);
+"""
+
+KIND_REQUEST = "request"
+KIND_JOB = "job"
+
+
+def default_owner_id():
+    """Return an id for this worker process that is unique across hosts and restarts."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+@dataclass(frozen=True)
+class GenerationState:
+    """Registry row of one in-flight generation."""
+
+    generation_id: str
+    file_id: str
+    kind: str
+    owner: str
+    stage: str
+    started_at: float
+    updated_at: float
+    cancel_requested: bool
+
+    def to_dict(self):
+        """Serialize the public state."""
+        return {
+            "generation_id": self.generation_id,
+            "file_id": self.file_id,
+            "kind": self.kind,
+            "owner": self.owner,
+            "stage": self.stage,
+            "started_at": self.started_at,
+            "cancel_requested": self.cancel_requested,
+        }
+
+
+class GenerationRegistry:
+    """
+    SQLite-backed registry of in-flight generations shared by all workers.
+
+    Args:
+        db_path (str): Path of the SQLite database file, on storage every worker can reach
+        owner (str, optional): Id of this worker, generated if not given
+        stale_seconds (float): Rows whose owner stopped heartbeating for this long are dropped
+    """
+
+    def __init__(self, db_path, owner=None, stale_seconds=30.0):
+        self.db_path = db_path
+        self.owner = owner or default_owner_id()
+        self.stale_seconds = stale_seconds
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        # Several worker processes write to the same file, so wait for their locks
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        # One thread, so deferred writes land in the order they were made
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generation-registry")
+
+    def write_behind(self, method, *args, **kwargs):
+        """
+        Run a registry write on the writer thread without waiting for it.
+
+        Writes run one at a time in submission order, so a generation's
+        register, stage updates and finish never overtake each other.
+
+        Args:
+            method (callable): Bound registry method, such as self.update_stage
+            *args, **kwargs: Arguments of the method
+
+        Returns:
+            concurrent.futures.Future: Completes once the write is applied
+        """
+        future = self._writer.submit(method, *args, **kwargs)
+        future.add_done_callback(self._log_write_error)
+        return future
+
+    @staticmethod
+    def _log_write_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.getLogger(__name__).warning(f"Generation registry write failed: {future.exception()}")
+
+    def close(self):
+        """Apply pending writes, drop this worker's rows and close the database connection."""
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            self._conn.execute("DELETE FROM generations WHERE owner = ?", (self.owner,))
+            self._conn.close()
+
+    def register(self, generation_id, file_id=None, kind=KIND_REQUEST, stage="starting", started_at=None):
+        """
+        Record a generation owned by this worker, or update its stage if already registered.
+
+        A cancel flag set in the meantime is kept.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO generations VALUES (?, ?, ?, ?, ?, ?, ?, 0) "
+                "ON CONFLICT (generation_id) DO UPDATE SET "
+                "stage = excluded.stage, started_at = excluded.started_at, updated_at = excluded.updated_at",
+                (generation_id, file_id, kind, self.owner, stage, started_at or now, now),
+            )
+
+    def update_stage(self, generation_id, stage):
+        """Record the pipeline stage a generation has reached."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE generations SET stage = ?, updated_at = ? WHERE generation_id = ?",
+                (stage, time.time(), generation_id),
+            )
+
+    def finish(self, generation_id):
+        """Remove a generation that is no longer running."""
+        with self._lock:
+            self._conn.execute("DELETE FROM generations WHERE generation_id = ?", (generation_id,))
+
+    def get(self, generation_id):
+        """
+        Look up a generation.
+
+        Returns:
+            GenerationState or None: The state, or None if it is not in flight
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM generations WHERE generation_id = ?", (generation_id,)
+            ).fetchone()
+        return self._state(row) if row else None
+
+    def for_file(self, file_id):
+        """Return the in-flight generations of an upload, on any worker."""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM generations WHERE file_id = ?", (file_id,)).fetchall()
+        return [self._state(row) for row in rows]
+
+    def request_cancel(self, generation_id=None, file_id=None):
+        """
+        Flag generations for cancellation by their owners.
+
+        Args:
+            generation_id (str, optional): Cancel this generation
+            file_id (str, optional): Cancel every generation of this upload
+
+        Returns:
+            int: Number of generations flagged
+        """
+        logger = logging.getLogger(__name__)
+
+        column, value = ("generation_id", generation_id) if generation_id else ("file_id", file_id)
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE generations SET cancel_requested = 1 WHERE {column} = ?", (value,)
+            )
+        if cursor.rowcount:
+            logger.info(f"Cancellation requested for {cursor.rowcount} generation(s) of {column} {value}")
+        return cursor.rowcount
+
+    def pending_cancellations(self):
+        """Return the ids of this worker's generations that were flagged for cancellation."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT generation_id FROM generations WHERE owner = ? AND cancel_requested = 1", (self.owner,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def heartbeat(self):
+        """Mark this worker's generations as alive and drop rows of workers that stopped."""
+        logger = logging.getLogger(__name__)
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE generations SET updated_at = ? WHERE owner = ?", (now, self.owner))
+            cursor = self._conn.execute(
+                "DELETE FROM generations WHERE owner != ? AND updated_at < ?",
+                (self.owner, now - self.stale_seconds),
+            )
+        if cursor.rowcount:
+            logger.warning(f"Dropped {cursor.rowcount} generation(s) of workers that stopped responding")
+
+    async def watch(self, on_cancel, interval=0.5):
+        """
+        Poll for cancellation requests of this worker's generations until cancelled.
+
+        on_cancel is called once per flagged generation, not on every poll
+        until its row is finished.
+
+        Args:
+            on_cancel (callable): Called with the id of each flagged generation
+            interval (float): Seconds between polls (also the heartbeat period)
+        """
+        logger = logging.getLogger(__name__)
+
+        handled = set()
+        while True:
+            try:
+                await asyncio.to_thread(self.heartbeat)
+                pending = set(await asyncio.to_thread(self.pending_cancellations))
+                # Forget generations whose rows are gone
+                handled &= pending
+                for generation_id in pending - handled:
+                    handled.add(generation_id)
+                    on_cancel(generation_id)
+            except sqlite3.Error as e:
+                logger.warning(f"Generation registry poll failed: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self):
+        """Return in-flight generation counts across all workers."""
+        with self._lock:
+            rows = self._conn.execute("SELECT owner, stage, cancel_requested FROM generations").fetchall()
+        by_owner = {}
+        by_stage = {}
+        for owner, stage, _ in rows:
+            by_owner[owner] = by_owner.get(owner, 0) + 1
+            by_stage[stage] = by_stage.get(stage, 0) + 1
+        return {
+            "owner": self.owner,
+            "in_flight": len(rows),
+            "cancel_pending": sum(1 for row in rows if row[2]),
+            "by_owner": by_owner,
+            "by_stage": by_stage,
+        }
+
+    @staticmethod
+    def _state(row):
+        generation_id, file_id, kind, owner, stage, started_at, updated_at, cancel_requested = row
+        return GenerationState(
+            generation_id, file_id, kind, owner, stage, started_at, updated_at, bool(cancel_requested)
+        )
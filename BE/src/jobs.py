@@ -0,0 +1,251 @@
+"""
+Background job queue for AD-AI.
+
+Generation requests are accepted immediately and processed by a bounded pool
+of worker tasks. Clients poll for status/progress and fetch the result once
+the job has finished, so no HTTP connection has to stay open for the whole
+image generation.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from .cancellation import record_cancellation
+from .logging_setup import bind_correlation_id, get_correlation_id, reset_correlation_id
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+@dataclass
+class Job:
+    """A single queued generation and its progress."""
+
+    job_id: str
+    params: dict
+    file_id: str = None
+    correlation_id: str = None
+    status: str = JOB_QUEUED
+    stage: str = JOB_QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: float = None
+    finished_at: float = None
+    result: dict = None
+    error: str = None
+    cancel_requested: bool = False
+    task: asyncio.Task = field(default=None, repr=False)
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def to_dict(self):
+        """Serialize the public job state."""
+        return {
+            "job_id": self.job_id,
+            "file_id": self.file_id,
+            "correlation_id": self.correlation_id,
+            "status": self.status,
+            "stage": self.stage,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Bounded queue plus a fixed pool of worker tasks.
+
+    Args:
+        runner (callable): ``async runner(params, progress_callback)`` returning the job result
+        num_workers (int): Number of jobs processed concurrently
+        max_queue_size (int): Maximum number of jobs waiting to start
+        retention_seconds (float): How long finished jobs are kept for polling
+        on_update (callable, optional): Called with the job whenever its status or stage changes
+    """
+
+    def __init__(self, runner, num_workers=4, max_queue_size=100, retention_seconds=3600, on_update=None):
+        self._runner = runner
+        self._on_update = on_update
+        self._num_workers = num_workers
+        self._retention_seconds = retention_seconds
+        self._max_queue_size = max_queue_size
+        # Unbounded: jobs cancelled while queued stay in it until a worker skips them,
+        # so capacity is counted in _queued, which only holds jobs still waiting to run
+        self._queue = asyncio.Queue()
+        self._queued = 0
+        self._jobs = {}
+        self._workers = []
+
+    async def start(self):
+        """Start the worker tasks."""
+        logger = logging.getLogger(__name__)
+
+        for index in range(self._num_workers):
+            self._workers.append(asyncio.create_task(self._worker(index)))
+        logger.info(f"Job manager started with {self._num_workers} workers")
+
+    async def stop(self):
+        """Cancel running jobs and stop the worker tasks."""
+        logger = logging.getLogger(__name__)
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("Job manager stopped")
+
+    def submit(self, params, file_id=None):
+        """
+        Queue a new job.
+
+        Args:
+            params (dict): Keyword arguments handed to the runner
+            file_id (str, optional): Upload the job belongs to, used for cancellation by file
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            QueueFullError: If the queue is at capacity
+        """
+        logger = logging.getLogger(__name__)
+
+        self._prune()
+        job_id = str(uuid.uuid4())
+        # Logs of the job are tagged with the id of the request that submitted it
+        job = Job(job_id=job_id, params=params, file_id=file_id, correlation_id=get_correlation_id() or job_id)
+        if self._queued >= self._max_queue_size:
+            raise QueueFullError("Job queue is full, try again later")
+        self._queue.put_nowait(job)
+        self._queued += 1
+        self._jobs[job.job_id] = job
+        self._notify(job)
+        logger.info(f"Job {job.job_id} queued (queue depth: {self._queued})")
+        return job
+
+    def get(self, job_id):
+        """Return the job with this id, or None."""
+        return self._jobs.get(job_id)
+
+    def jobs_for_file(self, file_id):
+        """Return the unfinished jobs created for an upload."""
+        return [job for job in self._jobs.values() if job.file_id == file_id and not job.finished]
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job.
+
+        Returns:
+            bool: True if the job was cancelled, False if it was unknown or already finished
+        """
+        logger = logging.getLogger(__name__)
+
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+
+        # Tells _run the job was cancelled, not the worker running it
+        job.cancel_requested = True
+        if job.task is not None:
+            job.task.cancel()
+        else:
+            # Still queued: the whole generation is skipped, and its slot is free at once
+            self._queued -= 1
+            record_cancellation(None, 0.0)
+        self._finish(job, JOB_CANCELLED)
+        logger.info(f"Job {job_id} cancelled")
+        return True
+
+    def stats(self):
+        """Return queue depth and job counts by status."""
+        counts = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"queue_depth": self._queued, "workers": self._num_workers, "jobs": counts}
+
+    async def _worker(self, index):
+        logger = logging.getLogger(__name__)
+
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.finished:
+                    # Cancelled while still waiting in the queue
+                    continue
+                self._queued -= 1
+                await self._run(job)
+            except asyncio.CancelledError:
+                if job.task is not None:
+                    job.task.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Worker {index} failed on job {job.job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job):
+        logger = logging.getLogger(__name__)
+
+        def progress_callback(stage):
+            job.stage = stage
+            self._notify(job)
+
+        job.status = JOB_RUNNING
+        job.stage = "starting"
+        job.started_at = time.time()
+        self._notify(job)
+        correlation_token = bind_correlation_id(job.correlation_id)
+        job.task = asyncio.create_task(self._runner(job.params, progress_callback))
+        try:
+            job.result = await job.task
+            self._finish(job, JOB_SUCCEEDED)
+            logger.info(f"Job {job.job_id} finished in {job.finished_at - job.started_at:.2f} seconds")
+        except asyncio.CancelledError:
+            self._finish(job, JOB_CANCELLED)
+            if not job.cancel_requested or asyncio.current_task().cancelling():
+                # The worker itself is being stopped
+                raise
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, JOB_FAILED)
+            logger.error(f"Job {job.job_id} failed: {e}")
+        finally:
+            job.task = None
+            reset_correlation_id(correlation_token)
+
+    def _finish(self, job, status):
+        if job.finished:
+            return
+        job.status = status
+        job.stage = status
+        job.finished_at = time.time()
+        self._notify(job)
+
+    def _notify(self, job):
+        if self._on_update is None:
+            return
+        try:
+            self._on_update(job)
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Job update hook failed for {job.job_id}: {e}")
+
+    def _prune(self):
+        cutoff = time.time() - self._retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
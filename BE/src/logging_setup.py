@@ -0,0 +1,243 @@
+"""
+Non-blocking, structured logging for AD-AI.
+
+Records are put on an in-memory queue by a QueueHandler on the root logger and
+written to the log file and the console by a QueueListener thread, so neither
+the event loop nor executor threads wait on disk I/O. Every record carries the
+correlation id of the request (or job) it belongs to; it lives in a context
+variable, so it follows the request through tasks and worker threads. DEBUG
+chatter can be sampled per correlation id: a sampled request keeps all of its
+debug lines, the others keep none.
+"""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - [%(correlation_id)s] %(message)s"
+LOG_FORMATS = ("text", "json")
+
+# Correlation id of the request or job the current code runs for
+_correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+# Set once by configure_logging
+_listener = None
+_queue_handler = None
+
+
+def new_correlation_id():
+    """Return a fresh correlation id."""
+    return uuid.uuid4().hex[:16]
+
+
+def get_correlation_id():
+    """Return the correlation id of the current context, or None."""
+    return _correlation_id.get()
+
+
+def bind_correlation_id(correlation_id=None):
+    """
+    Set the correlation id for the current context.
+
+    Args:
+        correlation_id (str, optional): Id to use; when None, the current id is
+            kept, or a new one is created if there is none
+
+    Returns:
+        contextvars.Token: Pass to reset_correlation_id to restore the previous id
+    """
+    if correlation_id is None:
+        correlation_id = _correlation_id.get() or new_correlation_id()
+    return _correlation_id.set(correlation_id)
+
+
+def reset_correlation_id(token):
+    """Restore the correlation id that was set before bind_correlation_id."""
+    _correlation_id.reset(token)
+
+
+class CorrelationFilter(logging.Filter):
+    """Stamps records with the correlation id of the context that logged them."""
+
+    def filter(self, record):
+        record.correlation_id = _correlation_id.get() or "-"
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """
+    Keeps a share of DEBUG records, deciding once per correlation id.
+
+    Args:
+        rate (float): Share of requests whose debug records are kept (0 to 1)
+    """
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = min(max(rate, 0.0), 1.0)
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        if self.rate <= 0.0:
+            return False
+        correlation_id = _correlation_id.get()
+        if correlation_id is None:
+            return random.random() < self.rate
+        return zlib.crc32(correlation_id.encode()) / 0xFFFFFFFF < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "correlation_id": getattr(record, "correlation_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler renders the whole line before queueing; only the message
+    arguments are merged here, as they may not be safe to use from another thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(level=None, log_file=None, log_format=None, debug_sample_rate=None):
+    """
+    Configure logging for the application.
+
+    Safe to call repeatedly: handlers are only installed on the first call.
+
+    Args:
+        level (str, optional): Root log level, defaults to LOG_LEVEL or INFO
+        log_file (str, optional): Log file path, defaults to LOG_FILE or ad_ai.log
+            (an empty LOG_FILE logs to the console only)
+        log_format (str, optional): "text" or "json", defaults to LOG_FORMAT or text
+        debug_sample_rate (float, optional): Share of requests whose DEBUG records
+            are kept, defaults to LOG_DEBUG_SAMPLE_RATE or 1
+
+    Returns:
+        logging.Logger: Logger of this module
+    """
+    global _listener, _queue_handler
+
+    logger = logging.getLogger(__name__)
+    if _listener is not None:
+        return logger
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    log_file = log_file if log_file is not None else os.getenv("LOG_FILE", "ad_ai.log")
+    log_format = (log_format or os.getenv("LOG_FORMAT", "text")).lower()
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Invalid log format '{log_format}', expected one of: {', '.join(LOG_FORMATS)}")
+    if debug_sample_rate is None:
+        debug_sample_rate = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1"))
+
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # Filters run in the thread that logs, where the correlation id is set
+    _queue_handler = _QueueHandler(queue.SimpleQueue())
+    _queue_handler.addFilter(CorrelationFilter())
+    _queue_handler.addFilter(DebugSampler(debug_sample_rate))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_queue_handler)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    logger.info(f"Logging configured successfully (level: {level}, format: {log_format})")
+    return logger
+
+
+def shutdown_logging():
+    """Flush queued records, stop the listener thread and remove the handlers."""
+    global _listener, _queue_handler
+
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener = None
+    _queue_handler = None
+
+
+class CorrelationIdMiddleware:
+    """
+    ASGI middleware binding a correlation id to every HTTP request.
+
+    The id is taken from the X-Request-ID request header when present and
+    echoed back in the response, so client and server logs can be joined.
+    """
+
+    header = b"x-request-id"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        correlation_id = None
+        for name, value in scope["headers"]:
+            if name == self.header:
+                # Bounded and printable: the id ends up in every log line
+                correlation_id = value.decode("latin-1")[:64].strip() or None
+                if correlation_id and not correlation_id.isprintable():
+                    correlation_id = None
+                break
+        token = bind_correlation_id(correlation_id or new_correlation_id())
+        correlation_id = _correlation_id.get()
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((self.header, correlation_id.encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            reset_correlation_id(token)
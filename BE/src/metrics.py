@@ -0,0 +1,189 @@
+"""
+Prometheus metrics for AD-AI.
+
+Exposes latency histograms for every generation pipeline stage (upload,
+color/vision, prompt, validation, preprocessing, image edit, decode and save),
+OpenAI call latencies and error counts by model, in-flight generations, job
+queue depth, cache hit/miss counters and bytes exchanged with clients and
+OpenAI. Stage histograms are what SLOs are set on; comparing their p99s shows
+which stage dominates tail latency.
+
+When PROMETHEUS_MULTIPROC_DIR is set (uvicorn --workers N), counters and
+histograms are aggregated across worker processes; gauges read at scrape
+time describe the worker that answered the scrape.
+"""
+
+import logging
+import os
+import threading
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# From prompt building (milliseconds) to slow image edits (minutes)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300)
+
+STAGE_DURATION = Histogram(
+    "adai_stage_duration_seconds",
+    "Duration of each generation pipeline stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+OPENAI_REQUEST_DURATION = Histogram(
+    "adai_openai_request_duration_seconds",
+    "Duration of single OpenAI API attempts",
+    ["model"],
+    buckets=LATENCY_BUCKETS,
+)
+OPENAI_REQUESTS = Counter("adai_openai_requests_total", "OpenAI API attempts", ["model"])
+OPENAI_ERRORS = Counter(
+    "adai_openai_errors_total",
+    "Failed OpenAI API attempts by kind (rate_limited, timeout, connection, server_error, client_error)",
+    ["model", "kind"],
+)
+GENERATIONS_IN_FLIGHT = Gauge(
+    "adai_generations_in_flight",
+    "Generation pipelines currently running",
+    multiprocess_mode="livesum",
+)
+GENERATIONS = Counter("adai_generations_total", "Finished generation pipelines by outcome", ["outcome"])
+BYTES_RECEIVED = Counter("adai_bytes_received_total", "Bytes received, by source (client, openai)", ["source"])
+BYTES_SENT = Counter("adai_bytes_sent_total", "Bytes sent, by destination (client, openai)", ["destination"])
+
+
+def observe_stage(stage, seconds):
+    """Record the duration of a pipeline stage."""
+    STAGE_DURATION.labels(stage=stage).observe(seconds)
+
+
+def observe_openai_call(model, seconds, error_kind=None):
+    """
+    Record one OpenAI API attempt.
+
+    Args:
+        model (str): Model called
+        seconds (float): Duration of the attempt
+        error_kind (str, optional): Kind of failure, None if the call succeeded
+    """
+    OPENAI_REQUESTS.labels(model=model).inc()
+    OPENAI_REQUEST_DURATION.labels(model=model).observe(seconds)
+    if error_kind is not None:
+        OPENAI_ERRORS.labels(model=model, kind=error_kind).inc()
+
+
+def record_bytes_received(source, size):
+    """Count bytes received from a client or from OpenAI."""
+    BYTES_RECEIVED.labels(source=source).inc(size)
+
+
+def record_bytes_sent(destination, size):
+    """Count bytes sent to a client or to OpenAI."""
+    BYTES_SENT.labels(destination=destination).inc(size)
+
+
+class _LiveCollector:
+    """Reads queue depths, cache counters and other live values at scrape time."""
+
+    def __init__(self):
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def add_gauge(self, name, documentation, read):
+        with self._lock:
+            self._gauges[name] = (documentation, read)
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        logger = logging.getLogger(__name__)
+
+        with self._lock:
+            gauges = dict(self._gauges)
+        for name, (documentation, read) in gauges.items():
+            try:
+                yield GaugeMetricFamily(name, documentation, value=read())
+            except Exception as e:
+                logger.warning(f"Could not read metric {name}: {e}")
+
+        # Imported here: the caches are created lazily from the environment
+        from .color_cache import get_color_cache
+        from .result_cache import get_result_cache
+
+        hits = CounterMetricFamily("adai_cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("adai_cache_misses", "Cache misses", labels=["cache"])
+        for cache_name, cache in (("result", get_result_cache()), ("color", get_color_cache())):
+            if cache is None:
+                continue
+            stats = cache.stats()
+            hits.add_metric([cache_name], stats["hits"])
+            misses.add_metric([cache_name], stats["misses"])
+        yield hits
+        yield misses
+
+
+_live_collector = _LiveCollector()
+REGISTRY.register(_live_collector)
+
+
+def register_gauge(name, documentation, read):
+    """
+    Expose a value read at scrape time, such as a queue depth.
+
+    Args:
+        name (str): Metric name
+        documentation (str): Help text
+        read (callable): Returns the current value
+    """
+    _live_collector.add_gauge(name, documentation, read)
+
+
+def render_metrics():
+    """
+    Render all metrics in the Prometheus text format.
+
+    Returns:
+        tuple: (payload bytes, content type)
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_live_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class BytesMetricsMiddleware:
+    """ASGI middleware counting HTTP request and response body bytes."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                record_bytes_received("client", len(message.get("body", b"")))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.body":
+                record_bytes_sent("client", len(message.get("body", b"")))
+            elif message["type"] == "http.response.pathsend":
+                record_bytes_sent("client", os.path.getsize(message["path"]))
+            await send(message)
+
+        await self.app(scope, counting_receive, counting_send)
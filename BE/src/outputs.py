@@ -0,0 +1,137 @@
+"""
+Generated image output for AD-AI.
+
+Decodes base64 image payloads from the API in fixed-size chunks straight into
+a temporary file next to the destination, computing the size and SHA-256 on
+the way, then fsyncs and atomically renames it into place. Only one chunk of
+decoded bytes is held in memory at a time, and readers never see a partially
+written image. write_image_bytes gives already encoded images (such as the
+local fallback renderer's) the same guarantees.
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+
+from .cancellation import GenerationCancelled
+from .metrics import observe_stage
+
+# Base64 characters decoded per chunk; a multiple of 4 so chunks decode independently
+DECODE_CHUNK_CHARS = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class SavedImage:
+    """A generated image written to disk."""
+
+    path: str
+    size: int
+    sha256: str
+
+
+def _fsync_directory(directory):
+    """Persist a rename by syncing its directory, where the platform allows it."""
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_atomically(output_filename, chunks, cancel_event=None):
+    """
+    Write byte chunks to a temporary file, fsync it and rename it over output_filename.
+
+    Returns:
+        SavedImage: Path, size and SHA-256 of the written file
+
+    Raises:
+        GenerationCancelled: If cancel_event was set before the file was in place
+    """
+    directory = os.path.dirname(output_filename)
+    tmp_path = os.path.join(directory, f".{os.path.basename(output_filename)}.{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as output:
+            for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                output.write(chunk)
+            output.flush()
+            os.fsync(output.fileno())
+
+        if cancel_event is not None and cancel_event.is_set():
+            raise GenerationCancelled("Image write cancelled")
+        os.replace(tmp_path, output_filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_directory(directory)
+    return SavedImage(path=output_filename, size=size, sha256=digest.hexdigest())
+
+
+def write_image_bytes(data, output_filename):
+    """
+    Write an encoded image atomically and durably.
+
+    Args:
+        data (bytes): Encoded image
+        output_filename (str): Final path of the image
+
+    Returns:
+        SavedImage: Path, size and SHA-256 of the written image
+    """
+    return _write_atomically(output_filename, [data])
+
+
+def write_base64_image(image_base64, output_filename, cancel_event=None, chunk_chars=DECODE_CHUNK_CHARS):
+    """
+    Decode a base64 image into a file without materializing the decoded bytes.
+
+    Args:
+        image_base64 (str): Base64 payload from the API
+        output_filename (str): Final path of the image
+        cancel_event (threading.Event, optional): When set, the write is abandoned
+            and nothing is left on disk
+        chunk_chars (int): Base64 characters decoded per chunk (multiple of 4)
+
+    Returns:
+        SavedImage: Path, size and SHA-256 of the written image
+
+    Raises:
+        GenerationCancelled: If cancel_event was set before the image was in place
+    """
+    logger = logging.getLogger(__name__)
+
+    if not image_base64:
+        raise ValueError("API response contained an empty image")
+
+    decode_seconds = 0.0
+
+    def decoded_chunks():
+        nonlocal decode_seconds
+        for start in range(0, len(image_base64), chunk_chars):
+            if cancel_event is not None and cancel_event.is_set():
+                raise GenerationCancelled("Image write cancelled")
+            decode_started = time.perf_counter()
+            chunk = base64.b64decode(image_base64[start:start + chunk_chars])
+            decode_seconds += time.perf_counter() - decode_started
+            yield chunk
+
+    saved = _write_atomically(output_filename, decoded_chunks(), cancel_event)
+    # Decoding is interleaved with writing, so it is timed separately from the save stage
+    observe_stage("decode", decode_seconds)
+
+    logger.info(f"Image saved successfully: {output_filename} ({saved.size} bytes, sha256 {saved.sha256[:12]})")
+    return saved
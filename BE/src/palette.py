@@ -0,0 +1,276 @@
+"""
+Offline color recommendation engine for AD-AI.
+
+Extracts the dominant colors of a product image with k-means in CIE Lab
+space on a downsampled copy, then picks vivid, complementary advertisement
+colors from a palette of human-readable color names. Runs in milliseconds
+with no network access.
+"""
+
+import logging
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Vivid advertisement colors and their approximate sRGB values
+NAMED_COLORS = {
+    "electric blue": (44, 117, 255),
+    "neon green": (57, 255, 20),
+    "hot pink": (255, 20, 147),
+    "bright orange": (255, 140, 0),
+    "deep purple": (94, 38, 168),
+    "crimson red": (220, 20, 60),
+    "golden yellow": (255, 200, 0),
+    "turquoise": (64, 224, 208),
+    "magenta": (255, 0, 255),
+    "lime green": (50, 205, 50),
+    "coral": (255, 127, 80),
+    "royal blue": (65, 105, 225),
+    "emerald green": (0, 155, 119),
+    "sunset orange": (253, 94, 83),
+    "violet": (143, 0, 255),
+    "teal": (0, 128, 128),
+    "ruby red": (155, 17, 30),
+    "amber": (255, 191, 0),
+    "indigo": (75, 0, 130),
+    "chartreuse": (127, 255, 0),
+}
+
+SAMPLE_SIZE = 96
+MIN_OPAQUE_PIXELS = 64
+# Minimum Lab distance between two recommended colors
+MIN_COLOR_DISTANCE = 35.0
+# Chroma below which a product color is treated as neutral (white/grey/black)
+NEUTRAL_CHROMA = 12.0
+# Lab distance within which a pixel is considered part of a plain studio background
+BACKGROUND_DISTANCE = 12.0
+
+
+def rgb_to_lab(rgb):
+    """
+    Convert sRGB values to CIE Lab (D65).
+
+    Args:
+        rgb (np.ndarray): Array of shape (..., 3) with values in 0-255
+
+    Returns:
+        np.ndarray: Array of shape (..., 3) with L, a, b
+    """
+    srgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(srgb <= 0.04045, srgb / 12.92, ((srgb + 0.055) / 1.055) ** 2.4)
+    matrix = np.array([
+        [0.4124564, 0.3575761, 0.1804375],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339, 0.1191920, 0.9503041],
+    ])
+    xyz = linear @ matrix.T / np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    lab = np.empty_like(f)
+    lab[..., 0] = 116 * f[..., 1] - 16
+    lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+    return lab
+
+
+def lab_hue_chroma(lab):
+    """Return (hue in degrees, chroma) for Lab values."""
+    lab = np.asarray(lab, dtype=np.float64)
+    hue = np.degrees(np.arctan2(lab[..., 2], lab[..., 1])) % 360
+    chroma = np.hypot(lab[..., 1], lab[..., 2])
+    return hue, chroma
+
+
+NAMED_COLOR_NAMES = list(NAMED_COLORS)
+NAMED_COLOR_LAB = rgb_to_lab(np.array([NAMED_COLORS[name] for name in NAMED_COLOR_NAMES]))
+
+
+def load_pixels(image, sample_size=SAMPLE_SIZE):
+    """
+    Downsample an image and return its opaque pixels.
+
+    Args:
+        image (str or PIL.Image.Image): Image path or opened image
+        sample_size (int): Longest side of the downsampled image
+
+    Returns:
+        np.ndarray: Array of shape (H, W, 4) with RGBA values
+    """
+    if not isinstance(image, Image.Image):
+        with Image.open(image) as opened:
+            opened.draft("RGB", (sample_size * 2, sample_size * 2))
+            return load_pixels(ImageOps.exif_transpose(opened), sample_size)
+
+    image = image.copy()
+    image.thumbnail((sample_size, sample_size), Image.Resampling.BILINEAR)
+    return np.asarray(image.convert("RGBA"), dtype=np.uint8)
+
+
+def product_pixels(rgba):
+    """
+    Return the Lab values of the pixels that belong to the product.
+
+    Transparent pixels are dropped, and so is a plain background: if the
+    image border is a near-uniform color (typical studio shots), pixels
+    close to that color are excluded as long as enough pixels remain.
+
+    Args:
+        rgba (np.ndarray): Array of shape (H, W, 4) from load_pixels
+
+    Returns:
+        np.ndarray: Array of shape (N, 3) with Lab values
+    """
+    opaque = rgba[..., 3] >= 128
+    lab = rgb_to_lab(rgba[..., :3])
+
+    border = np.concatenate([lab[0], lab[-1], lab[:, 0], lab[:, -1]])
+    border = border[np.concatenate([opaque[0], opaque[-1], opaque[:, 0], opaque[:, -1]])]
+    if len(border):
+        background = np.median(border, axis=0)
+        border_spread = np.median(np.linalg.norm(border - background, axis=1))
+        if border_spread < BACKGROUND_DISTANCE:
+            foreground = opaque & (np.linalg.norm(lab - background, axis=-1) >= BACKGROUND_DISTANCE)
+            if foreground.sum() >= MIN_OPAQUE_PIXELS:
+                return lab[foreground]
+
+    return lab[opaque]
+
+
+def kmeans(points, k, iterations=12, seed=0):
+    """
+    Cluster points with Lloyd's k-means (k-means++ seeding).
+
+    Args:
+        points (np.ndarray): Array of shape (N, D)
+        k (int): Number of clusters
+        iterations (int): Maximum number of refinement passes
+        seed (int): Random seed for reproducible palettes
+
+    Returns:
+        tuple: (centers of shape (k, D), labels of shape (N,))
+    """
+    rng = np.random.default_rng(seed)
+    k = min(k, len(points))
+
+    centers = [points[rng.integers(len(points))]]
+    for _ in range(1, k):
+        distances = np.min(((points[:, None, :] - np.array(centers)[None]) ** 2).sum(-1), axis=1)
+        total = distances.sum()
+        if total == 0:
+            break
+        centers.append(points[rng.choice(len(points), p=distances / total)])
+    centers = np.array(centers)
+
+    labels = None
+    for _ in range(iterations):
+        distances = ((points[:, None, :] - centers[None]) ** 2).sum(-1)
+        new_labels = distances.argmin(axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for index in range(len(centers)):
+            members = points[labels == index]
+            if len(members):
+                centers[index] = members.mean(axis=0)
+    return centers, labels
+
+
+def extract_palette(image, num_colors=5, sample_size=SAMPLE_SIZE):
+    """
+    Extract the dominant colors of an image.
+
+    Args:
+        image (str or PIL.Image.Image): Image path or opened image
+        num_colors (int): Number of clusters to extract
+        sample_size (int): Longest side of the downsampled image
+
+    Returns:
+        list: (lab_color, weight) tuples sorted by weight, largest first.
+            Empty if the image has too few opaque pixels.
+    """
+    lab = product_pixels(load_pixels(image, sample_size))
+    if len(lab) < MIN_OPAQUE_PIXELS:
+        return []
+
+    centers, labels = kmeans(lab, num_colors)
+    weights = np.bincount(labels, minlength=len(centers)) / len(labels)
+    order = np.argsort(weights)[::-1]
+    return [(centers[i], float(weights[i])) for i in order if weights[i] > 0]
+
+
+def score_named_colors(palette):
+    """
+    Score every named color as an advertisement color for a product palette.
+
+    Colors score higher when they are saturated, far from the product's own
+    colors (so the product stands out) and close to the complement of the
+    product's dominant hue. For neutral products (white, black, steel) the
+    hue term is replaced by lightness contrast: deep colors for light
+    products, bright colors for dark ones.
+
+    Args:
+        palette (list): Output of extract_palette
+
+    Returns:
+        np.ndarray: One score per entry of NAMED_COLOR_NAMES
+    """
+    product_lab = np.array([color for color, _ in palette])
+    weights = np.array([weight for _, weight in palette])
+    product_hue, product_chroma = lab_hue_chroma(product_lab)
+    named_hue, named_chroma = lab_hue_chroma(NAMED_COLOR_LAB)
+
+    saturation = named_chroma / named_chroma.max()
+
+    # Weighted distance from the product's colors, capped so one outlier doesn't dominate
+    distances = np.linalg.norm(NAMED_COLOR_LAB[:, None, :] - product_lab[None], axis=-1)
+    contrast = np.clip((distances * weights[None]).sum(axis=1) / 100.0, 0, 1)
+
+    chromatic = product_chroma >= NEUTRAL_CHROMA
+    if chromatic.any():
+        chromatic_weights = weights * chromatic
+        dominant_hue = product_hue[np.argmax(chromatic_weights * product_chroma)]
+        complement = (dominant_hue + 180) % 360
+        hue_gap = np.abs((named_hue - complement + 180) % 360 - 180)
+        complementarity = 1 - hue_gap / 180
+    else:
+        product_lightness = (product_lab[:, 0] * weights).sum()
+        complementarity = np.abs(NAMED_COLOR_LAB[:, 0] - product_lightness) / 100
+
+    return 0.5 * complementarity + 0.15 * saturation + 0.35 * contrast
+
+
+def pick_colors(scores, count=3):
+    """Greedily pick the best-scoring named colors that are distinct from each other."""
+    chosen = []
+    for index in np.argsort(scores)[::-1]:
+        lab = NAMED_COLOR_LAB[index]
+        if all(np.linalg.norm(lab - NAMED_COLOR_LAB[other]) >= MIN_COLOR_DISTANCE for other in chosen):
+            chosen.append(index)
+        if len(chosen) == count:
+            break
+    return [NAMED_COLOR_NAMES[index] for index in chosen]
+
+
+def recommend_colors_local(image_path, count=3):
+    """
+    Recommend advertisement colors for a product image without any API call.
+
+    Args:
+        image_path (str or PIL.Image.Image): Path to the product image, or an opened image
+        count (int): Number of colors to recommend
+
+    Returns:
+        list or None: Recommended color names, or None if the image has too
+            little visible content to analyze
+    """
+    logger = logging.getLogger(__name__)
+
+    start_time = time.time()
+    palette = extract_palette(image_path)
+    if not palette:
+        logger.warning("Not enough opaque pixels for local color analysis")
+        return None
+
+    colors = pick_colors(score_named_colors(palette), count)
+    logger.info(f"Local palette analysis completed in {(time.time() - start_time) * 1000:.1f} ms: {colors}")
+    return colors
@@ -0,0 +1,221 @@
+"""
+Input image preprocessing for AD-AI.
+
+Prepares each upload once before it is sent to OpenAI: auto-orients it from
+EXIF, downscales it to the largest size the image model uses (and further
+for the vision model), re-encodes it to a compact format with the matching
+MIME type and drops all metadata. Prepared variants are cached on disk by
+content hash and memoized in memory, so repeated calls for the same upload
+are free.
+"""
+
+import logging
+import mimetypes
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from cachetools import LRUCache
+from PIL import Image, ImageOps
+
+from .result_cache import hash_file
+
+# gpt-image-1 never renders larger than 1536px on the long side
+EDIT_MAX_SIZE = 1536
+# gpt-4o analyzes images at low detail in a 512px tile
+VISION_MAX_SIZE = 512
+# WEBP is accepted by both images.edit and the vision model and keeps alpha
+VARIANT_FORMAT = "WEBP"
+EDIT_QUALITY = 90
+VISION_QUALITY = 80
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+ORIENTATION_TAG = 0x0112
+# Image.info keys of metadata that must not leave the server (camera, location, color profile, editor data)
+METADATA_KEYS = ("exif", "icc_profile", "xmp", "XML:com.adobe.xmp", "photoshop", "iptc", "comment")
+
+
+@dataclass(frozen=True)
+class PreparedImage:
+    """An upload and the API-ready variants derived from it."""
+
+    source_path: str
+    source_hash: str
+    width: int
+    height: int
+    edit_path: str
+    edit_mime: str
+    vision_path: str
+    vision_mime: str
+
+
+def _has_alpha(image):
+    return image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+
+
+def _has_metadata(image):
+    """Return True if the image carries EXIF (including GPS), ICC, XMP or similar metadata."""
+    return bool(image.getexif()) or any(key in image.info for key in METADATA_KEYS)
+
+
+def _save_variant(image, path, quality):
+    """Encode an image atomically, without any of the source metadata."""
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    image.save(tmp_path, format=VARIANT_FORMAT, quality=quality, method=4)
+    os.replace(tmp_path, path)
+
+
+def _variant_paths(cache_dir, source_hash):
+    stem = os.path.join(cache_dir, source_hash[:2], source_hash)
+    extension = EXTENSIONS[VARIANT_FORMAT]
+    return (
+        f"{stem}_edit_{EDIT_MAX_SIZE}{extension}",
+        f"{stem}_vision_{VISION_MAX_SIZE}{extension}",
+    )
+
+
+def prepare_image(image_path, cache_dir="cache/prepared", source_hash=None):
+    """
+    Build (or reuse) the API variants of an image.
+
+    Both variants are WEBP. The edit variant keeps transparency; the vision
+    variant is flattened onto white.
+
+    Args:
+        image_path (str): Path to the uploaded image
+        cache_dir (str): Directory holding prepared variants
+        source_hash (str, optional): SHA-256 of the source, if already known
+
+    Returns:
+        PreparedImage: Paths and MIME types of the prepared variants
+    """
+    logger = logging.getLogger(__name__)
+
+    start_time = time.time()
+    if source_hash is None:
+        source_hash = hash_file(image_path)
+
+    with Image.open(image_path) as opened:
+        # Only the header is read here; pixels are decoded if variants are missing
+        alpha = _has_alpha(opened)
+        source_format = opened.format
+        width, height = opened.size
+        orientation = opened.getexif().get(ORIENTATION_TAG, 1)
+        has_metadata = _has_metadata(opened)
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+
+        edit_path, vision_path = _variant_paths(cache_dir, source_hash)
+        if not (os.path.exists(edit_path) and os.path.exists(vision_path)):
+            image = ImageOps.exif_transpose(opened)
+            image.load()
+        else:
+            image = None
+
+    if image is not None:
+        os.makedirs(os.path.dirname(edit_path), exist_ok=True)
+
+        edit_image = image.convert("RGBA" if alpha else "RGB")
+        edit_image.thumbnail((EDIT_MAX_SIZE, EDIT_MAX_SIZE), Image.Resampling.LANCZOS)
+        _save_variant(edit_image, edit_path, EDIT_QUALITY)
+
+        vision_image = edit_image.copy()
+        vision_image.thumbnail((VISION_MAX_SIZE, VISION_MAX_SIZE), Image.Resampling.LANCZOS)
+        if alpha:
+            background = Image.new("RGB", vision_image.size, (255, 255, 255))
+            background.paste(vision_image, mask=vision_image.getchannel("A"))
+            vision_image = background
+        _save_variant(vision_image, vision_path, VISION_QUALITY)
+
+        logger.info(
+            f"Prepared {image_path} in {time.time() - start_time:.2f}s: "
+            f"{os.path.getsize(image_path)} -> {os.path.getsize(edit_path)} bytes (edit), "
+            f"{os.path.getsize(vision_path)} bytes (vision)"
+        )
+
+    edit_mime = MIME_TYPES[VARIANT_FORMAT]
+    # Never upload more bytes than the original when it needed no resizing or rotation,
+    # as long as sending it as is does not leak its metadata
+    if (
+        source_format in MIME_TYPES
+        and not has_metadata
+        and orientation == 1
+        and max(width, height) <= EDIT_MAX_SIZE
+        and os.path.getsize(image_path) <= os.path.getsize(edit_path)
+    ):
+        edit_path, edit_mime = image_path, MIME_TYPES[source_format]
+
+    return PreparedImage(
+        source_path=image_path,
+        source_hash=source_hash,
+        width=width,
+        height=height,
+        edit_path=edit_path,
+        edit_mime=edit_mime,
+        vision_path=vision_path,
+        vision_mime=MIME_TYPES[VARIANT_FORMAT],
+    )
+
+
+_prepared = LRUCache(maxsize=1024)
+_prepared_lock = threading.Lock()
+
+
+def get_prepared_image(image_path):
+    """
+    Return the prepared variants of an upload, preparing it on first use.
+
+    Results are memoized by path, size and modification time. If
+    preprocessing is disabled (PREPROCESS_ENABLED=false) or the image cannot
+    be decoded, the original file is used for both variants.
+
+    Args:
+        image_path (str): Path to the uploaded image
+
+    Returns:
+        PreparedImage: Paths and MIME types to send to the API
+    """
+    logger = logging.getLogger(__name__)
+
+    stat = os.stat(image_path)
+    memo_key = (os.path.realpath(image_path), stat.st_size, stat.st_mtime_ns)
+    with _prepared_lock:
+        prepared = _prepared.get(memo_key)
+    if prepared is not None:
+        return prepared
+
+    source_hash = hash_file(image_path)
+    if os.getenv("PREPROCESS_ENABLED", "true").lower() in ("0", "false", "no"):
+        prepared = passthrough_image(image_path, source_hash)
+    else:
+        try:
+            prepared = prepare_image(
+                image_path,
+                cache_dir=os.getenv("PREPROCESS_CACHE_DIR", "cache/prepared"),
+                source_hash=source_hash,
+            )
+        except Exception as e:
+            logger.warning(f"Image preprocessing failed for {image_path}, sending original: {e}")
+            prepared = passthrough_image(image_path, source_hash)
+
+    with _prepared_lock:
+        _prepared[memo_key] = prepared
+    return prepared
+
+
+def passthrough_image(image_path, source_hash):
+    """Describe an unprocessed upload as a PreparedImage."""
+    mime_type, _ = mimetypes.guess_type(image_path)
+    mime_type = mime_type if mime_type and mime_type.startswith("image/") else "image/jpeg"
+    return PreparedImage(
+        source_path=image_path,
+        source_hash=source_hash,
+        width=0,
+        height=0,
+        edit_path=image_path,
+        edit_mime=mime_type,
+        vision_path=image_path,
+        vision_mime=mime_type,
+    )
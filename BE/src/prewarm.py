@@ -0,0 +1,260 @@
+"""
+Speculative pre-warming of uploads for AD-AI.
+
+Users upload an image first and only then type the product and brand names,
+so the upload's API variants and its color analysis are prepared in the
+background in the meantime. Results land in the caches the generation
+pipeline reads (the prepared-image memo and the color cache, keyed by image
+content), so the generation that follows starts straight at the image edit.
+
+Speculative work is bounded: at most max_concurrency prewarms run at once,
+at most max_pending are accepted at a time, each one is given timeout
+seconds, and speculative vision calls (which cost money even if the user
+never generates) are capped per minute.
+"""
+
+import asyncio
+import collections
+import logging
+import time
+from dataclasses import dataclass, field
+
+import anyio
+
+from .ad_generator import async_colors_recommendation, local_colors_recommendation
+from .color_cache import normalize_product_name
+from .preprocess import get_prepared_image
+
+PREWARM_QUEUED = "queued"
+PREWARM_RUNNING = "running"
+PREWARM_READY = "ready"
+PREWARM_FAILED = "failed"
+PREWARM_CANCELLED = "cancelled"
+
+FINISHED_STATES = (PREWARM_READY, PREWARM_FAILED, PREWARM_CANCELLED)
+
+# Analyses a prewarm can run
+ANALYSIS_LOCAL = "local"
+ANALYSIS_VISION = "vision"
+ANALYSES = (ANALYSIS_LOCAL, ANALYSIS_VISION)
+
+
+@dataclass
+class PrewarmState:
+    """Speculative work started for one upload."""
+
+    file_id: str
+    image_path: str
+    product_name: str = None
+    status: str = PREWARM_QUEUED
+    created_at: float = field(default_factory=time.time)
+    finished_at: float = None
+    local_colors: list = None
+    vision_colors: list = None
+    error: str = None
+    task: asyncio.Task = field(default=None, repr=False)
+    # Set once the API variants and the local analysis are done
+    prepared: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def covers(self, product_name):
+        """Return True if this prewarm runs the vision analysis for product_name."""
+        return bool(self.product_name) and (
+            normalize_product_name(self.product_name) == normalize_product_name(product_name)
+        )
+
+    def to_dict(self):
+        """Serialize the public prewarm state."""
+        return {
+            "file_id": self.file_id,
+            "product_name": self.product_name,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "local_colors": self.local_colors,
+            "vision_colors": self.vision_colors,
+            "error": self.error,
+        }
+
+
+class Prewarmer:
+    """
+    Runs and tracks speculative work per file_id.
+
+    Must be used from a single event loop.
+
+    Args:
+        analyses (tuple): Color analyses to run speculatively ("local", "vision")
+        max_concurrency (int): Prewarms running at the same time
+        max_pending (int): Prewarms accepted at a time (queued or running); more are skipped
+        vision_per_minute (int): Speculative vision calls allowed per minute (0 disables them)
+        timeout (float): Seconds a single prewarm may take before it is abandoned
+    """
+
+    def __init__(self, analyses=ANALYSES, max_concurrency=2, max_pending=32, vision_per_minute=10, timeout=60.0):
+        self.analyses = tuple(analyses)
+        self.max_pending = max_pending
+        self.vision_per_minute = vision_per_minute
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._states = {}
+        self._vision_calls = collections.deque()
+        self._stats = {"scheduled": 0, "ready": 0, "failed": 0, "cancelled": 0, "skipped": 0, "vision_skipped": 0}
+
+    def schedule(self, file_id, image_path, product_name=None):
+        """
+        Start pre-warming an upload.
+
+        Already running work for the same file_id is reused when it covers
+        product_name, and restarted otherwise (finished steps are cache hits).
+
+        Args:
+            file_id (str): Upload to pre-warm
+            image_path (str): Local path of the upload
+            product_name (str, optional): Product name, needed for the vision analysis
+
+        Returns:
+            PrewarmState or None: The prewarm, or None if the speculative budget is exhausted
+        """
+        logger = logging.getLogger(__name__)
+
+        existing = self._states.get(file_id)
+        if existing is not None:
+            reusable = not product_name or existing.covers(product_name)
+            if reusable and existing.status not in (PREWARM_FAILED, PREWARM_CANCELLED):
+                return existing
+            if not existing.finished:
+                existing.task.cancel()
+
+        pending = sum(1 for state in self._states.values() if not state.finished)
+        if pending >= self.max_pending:
+            self._stats["skipped"] += 1
+            logger.info(f"Skipped prewarm of {file_id}, {pending} prewarms already pending")
+            return None
+
+        state = PrewarmState(file_id=file_id, image_path=image_path, product_name=product_name or None)
+        state.task = asyncio.create_task(self._run(state))
+        self._states[file_id] = state
+        self._stats["scheduled"] += 1
+        return state
+
+    def get(self, file_id):
+        """Return the prewarm of an upload, or None."""
+        return self._states.get(file_id)
+
+    async def wait(self, file_id, product_name=None, timeout=None):
+        """
+        Wait for an upload's prewarm so a request reuses it instead of repeating its work.
+
+        The whole prewarm is awaited when it runs the vision analysis for
+        product_name; otherwise only the API variants and the local analysis are.
+        Never raises: a failed or slow prewarm just leaves the work to the caller.
+
+        Args:
+            file_id (str): Upload about to be used
+            product_name (str, optional): Product name of the request
+            timeout (float, optional): Longest wait, defaults to the prewarm timeout
+        """
+        state = self._states.get(file_id)
+        if state is None or state.finished:
+            return
+
+        timeout = timeout or self.timeout
+        if state.covers(product_name):
+            # asyncio.wait neither cancels the prewarm nor raises its outcome, so a
+            # CancelledError here always belongs to the caller
+            await asyncio.wait({state.task}, timeout=timeout)
+            return
+        try:
+            await asyncio.wait_for(state.prepared.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def cancel(self, file_id):
+        """
+        Cancel and forget the prewarm of an upload.
+
+        Returns:
+            bool: True if a running prewarm was cancelled
+        """
+        state = self._states.pop(file_id, None)
+        if state is None or state.finished:
+            return False
+        state.task.cancel()
+        return True
+
+    async def stop(self):
+        """Cancel every running prewarm."""
+        tasks = [state.task for state in self._states.values() if not state.finished]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._states.clear()
+
+    def stats(self):
+        """Return prewarm counters and the number of prewarms pending."""
+        pending = sum(1 for state in self._states.values() if not state.finished)
+        return {"pending": pending, "tracked": len(self._states), **self._stats}
+
+    def _take_vision_budget(self):
+        now = time.monotonic()
+        while self._vision_calls and self._vision_calls[0] < now - 60:
+            self._vision_calls.popleft()
+        if len(self._vision_calls) >= self.vision_per_minute:
+            return False
+        self._vision_calls.append(now)
+        return True
+
+    async def _run(self, state):
+        logger = logging.getLogger(__name__)
+
+        try:
+            async with self._semaphore:
+                state.status = PREWARM_RUNNING
+                started = time.monotonic()
+                await asyncio.wait_for(self._warm(state), timeout=self.timeout)
+            state.status = PREWARM_READY
+            self._stats["ready"] += 1
+            logger.info(f"Prewarmed upload {state.file_id} in {time.monotonic() - started:.2f} seconds")
+        except asyncio.CancelledError:
+            state.status = PREWARM_CANCELLED
+            self._stats["cancelled"] += 1
+            logger.info(f"Prewarm of upload {state.file_id} cancelled")
+            raise
+        except Exception as e:
+            state.status = PREWARM_FAILED
+            state.error = str(e) or type(e).__name__
+            self._stats["failed"] += 1
+            logger.warning(f"Prewarm of upload {state.file_id} failed: {state.error}")
+        finally:
+            state.finished_at = time.time()
+            state.prepared.set()
+            self._prune()
+
+    async def _warm(self, state):
+        logger = logging.getLogger(__name__)
+
+        # Downscaled edit and vision variants, memoized for the generation
+        await anyio.to_thread.run_sync(get_prepared_image, state.image_path, abandon_on_cancel=True)
+        if ANALYSIS_LOCAL in self.analyses:
+            state.local_colors = await anyio.to_thread.run_sync(
+                local_colors_recommendation, state.product_name or "", state.image_path, abandon_on_cancel=True
+            )
+        state.prepared.set()
+
+        if ANALYSIS_VISION not in self.analyses or not state.product_name:
+            return
+        if not self._take_vision_budget():
+            self._stats["vision_skipped"] += 1
+            logger.info(f"Skipped speculative vision analysis of {state.file_id}, budget exhausted")
+            return
+        state.vision_colors = await async_colors_recommendation(state.product_name, state.image_path)
+
+    def _prune(self):
+        # Keep the states of finished prewarms for a while so clients can inspect them
+        finished = [file_id for file_id, state in self._states.items() if state.finished]
+        for file_id in finished[:max(0, len(finished) - 4 * self.max_pending)]:
+            del self._states[file_id]
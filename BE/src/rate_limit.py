@@ -0,0 +1,464 @@
+"""
+OpenAI rate limiting for AD-AI.
+
+Every model gets one shared limiter that combines token buckets for requests
+and images per minute with an adaptive concurrency limit: the limit is
+halved when OpenAI answers 429 and grows back by one after a full window of
+successful calls. A Retry-After from OpenAI pauses every caller of that
+model, not just the one that was throttled. Calls are retried with jittered
+exponential backoff (via tenacity) until a total deadline.
+
+Calls can also go through an endpoint's circuit breaker, which rejects them
+at once while the upstream is unhealthy, and under a stage Deadline, which
+bounds every attempt by the time left and stops retrying before it passes.
+"""
+
+import asyncio
+import email.utils
+import logging
+import os
+import threading
+import time
+
+import openai
+from tenacity import (
+    AsyncRetrying,
+    Retrying,
+    retry_if_exception,
+    stop_after_attempt,
+    stop_before_delay,
+    wait_random_exponential,
+)
+
+from .deadlines import DeadlineExceeded
+from .metrics import observe_openai_call
+
+# Longest a waiting caller sleeps before re-checking the limiter
+MAX_POLL_INTERVAL = 0.25
+# How long a concurrency slot waiter sleeps before re-checking
+SLOT_POLL_INTERVAL = 0.05
+# 429s within this many seconds of a decrease count as the same burst
+DECREASE_COOLDOWN = 2.0
+
+
+class RateLimitExceeded(Exception):
+    """Raised when an OpenAI call is still rate limited after all retries."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at a per-minute rate.
+
+    Args:
+        per_minute (float): Tokens added per minute, also the bucket capacity
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost, now):
+        """Return seconds until cost tokens are available (0 if they are now)."""
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost):
+        self.tokens -= min(cost, self.capacity)
+
+
+class ModelRateLimiter:
+    """
+    Shared limiter for one OpenAI model.
+
+    Safe to use from threads and from the event loop at the same time.
+
+    Args:
+        model (str): Model name, used in logs and stats
+        requests_per_minute (int): Request quota, 0 for unlimited
+        images_per_minute (int): Image quota, 0 for unlimited
+        max_concurrency (int): Upper bound of concurrent calls
+        min_concurrency (int): Lower bound the adaptive limit never goes under
+    """
+
+    def __init__(self, model, requests_per_minute=0, images_per_minute=0, max_concurrency=8, min_concurrency=1):
+        self.model = model
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = self.max_concurrency
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._image_bucket = TokenBucket(images_per_minute) if images_per_minute > 0 else None
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "throttled": 0, "rate_limited": 0, "retries": 0}
+
+    def _try_acquire(self, images):
+        """Take a slot and tokens if available; otherwise return how long to wait."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            if self.in_flight >= self.limit:
+                wait = max(wait, SLOT_POLL_INTERVAL)
+            for bucket, cost in ((self._request_bucket, 1), (self._image_bucket, images)):
+                if bucket is not None and cost:
+                    wait = max(wait, bucket.wait_time(cost, now))
+            if wait > 0:
+                return wait
+
+            for bucket, cost in ((self._request_bucket, 1), (self._image_bucket, images)):
+                if bucket is not None and cost:
+                    bucket.consume(cost)
+            self.in_flight += 1
+            self._stats["calls"] += 1
+            return 0.0
+
+    def acquire(self, images=0, deadline=None):
+        """
+        Block until a call may start. Pair with release().
+
+        Raises DeadlineExceeded as soon as the wait would outlast deadline.
+        """
+        throttled = False
+        while (wait := self._try_acquire(images)) > 0:
+            throttled = True
+            self._check_deadline(wait, deadline)
+            time.sleep(min(wait, MAX_POLL_INTERVAL))
+        if throttled:
+            self._count("throttled")
+
+    async def acquire_async(self, images=0, deadline=None):
+        """Wait without blocking the event loop until a call may start. Pair with release()."""
+        throttled = False
+        while (wait := self._try_acquire(images)) > 0:
+            throttled = True
+            self._check_deadline(wait, deadline)
+            await asyncio.sleep(min(wait, MAX_POLL_INTERVAL))
+        if throttled:
+            self._count("throttled")
+
+    def _check_deadline(self, wait, deadline):
+        left = deadline.left() if deadline is not None else None
+        if left is not None and wait >= left:
+            self._count("throttled")
+            raise DeadlineExceeded(deadline.stage, deadline.seconds)
+
+    def release(self):
+        """Free the concurrency slot of a finished call."""
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def record_success(self):
+        """Grow the concurrency limit by one after a full window of successes."""
+        with self._lock:
+            self._successes += 1
+            if self.limit < self.max_concurrency and self._successes >= self.limit:
+                self.limit += 1
+                self._successes = 0
+
+    def record_rate_limited(self, retry_after=None):
+        """Halve the concurrency limit and pause all callers for retry_after seconds."""
+        logger = logging.getLogger(__name__)
+
+        with self._lock:
+            now = time.monotonic()
+            self._stats["rate_limited"] += 1
+            self._successes = 0
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            if now - self._last_decrease >= DECREASE_COOLDOWN:
+                self.limit = max(self.min_concurrency, self.limit // 2)
+                self._last_decrease = now
+        logger.warning(
+            f"Rate limited by OpenAI on {self.model}: concurrency limit {self.limit}"
+            f"{f', pausing {retry_after:.1f}s' if retry_after else ''}"
+        )
+
+    def record_retry(self):
+        """Count a retried call."""
+        self._count("retries")
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Return the current limit, usage and counters."""
+        with self._lock:
+            return {
+                "concurrency_limit": self.limit,
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "paused_seconds": round(max(0.0, self.blocked_until - time.monotonic()), 2),
+                **self._stats,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def get_rate_limiter(model, env_prefix):
+    """
+    Return the process-wide limiter of a model, creating it on first use.
+
+    Quotas are read from <env_prefix>_RPM, <env_prefix>_IPM and
+    <env_prefix>_MAX_CONCURRENCY.
+
+    Args:
+        model (str): Model name
+        env_prefix (str): Prefix of the model's environment settings
+
+    Returns:
+        ModelRateLimiter: The shared limiter
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limiter = ModelRateLimiter(
+                model,
+                requests_per_minute=_env_int(f"{env_prefix}_RPM", 0),
+                images_per_minute=_env_int(f"{env_prefix}_IPM", 0),
+                max_concurrency=_env_int(f"{env_prefix}_MAX_CONCURRENCY", 8),
+            )
+            _limiters[model] = limiter
+        return limiter
+
+
+def rate_limiter_stats():
+    """Return the stats of every limiter created so far, keyed by model."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.model: limiter.stats() for limiter in limiters}
+
+
+def retry_after_seconds(error):
+    """
+    Read the delay OpenAI asked for from an error response.
+
+    Returns:
+        float or None: Seconds to wait, or None if the response has no hint
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+        return max(0.0, retry_at.timestamp() - time.time()) if retry_at else None
+
+
+def is_retryable(error):
+    """Return True for OpenAI errors that are worth retrying."""
+    if isinstance(error, openai.RateLimitError):
+        # An exhausted quota does not recover by waiting
+        return getattr(error, "code", None) != "insufficient_quota"
+    return isinstance(error, (openai.APIConnectionError, openai.InternalServerError))
+
+
+def error_kind(error):
+    """Classify a failed OpenAI call for the error metrics."""
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limited"
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    if isinstance(error, openai.InternalServerError):
+        return "server_error"
+    return "client_error"
+
+
+def _record_failure(limiter, error, started):
+    """Feed a failed attempt into the metrics and, for a 429, the limiter."""
+    observe_openai_call(limiter.model, time.monotonic() - started, error_kind(error))
+    if isinstance(error, openai.RateLimitError):
+        limiter.record_rate_limited(retry_after_seconds(error))
+
+
+def _retry_settings():
+    return (
+        _env_int("OPENAI_RETRY_MAX_ATTEMPTS", 5),
+        float(os.getenv("OPENAI_RETRY_DEADLINE", "300")),
+        float(os.getenv("OPENAI_RETRY_MAX_WAIT", "30")),
+    )
+
+
+def _retry_kwargs(stage_deadline=None):
+    """Build the tenacity policy: jittered backoff that honors Retry-After, within a deadline."""
+    max_attempts, deadline, max_wait = _retry_settings()
+    jitter = wait_random_exponential(multiplier=1, max=max_wait)
+
+    def wait(retry_state):
+        retry_after = retry_after_seconds(retry_state.outcome.exception())
+        return max(retry_after or 0.0, jitter(retry_state))
+
+    def before_sleep(retry_state):
+        logging.getLogger(__name__).warning(
+            f"OpenAI call failed (attempt {retry_state.attempt_number}): "
+            f"{retry_state.outcome.exception()}; retrying in {retry_state.next_action.sleep:.1f}s"
+        )
+
+    stop = stop_after_attempt(max_attempts) | stop_before_delay(deadline)
+    if stage_deadline is not None and stage_deadline.bounded:
+        # Give up instead of sleeping past the stage deadline
+        stop = stop | (lambda retry_state: stage_deadline.left() <= (retry_state.upcoming_sleep or 0.0))
+
+    return {
+        "retry": retry_if_exception(is_retryable),
+        "wait": wait,
+        "stop": stop,
+        "before_sleep": before_sleep,
+        "reraise": True,
+    }
+
+
+def _raise_rate_limited(limiter, error):
+    raise RateLimitExceeded(
+        f"OpenAI rate limit for {limiter.model} still exceeded after retries",
+        retry_after=retry_after_seconds(error),
+    ) from error
+
+
+def call_with_rate_limit(limiter, call, images=0, breaker=None, deadline=None):
+    """
+    Run an OpenAI call under a model's limiter, retrying transient failures.
+
+    Args:
+        limiter (ModelRateLimiter): Limiter of the model being called
+        call (callable): Makes the API call; invoked once per attempt
+        images (int): Number of images the call produces
+        breaker (CircuitBreaker, optional): Breaker of the endpoint being called
+        deadline (Deadline, optional): Stage deadline; call must bound its
+            request by deadline.client_options()
+
+    Returns:
+        The result of call
+
+    Raises:
+        RateLimitExceeded: If OpenAI kept answering 429 until the retries ran out
+        CircuitOpen: If the endpoint's breaker is open
+        DeadlineExceeded: If the stage deadline passed, or the limiter could not
+            let the call start before it
+    """
+    try:
+        for attempt in Retrying(**_retry_kwargs(deadline)):
+            with attempt:
+                if attempt.retry_state.attempt_number > 1:
+                    limiter.record_retry()
+                if deadline is not None:
+                    deadline.check()
+                if breaker is not None:
+                    breaker.acquire()
+                try:
+                    limiter.acquire(images, deadline)
+                except BaseException:
+                    # Waiting on our own limiter says nothing about the upstream
+                    if breaker is not None:
+                        breaker.release()
+                    raise
+                started = time.monotonic()
+                try:
+                    result = call()
+                except BaseException as e:
+                    if isinstance(e, openai.OpenAIError):
+                        _record_failure(limiter, e, started)
+                    if breaker is not None:
+                        breaker.record_outcome(e)
+                    raise
+                finally:
+                    limiter.release()
+                if breaker is not None:
+                    breaker.record_outcome()
+                observe_openai_call(limiter.model, time.monotonic() - started)
+                limiter.record_success()
+        return result
+    except openai.RateLimitError as e:
+        _raise_rate_limited(limiter, e)
+
+
+async def async_call_with_rate_limit(limiter, call, images=0, breaker=None, deadline=None):
+    """
+    Run an async OpenAI call under a model's limiter, retrying transient failures.
+
+    Args:
+        limiter (ModelRateLimiter): Limiter of the model being called
+        call (callable): Returns a new awaitable making the API call on each attempt
+        images (int): Number of images the call produces
+        breaker (CircuitBreaker, optional): Breaker of the endpoint being called
+        deadline (Deadline, optional): Stage deadline bounding the limiter wait and every attempt
+
+    Returns:
+        The result of call
+
+    Raises:
+        RateLimitExceeded: If OpenAI kept answering 429 until the retries ran out
+        CircuitOpen: If the endpoint's breaker is open
+        DeadlineExceeded: If the stage deadline passed
+    """
+    try:
+        async for attempt in AsyncRetrying(**_retry_kwargs(deadline)):
+            with attempt:
+                if attempt.retry_state.attempt_number > 1:
+                    limiter.record_retry()
+                if deadline is not None:
+                    deadline.check()
+                if breaker is not None:
+                    breaker.acquire()
+                try:
+                    await limiter.acquire_async(images, deadline)
+                except BaseException:
+                    # Waiting on our own limiter says nothing about the upstream
+                    if breaker is not None:
+                        breaker.release()
+                    raise
+                started = time.monotonic()
+                try:
+                    result = await (deadline.run(call()) if deadline is not None else call())
+                except BaseException as e:
+                    if isinstance(e, openai.OpenAIError):
+                        _record_failure(limiter, e, started)
+                    if breaker is not None:
+                        breaker.record_outcome(e)
+                    raise
+                finally:
+                    limiter.release()
+                if breaker is not None:
+                    breaker.record_outcome()
+                observe_openai_call(limiter.model, time.monotonic() - started)
+                limiter.record_success()
+        return result
+    except openai.RateLimitError as e:
+        _raise_rate_limited(limiter, e)
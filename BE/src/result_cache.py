@@ -0,0 +1,248 @@
+"""
+Content-addressed cache for generated advertisements.
+
+Results are keyed by a hash of the input image bytes, the final prompt and
+the image model parameters, stored on disk and evicted least-recently-used
+first once the configured entry count or total size is exceeded.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """
+    Return the SHA-256 hex digest of a file's contents.
+
+    Args:
+        path (str): File to hash
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(image_hash, prompt, model_params):
+    """
+    Build the cache key for a generation.
+
+    Args:
+        image_hash (str): SHA-256 of the input image bytes
+        prompt (str): Final prompt sent to the image model
+        model_params (dict): Image model parameters (model, size, quality, ...)
+
+    Returns:
+        str: Hex digest identifying the generation
+    """
+    payload = json.dumps(
+        {"image": image_hash, "prompt": prompt, "params": model_params},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Disk-backed LRU cache of generated images.
+
+    Args:
+        cache_dir (str): Directory holding cached results
+        max_entries (int): Maximum number of cached results
+        max_bytes (int): Maximum total size of cached results
+    """
+
+    def __init__(self, cache_dir="cache/results", max_entries=500, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _load(self):
+        """Rebuild the LRU order from the files already on disk."""
+        logger = logging.getLogger(__name__)
+
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                found.append((stat.st_mtime, name, stat.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+        if found:
+            logger.info(f"Result cache loaded {len(found)} entries ({self._total_bytes} bytes)")
+        with self._lock:
+            self._evict()
+
+    def get(self, key):
+        """
+        Look up a cached result.
+
+        Args:
+            key (str): Cache key from make_cache_key
+
+        Returns:
+            str or None: Path of the cached image, or None on a miss
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            if not os.path.exists(path):
+                self._total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # Persist recency so LRU order survives restarts; only the cache's own copy is touched
+            os.utime(path)
+        return path
+
+    def copy_to(self, key, output_filename):
+        """
+        Materialize a cached result at output_filename.
+
+        Args:
+            key (str): Cache key from make_cache_key
+            output_filename (str): Destination path
+
+        Returns:
+            bool: True on a hit, False on a miss
+        """
+        path = self.get(key)
+        if path is None:
+            return False
+        try:
+            # A copy, not a link: outputs must not share the entry's inode, whose mtime tracks recency
+            _copy_atomically(path, output_filename)
+        except FileNotFoundError:
+            # Evicted by a concurrent put() since get() returned it
+            self._discard(key)
+            return False
+        return True
+
+    def _discard(self, key):
+        """Forget an entry whose file vanished after a hit, counting the lookup as a miss."""
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self.hits -= 1
+            self.misses += 1
+
+    def put(self, key, source_path):
+        """
+        Store a generated image in the cache.
+
+        Args:
+            key (str): Cache key from make_cache_key
+            source_path (str): Generated image to cache
+        """
+        logger = logging.getLogger(__name__)
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+        logger.info(f"Cached generated image under {key[:12]} ({size} bytes)")
+
+    def _evict(self):
+        """Drop least-recently-used entries until within limits. Caller holds the lock."""
+        logger = logging.getLogger(__name__)
+
+        while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            logger.info(f"Evicted cached result {key[:12]} ({size} bytes)")
+
+    def stats(self):
+        """Return hit/miss counters and current usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _copy_atomically(source, destination):
+    """Copy source to destination through a temporary file, so readers never see a partial copy."""
+    tmp_path = f"{destination}.{threading.get_ident()}.tmp"
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Return the process-wide result cache, or None if disabled.
+
+    Configured by RESULT_CACHE_ENABLED, RESULT_CACHE_DIR,
+    RESULT_CACHE_MAX_ENTRIES and RESULT_CACHE_MAX_BYTES.
+    """
+    global _cache
+    if os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache(
+                    cache_dir=os.getenv("RESULT_CACHE_DIR", "cache/results"),
+                    max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "500")),
+                    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024))),
+                )
+    return _cache
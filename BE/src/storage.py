@@ -0,0 +1,392 @@
+"""
+Storage backends for AD-AI uploads and outputs.
+
+Uploads and generated ads are kept in a storage backend shared by every
+worker, so any worker or node can serve any file_id or download. Workers
+still generate from node-local copies: an object is fetched into the local
+directory on first use and published back to storage once written.
+
+Two backends are available, selected by STORAGE_BACKEND:
+
+- "local": a directory (optionally on a shared volume) sharded into
+  hash-prefixed subdirectories so no directory grows unbounded.
+- "s3": any S3-compatible object store (AWS S3, MinIO, ...), through boto3
+  (imported only when selected). Downloads are streamed, or redirected to a
+  presigned URL when S3_PRESIGN_DOWNLOADS is enabled.
+"""
+
+import abc
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import uuid
+from dataclasses import dataclass
+
+from .derivatives import detect_media_type
+
+UPLOADS_PREFIX = "uploads"
+OUTPUTS_PREFIX = "outputs"
+BATCHES_PREFIX = "batches"
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class StoredObject:
+    """Metadata of one object in storage."""
+
+    key: str
+    size: int
+    modified: float
+    etag: str
+    content_type: str = None
+
+
+def upload_key(sha256, extension):
+    """Return the storage key of upload content; identical uploads share one object."""
+    return f"{UPLOADS_PREFIX}/{sha256}{extension}"
+
+
+def output_key(output_filename):
+    """Return the storage key of a generated ad."""
+    return f"{OUTPUTS_PREFIX}/{os.path.basename(output_filename)}"
+
+
+def batch_archive_key(batch_id):
+    """Return the storage key of a batch's zip archive."""
+    return f"{BATCHES_PREFIX}/{batch_id}.zip"
+
+
+def _validate_key(key):
+    parts = key.split("/")
+    if not key or key.startswith("/") or any(part in ("", ".", "..") for part in parts):
+        raise ValueError(f"Invalid storage key: {key}")
+
+
+def link_or_copy(source, destination):
+    """
+    Hard-link source to a new destination path, copying when linking is not possible.
+
+    destination must not exist yet; callers link to a temporary path and
+    rename it into place.
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def _temp_path(path):
+    """Return a unique temporary path next to path, for an atomic rename into place."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{uuid.uuid4().hex}.part")
+
+
+class Storage(abc.ABC):
+    """Interface of a storage backend. Keys are '/'-separated relative paths."""
+
+    backend = None
+
+    @abc.abstractmethod
+    def put_file(self, key, path, content_type=None):
+        """Store the local file at path under key, replacing any existing object."""
+
+    @abc.abstractmethod
+    def fetch(self, key, path):
+        """
+        Copy an object to a local path, atomically.
+
+        Returns:
+            str: path
+
+        Raises:
+            FileNotFoundError: If the object does not exist
+        """
+
+    @abc.abstractmethod
+    def stat(self, key):
+        """
+        Look up an object.
+
+        Returns:
+            StoredObject or None: Metadata, or None if the object does not exist
+        """
+
+    def exists(self, key):
+        """Return True if an object exists under key."""
+        return self.stat(key) is not None
+
+    @abc.abstractmethod
+    def delete(self, key):
+        """Delete an object; deleting a missing object is not an error."""
+
+    @abc.abstractmethod
+    def iter_bytes(self, key, start=None, end=None):
+        """
+        Stream an object's content in chunks.
+
+        Args:
+            key (str): Object key
+            start (int, optional): First byte to read
+            end (int, optional): Last byte to read, inclusive
+
+        Yields:
+            bytes: Chunks of at most READ_CHUNK_SIZE bytes
+        """
+
+    def local_path(self, key):
+        """Return a local path to the object if the backend has one, else None."""
+        return None
+
+    def presigned_url(self, key, filename=None):
+        """Return a temporary direct download URL if the backend supports it, else None."""
+        return None
+
+
+class LocalStorage(Storage):
+    """
+    Storage in a local (or shared network) directory.
+
+    An object "outputs/ad.jpg" lives at <root>/outputs/ab/cd/ad.jpg, where
+    abcd are the first hex digits of the SHA-256 of its name.
+
+    Args:
+        root (str): Directory holding all objects
+    """
+
+    backend = "local"
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        _validate_key(key)
+        directory, name = os.path.split(key)
+        shard = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, directory, shard[:2], shard[2:4], name)
+
+    def put_file(self, key, path, content_type=None):
+        destination = self._path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        tmp_path = _temp_path(destination)
+        try:
+            link_or_copy(path, tmp_path)
+            os.replace(tmp_path, destination)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def fetch(self, key, path):
+        source = self._path(key)
+        if not os.path.isfile(source):
+            raise FileNotFoundError(f"Object not found in storage: {key}")
+        tmp_path = _temp_path(path)
+        try:
+            link_or_copy(source, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def stat(self, key):
+        try:
+            stat_result = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return StoredObject(
+            key=key,
+            size=stat_result.st_size,
+            modified=stat_result.st_mtime,
+            etag=f"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}",
+        )
+
+    def delete(self, key):
+        path = self._path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def iter_bytes(self, key, start=None, end=None):
+        with open(self._path(key), "rb") as stored_file:
+            if start:
+                stored_file.seek(start)
+            remaining = None if end is None else end - (start or 0) + 1
+            while remaining is None or remaining > 0:
+                chunk = stored_file.read(READ_CHUNK_SIZE if remaining is None else min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def local_path(self, key):
+        path = self._path(key)
+        return path if os.path.isfile(path) else None
+
+
+class S3Storage(Storage):
+    """
+    Storage in an S3-compatible bucket.
+
+    Args:
+        bucket (str): Bucket name
+        prefix (str): Prefix prepended to every key
+        endpoint_url (str, optional): Endpoint of a non-AWS store such as MinIO
+        region (str, optional): Bucket region
+        presign_downloads (bool): Redirect downloads to presigned URLs instead of streaming them
+        presign_expiry (int): Lifetime of presigned URLs in seconds
+    """
+
+    backend = "s3"
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, region=None,
+                 presign_downloads=False, presign_expiry=3600):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the boto3 package (pip install boto3)") from e
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.presign_downloads = presign_downloads
+        self.presign_expiry = presign_expiry
+        # Path-style addressing works with MinIO and other S3-compatible stores
+        self._client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=Config(s3={"addressing_style": "path"}, retries={"mode": "standard"}),
+        )
+
+    def _object_key(self, key):
+        _validate_key(key)
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    @staticmethod
+    def _is_missing(error):
+        code = error.response.get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def put_file(self, key, path, content_type=None):
+        extra_args = {"ContentType": content_type} if content_type else None
+        self._client.upload_file(path, self.bucket, self._object_key(key), ExtraArgs=extra_args)
+
+    def fetch(self, key, path):
+        from botocore.exceptions import ClientError
+
+        tmp_path = _temp_path(path)
+        try:
+            self._client.download_file(self.bucket, self._object_key(key), tmp_path)
+            os.replace(tmp_path, path)
+        except ClientError as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(f"Object not found in storage: {key}") from e
+            raise
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    def stat(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self._client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if self._is_missing(e):
+                return None
+            raise
+        return StoredObject(
+            key=key,
+            size=head["ContentLength"],
+            modified=head["LastModified"].timestamp(),
+            etag=head["ETag"].strip('"'),
+            content_type=head.get("ContentType"),
+        )
+
+    def delete(self, key):
+        self._client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def iter_bytes(self, key, start=None, end=None):
+        request = {"Bucket": self.bucket, "Key": self._object_key(key)}
+        if start is not None or end is not None:
+            request["Range"] = f"bytes={start or 0}-{'' if end is None else end}"
+        body = self._client.get_object(**request)["Body"]
+        try:
+            yield from body.iter_chunks(READ_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def presigned_url(self, key, filename=None):
+        if not self.presign_downloads:
+            return None
+        params = {"Bucket": self.bucket, "Key": self._object_key(key)}
+        if filename:
+            params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+        return self._client.generate_presigned_url("get_object", Params=params, ExpiresIn=self.presign_expiry)
+
+
+def create_storage_from_env():
+    """
+    Build the storage backend configured by the environment.
+
+    STORAGE_BACKEND selects "local" (STORAGE_DIR) or "s3" (S3_BUCKET,
+    S3_PREFIX, S3_ENDPOINT_URL, S3_REGION, S3_PRESIGN_DOWNLOADS,
+    S3_PRESIGN_EXPIRY).
+
+    Returns:
+        Storage: The configured backend
+    """
+    backend = os.getenv("STORAGE_BACKEND", "local").lower()
+    if backend == "local":
+        return LocalStorage(os.getenv("STORAGE_DIR", "storage"))
+    if backend == "s3":
+        bucket = os.getenv("S3_BUCKET")
+        if not bucket:
+            raise ValueError("S3_BUCKET is required when STORAGE_BACKEND=s3")
+        return S3Storage(
+            bucket,
+            prefix=os.getenv("S3_PREFIX", ""),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+            region=os.getenv("S3_REGION") or None,
+            presign_downloads=os.getenv("S3_PRESIGN_DOWNLOADS", "false").lower() in ("1", "true", "yes"),
+            presign_expiry=int(os.getenv("S3_PRESIGN_EXPIRY", "3600")),
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend}, expected local or s3")
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Return the process-wide storage backend, creating it on first use."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage_from_env()
+    return _storage
+
+
+def publish_output(output_filename):
+    """
+    Copy a finished output file into storage so every worker can serve it.
+
+    Args:
+        output_filename (str): Local path of the generated file
+
+    Returns:
+        str: Storage key of the output
+    """
+    logger = logging.getLogger(__name__)
+
+    storage = get_storage()
+    key = output_key(output_filename)
+    storage.put_file(key, output_filename, content_type=detect_media_type(output_filename, None))
+    logger.info(f"Published {output_filename} to {storage.backend} storage as {key}")
+    return key
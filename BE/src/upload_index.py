@@ -0,0 +1,211 @@
+"""
+Persistent index of uploads for AD-AI.
+
+Maps each file_id to its stored path and metadata in SQLite, so resolving or
+cleaning up an upload is a primary-key lookup instead of a scan of the upload
+directory. The index can be reconciled with the files on disk at startup.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+from PIL import Image
+
+from .result_cache import hash_file
+from .storage import upload_key
+from .uploads import ACCEPTED_FORMATS
+
+FILE_ID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    file_id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    mime_type TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS uploads_sha256 ON uploads (sha256);
+"""
+
+
+@dataclass(frozen=True)
+class UploadRecord:
+    """Metadata of one stored upload."""
+
+    file_id: str
+    path: str
+    size: int
+    sha256: str
+    mime_type: str
+    width: int
+    height: int
+    created_at: float
+
+    @property
+    def storage_key(self):
+        """Storage key of the upload's content."""
+        return upload_key(self.sha256, os.path.splitext(self.path)[1])
+
+    @classmethod
+    def from_stored_upload(cls, stored):
+        """Build a record from a StoredUpload."""
+        return cls(
+            file_id=stored.file_id,
+            path=stored.path,
+            size=stored.size,
+            sha256=stored.sha256,
+            mime_type=stored.mime_type,
+            width=stored.width,
+            height=stored.height,
+            created_at=time.time(),
+        )
+
+
+class UploadIndex:
+    """
+    SQLite-backed file_id -> upload metadata index.
+
+    Args:
+        db_path (str): Path of the SQLite database file
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def add(self, record):
+        """Insert or replace the record for a file_id."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (record.file_id, record.path, record.size, record.sha256, record.mime_type,
+                 record.width, record.height, record.created_at),
+            )
+
+    def get(self, file_id):
+        """
+        Look up an upload.
+
+        Returns:
+            UploadRecord or None: The record, or None if the file_id is unknown
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM uploads WHERE file_id = ?", (file_id,)).fetchone()
+        return UploadRecord(*row) if row else None
+
+    def remove(self, file_id):
+        """
+        Delete an upload from the index.
+
+        Returns:
+            UploadRecord or None: The removed record, or None if the file_id was unknown
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM uploads WHERE file_id = ?", (file_id,)).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM uploads WHERE file_id = ?", (file_id,))
+        return UploadRecord(*row) if row else None
+
+    def count(self):
+        """Return the number of indexed uploads."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+
+    def references(self, sha256):
+        """Return how many file_ids point at the same content."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM uploads WHERE sha256 = ?", (sha256,)).fetchone()[0]
+
+    def reconcile(self, upload_dir, storage=None):
+        """
+        Bring the index in line with the uploads on disk.
+
+        Drops records whose file is gone and indexes upload files that have no
+        record (e.g. after the database was lost or uploads were restored from
+        a backup). Only runs a full rebuild when the two disagree.
+
+        Args:
+            upload_dir (str): Directory holding uploads
+            storage (Storage, optional): Shared storage; records whose file is
+                missing locally are kept while their content is still stored there
+
+        Returns:
+            int: Number of records added or removed
+        """
+        logger = logging.getLogger(__name__)
+
+        on_disk = {}
+        for name in os.listdir(upload_dir):
+            file_id, _ = os.path.splitext(name)
+            path = os.path.join(upload_dir, name)
+            if FILE_ID_PATTERN.match(file_id) and os.path.isfile(path):
+                on_disk[file_id] = path
+
+        with self._lock:
+            indexed = dict(self._conn.execute("SELECT file_id, path FROM uploads").fetchall())
+        if indexed == on_disk:
+            return 0
+
+        logger.info(f"Rebuilding upload index: {len(indexed)} records, {len(on_disk)} files on disk")
+        changes = 0
+        for file_id, path in indexed.items():
+            if on_disk.get(file_id) == path:
+                continue
+            # Uploaded through another worker, which shares the index and storage
+            if file_id not in on_disk and storage is not None:
+                record = self.get(file_id)
+                if record is not None and storage.exists(record.storage_key):
+                    continue
+            self.remove(file_id)
+            changes += 1
+
+        for file_id, path in on_disk.items():
+            if indexed.get(file_id) == path:
+                continue
+            try:
+                self.add(_record_from_file(file_id, path))
+                changes += 1
+            except Exception as e:
+                logger.warning(f"Could not index upload {path}: {e}")
+
+        logger.info(f"Upload index rebuilt with {changes} changes")
+        return changes
+
+
+def _record_from_file(file_id, path):
+    """Build a record by inspecting an upload that is already on disk."""
+    with Image.open(path) as image:
+        image_format = image.format
+        width, height = image.size
+    mime_type = ACCEPTED_FORMATS.get(image_format, (None, "application/octet-stream"))[1]
+    stat = os.stat(path)
+    return UploadRecord(
+        file_id=file_id,
+        path=path,
+        size=stat.st_size,
+        sha256=hash_file(path),
+        mime_type=mime_type,
+        width=width,
+        height=height,
+        created_at=stat.st_mtime,
+    )
@@ -0,0 +1,215 @@
+"""
+Upload storage for AD-AI.
+
+Uploads are streamed to disk in chunks without blocking the event loop,
+size-limited and hashed while they stream, and checked with a lazy Pillow
+open before they are accepted. Identical content is stored once as a blob;
+every file_id is a hard link to that blob. When a shared storage backend is
+given, the blob is also published there so other workers can fetch it.
+"""
+
+import hashlib
+import logging
+import os
+import uuid
+from dataclasses import dataclass
+
+import anyio
+from PIL import Image
+
+from .result_cache import hash_file
+from .storage import link_or_copy, upload_key
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+BLOB_DIR_NAME = "blobs"
+INCOMING_DIR_NAME = ".incoming"
+
+# Formats accepted by the image model, mapped to their stored extension and MIME type
+ACCEPTED_FORMATS = {
+    "JPEG": (".jpg", "image/jpeg"),
+    "PNG": (".png", "image/png"),
+    "WEBP": (".webp", "image/webp"),
+}
+
+
+class UploadRejected(Exception):
+    """Raised when an upload is refused; carries the HTTP status to report."""
+
+    status_code = 400
+
+
+class UploadTooLarge(UploadRejected):
+    status_code = 413
+
+
+class UnsupportedImage(UploadRejected):
+    status_code = 415
+
+
+@dataclass(frozen=True)
+class StoredUpload:
+    """Where an accepted upload was stored and what it contains."""
+
+    file_id: str
+    path: str
+    blob_path: str
+    size: int
+    sha256: str
+    mime_type: str
+    width: int
+    height: int
+    deduplicated: bool
+
+
+def inspect_image(path, max_pixels):
+    """
+    Check an image's header without decoding its pixels.
+
+    Args:
+        path (str): File to inspect
+        max_pixels (int): Largest accepted width * height
+
+    Returns:
+        tuple: (format, width, height)
+
+    Raises:
+        UnsupportedImage: If the file is corrupt or not an accepted image format
+        UploadTooLarge: If the image is a decompression bomb
+    """
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+            width, height = image.size
+            if image_format not in ACCEPTED_FORMATS:
+                raise UnsupportedImage(
+                    f"Unsupported image format {image_format}, expected one of: {', '.join(ACCEPTED_FORMATS)}"
+                )
+            if width * height > max_pixels:
+                raise UploadTooLarge(f"Image is too large ({width}x{height} pixels)")
+            image.verify()
+    except UploadRejected:
+        raise
+    except Image.DecompressionBombError as e:
+        raise UploadTooLarge("Image is too large to decode safely") from e
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Rejected unreadable image {path}: {e}")
+        raise UnsupportedImage("File is not a valid image") from e
+
+    return image_format, width, height
+
+
+async def store_upload(upload_file, upload_dir, max_bytes, max_pixels=Image.MAX_IMAGE_PIXELS, storage=None):
+    """
+    Stream an upload to disk, validate it and deduplicate its content.
+
+    Args:
+        upload_file (UploadFile): Incoming FastAPI upload
+        upload_dir (str): Directory holding uploads
+        max_bytes (int): Largest accepted upload size
+        max_pixels (int): Largest accepted width * height
+        storage (Storage, optional): Shared storage the content is published to
+
+    Returns:
+        StoredUpload: Where the upload was stored
+
+    Raises:
+        UploadRejected: If the upload is too large, corrupt or not an accepted image
+    """
+    logger = logging.getLogger(__name__)
+
+    file_id = str(uuid.uuid4())
+    incoming_dir = os.path.join(upload_dir, INCOMING_DIR_NAME)
+    blob_dir = os.path.join(upload_dir, BLOB_DIR_NAME)
+    await anyio.Path(incoming_dir).mkdir(parents=True, exist_ok=True)
+    await anyio.Path(blob_dir).mkdir(parents=True, exist_ok=True)
+
+    incoming_path = os.path.join(incoming_dir, f"{file_id}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with await anyio.open_file(incoming_path, "wb") as buffer:
+            while chunk := await upload_file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds the {max_bytes} byte limit")
+                digest.update(chunk)
+                await buffer.write(chunk)
+
+        if size == 0:
+            raise UploadRejected("Uploaded file is empty")
+
+        image_format, width, height = await anyio.to_thread.run_sync(inspect_image, incoming_path, max_pixels)
+        extension, mime_type = ACCEPTED_FORMATS[image_format]
+        sha256 = digest.hexdigest()
+
+        blob_path = os.path.join(blob_dir, f"{sha256}{extension}")
+        deduplicated = await anyio.Path(blob_path).exists()
+        if deduplicated:
+            await anyio.Path(incoming_path).unlink()
+        else:
+            await anyio.Path(incoming_path).rename(blob_path)
+    except BaseException:
+        await anyio.Path(incoming_path).unlink(missing_ok=True)
+        raise
+
+    path = os.path.join(upload_dir, f"{file_id}{extension}")
+    await anyio.to_thread.run_sync(link_or_copy, blob_path, path)
+    if storage is not None:
+        await anyio.to_thread.run_sync(_publish_blob, storage, upload_key(sha256, extension), blob_path, mime_type)
+
+    logger.info(
+        f"Stored upload {file_id}: {size} bytes, {width}x{height} {image_format}"
+        f"{' (deduplicated)' if deduplicated else ''}"
+    )
+    return StoredUpload(
+        file_id=file_id,
+        path=path,
+        blob_path=blob_path,
+        size=size,
+        sha256=sha256,
+        mime_type=mime_type,
+        width=width,
+        height=height,
+        deduplicated=deduplicated,
+    )
+
+
+def _publish_blob(storage, key, blob_path, mime_type):
+    """Copy a blob to shared storage unless identical content is already there."""
+    if not storage.exists(key):
+        storage.put_file(key, blob_path, content_type=mime_type)
+
+
+def release_upload(path, upload_dir, sha256=None, storage=None):
+    """
+    Remove a file_id's link and delete its blob once nothing points to it.
+
+    Args:
+        path (str): Path of the file_id link
+        upload_dir (str): Directory holding uploads
+        sha256 (str, optional): Content hash, computed from the file if not given
+        storage (Storage, optional): Shared storage to delete the content from as
+            well; only pass it once no other file_id references the content
+    """
+    logger = logging.getLogger(__name__)
+
+    if sha256 is None:
+        if not os.path.exists(path):
+            return
+        sha256 = hash_file(path)
+    extension = os.path.splitext(path)[1]
+    blob_path = os.path.join(upload_dir, BLOB_DIR_NAME, f"{sha256}{extension}")
+
+    # Delete the shared copy first: on local storage it is one more link to the blob
+    if storage is not None:
+        storage.delete(upload_key(sha256, extension))
+        logger.info(f"Removed unreferenced upload from storage: {sha256}{extension}")
+
+    if os.path.exists(path):
+        os.remove(path)
+        logger.info(f"Cleaned up: {path}")
+
+    # A blob with a single remaining link is no longer used by any file_id
+    if os.path.exists(blob_path) and os.stat(blob_path).st_nlink <= 1:
+        os.remove(blob_path)
+        logger.info(f"Removed unreferenced blob: {blob_path}")
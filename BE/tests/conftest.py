@@ -0,0 +1,21 @@
+import os
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ["LOG_FILE"] = ""
+os.environ["PREWARM_ENABLED"] = "false"
+
+
+@pytest.fixture(scope="session", autouse=True)
+def scratch_workdir(tmp_path_factory):
+    """Run in a scratch directory so uploads, outputs, caches and SQLite indexes stay out of the checkout."""
+    previous = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("workdir"))
+    yield
+    os.chdir(previous)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
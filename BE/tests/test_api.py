@@ -0,0 +1,107 @@
+import base64
+import importlib
+import io
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from src import ad_generator
+
+
+def png_bytes(color, size=(256, 256)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class FakeImages:
+    """images.edit of the fake client: answers every edit with a generated PNG."""
+
+    def __init__(self):
+        self.calls = []
+
+    async def edit(self, **params):
+        self.calls.append(params)
+        image = base64.b64encode(png_bytes((30, 90, 200))).decode("ascii")
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=image)] * params.get("n", 1))
+
+
+class FakeAsyncOpenAI:
+    def __init__(self):
+        self.images = FakeImages()
+
+    def with_options(self, **options):
+        return self
+
+
+@pytest.fixture(scope="module")
+def openai_client():
+    return FakeAsyncOpenAI()
+
+
+@pytest.fixture(scope="module")
+def client(openai_client):
+    # Imported here, once the scratch working directory is in place
+    main = importlib.import_module("main")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(ad_generator, "get_async_openai_client", lambda: openai_client)
+        with TestClient(main.app) as test_client:
+            yield test_client
+
+
+@pytest.fixture(scope="module")
+def generated(client):
+    upload = client.post(
+        "/upload-image", files={"file": ("mug.png", png_bytes((200, 30, 30)), "image/png")}
+    ).json()
+    response = client.post("/generate-ad", data={
+        "product_name": "Mug", "brand_name": "Brand", "file_id": upload["file_id"], "colors": "red, blue",
+        "output_format": "png"
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_generate_uses_the_patched_client(generated, openai_client):
+    assert generated["colors_used"] == ["red", "blue"]
+    assert openai_client.images.calls[0]["prompt"]
+
+
+def test_download_supports_etags(client, generated):
+    response = client.get(generated["download_url"])
+    assert response.status_code == 200
+    assert response.content == png_bytes((30, 90, 200))
+    etag = response.headers["etag"]
+
+    cached = client.get(generated["download_url"], headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+    assert client.get(generated["download_url"], headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_download_supports_ranges(client, generated):
+    full = client.get(generated["download_url"]).content
+
+    response = client.get(generated["download_url"], headers={"Range": "bytes=0-7"})
+    assert response.status_code == 206
+    assert response.content == full[:8] == b"\x89PNG\r\n\x1a\n"
+    assert response.headers["content-range"] == f"bytes 0-7/{len(full)}"
+
+    suffix = client.get(generated["download_url"], headers={"Range": "bytes=-4"})
+    assert suffix.status_code == 206
+    assert suffix.content == full[-4:]
+
+
+def test_download_rejects_unknown_files(client):
+    assert client.get("/download/missing.png").status_code == 404
+    assert client.get("/download/.env").status_code == 404
+
+
+def test_metrics_report_the_generation(client, generated):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'stage="edit"' in response.text
+    assert "adai_job_queue_depth" in response.text
@@ -0,0 +1,82 @@
+import httpx
+import openai
+import pytest
+
+from src import circuit_breaker
+from src.circuit_breaker import BREAKER_CLOSED, BREAKER_HALF_OPEN, BREAKER_OPEN, CircuitBreaker, CircuitOpen
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def connection_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/images/edits"))
+
+
+def call(breaker, error=None):
+    breaker.acquire()
+    breaker.record_outcome(error)
+
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    breaker = CircuitBreaker("edits", failure_rate=0.5, minimum_calls=4, open_seconds=30.0)
+    call(breaker)
+    call(breaker, connection_error())
+    call(breaker)
+    assert breaker.state == BREAKER_CLOSED
+
+    call(breaker, connection_error())
+    assert breaker.state == BREAKER_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+
+    clock.now += 30.0
+    assert breaker.state == BREAKER_HALF_OPEN
+    breaker.acquire()
+    # Only one probe at a time
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+    breaker.record_outcome()
+    assert breaker.state == BREAKER_CLOSED
+    assert breaker.stats()["opened"] == 1
+    assert breaker.stats()["rejected"] == 2
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = CircuitBreaker("edits", minimum_calls=1, open_seconds=10.0)
+    call(breaker, TimeoutError())
+    clock.now += 10.0
+
+    call(breaker, connection_error())
+    assert breaker.state == BREAKER_OPEN
+    assert breaker.stats()["opened"] == 2
+
+
+def test_client_errors_do_not_count_as_failures(clock):
+    breaker = CircuitBreaker("edits", minimum_calls=1)
+    call(breaker, ValueError("bad request"))
+
+    assert breaker.state == BREAKER_CLOSED
+    assert breaker.stats()["window_calls"] == 0
+
+
+def test_released_probe_frees_its_slot(clock):
+    breaker = CircuitBreaker("edits", minimum_calls=1, open_seconds=5.0)
+    call(breaker, connection_error())
+    clock.now += 5.0
+
+    breaker.acquire()
+    breaker.release()
+    breaker.acquire()
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from src.coalesce import SingleFlight, request_fingerprint
+
+
+def test_fingerprint_ignores_per_request_arguments():
+    first = request_fingerprint("abc", {"product_name": "Mug", "output_filename": "a.jpg"})
+    second = request_fingerprint("abc", {"product_name": "Mug", "output_filename": "b.jpg"})
+
+    assert first == second
+    assert first != request_fingerprint("abc", {"product_name": "Cup", "output_filename": "a.jpg"})
+
+
+@pytest.mark.anyio
+async def test_concurrent_callers_share_one_call():
+    flights = SingleFlight()
+    release = asyncio.Event()
+    calls = []
+
+    async def generate(progress_callback, preview_callback):
+        calls.append(1)
+        progress_callback("edit")
+        await release.wait()
+        return "ad.jpg"
+
+    stages = []
+    first = asyncio.create_task(flights.run("key", generate))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(flights.run("key", generate, progress_callback=stages.append))
+    await asyncio.sleep(0)
+    # A late joiner is told the stage the shared call is in
+    assert stages == ["edit"]
+    assert flights.in_flight() == 1
+
+    release.set()
+    assert await first == ("ad.jpg", False)
+    assert await second == ("ad.jpg", True)
+    assert calls == [1]
+    assert flights.stats() == {"in_flight": 0, "started": 1, "coalesced": 1, "cancelled": 0}
+
+
+@pytest.mark.anyio
+async def test_shared_call_is_cancelled_only_with_its_last_caller():
+    flights = SingleFlight()
+    started = asyncio.Event()
+    shared = []
+
+    async def generate(progress_callback, preview_callback):
+        shared.append(asyncio.current_task())
+        started.set()
+        await asyncio.Event().wait()
+
+    first = asyncio.create_task(flights.run("key", generate))
+    second = asyncio.create_task(flights.run("key", generate))
+    await started.wait()
+
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    assert not shared[0].done()
+    assert flights.in_flight() == 1
+
+    second.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await second
+    with pytest.raises(asyncio.CancelledError):
+        await shared[0]
+    assert flights.in_flight() == 0
+    assert flights.stats()["cancelled"] == 1
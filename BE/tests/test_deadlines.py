@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from src.deadlines import Deadline, DeadlineExceeded, stage_deadline
+
+
+@pytest.mark.anyio
+async def test_run_returns_the_result_within_the_deadline():
+    async def answer():
+        return 42
+
+    assert await Deadline("edit", 5.0).run(answer()) == 42
+    assert await Deadline("edit", 0).run(answer()) == 42
+
+
+@pytest.mark.anyio
+async def test_run_cancels_the_awaitable_once_the_deadline_passes():
+    cancelled = asyncio.Event()
+
+    async def hang():
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(DeadlineExceeded) as raised:
+        await Deadline("colors", 0.05).run(hang())
+    assert raised.value.stage == "colors"
+    assert cancelled.is_set()
+
+
+@pytest.mark.anyio
+async def test_run_keeps_timeouts_of_the_awaitable_itself():
+    async def times_out():
+        raise TimeoutError("socket timed out")
+
+    with pytest.raises(TimeoutError) as raised:
+        await Deadline("edit", 5.0).run(times_out())
+    assert not isinstance(raised.value, DeadlineExceeded)
+
+
+def test_client_options_carry_the_time_left():
+    assert Deadline("edit", 0).client_options() == {}
+    assert 0 < Deadline("edit", 10.0).client_options()["timeout"] <= 10.0
+
+    expired = Deadline("edit", 0.001)
+    expired.expires_at -= 1
+    with pytest.raises(DeadlineExceeded):
+        expired.client_options()
+
+
+def test_stage_deadline_reads_the_environment(monkeypatch):
+    monkeypatch.setenv("DEADLINE_EDIT_SECONDS", "7.5")
+    assert stage_deadline("edit").seconds == 7.5
+    monkeypatch.setenv("DEADLINE_EDIT_SECONDS", "0")
+    assert not stage_deadline("edit").bounded
@@ -0,0 +1,50 @@
+import logging
+import os
+import threading
+
+from PIL import Image
+
+from src import derivatives
+
+
+def test_concurrent_requests_render_a_derivative_once(tmp_path, caplog):
+    source = tmp_path / "ad.png"
+    Image.new("RGB", (1024, 1024), (20, 120, 220)).save(source)
+    cache_dir = str(tmp_path / "derivatives")
+    start = threading.Barrier(8)
+    paths = []
+
+    def request():
+        start.wait()
+        paths.append(derivatives.get_derivative(str(source), "thumb", cache_dir))
+
+    caplog.set_level(logging.INFO, logger=derivatives.__name__)
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(paths)) == 1
+    assert sum(record.getMessage().startswith("Rendered thumb") for record in caplog.records) == 1
+    assert os.listdir(cache_dir) == ["ad_thumb.webp"]
+    with Image.open(paths[0]) as thumb:
+        assert thumb.size == (256, 256)
+    # Locks are dropped once nobody waits on them
+    assert derivatives._render_locks == {}
+
+
+def test_derivative_is_rendered_again_when_the_source_changes(tmp_path):
+    source = tmp_path / "ad.png"
+    Image.new("RGB", (512, 512), "red").save(source)
+    cache_dir = str(tmp_path / "derivatives")
+    path = derivatives.get_derivative(str(source), "preview", cache_dir)
+    assert derivatives.get_derivative(str(source), "preview", cache_dir) == path
+    assert derivatives._render_locks == {}
+
+    Image.new("RGB", (512, 512), "blue").save(source)
+    stat = os.stat(path)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert derivatives.get_derivative(str(source), "preview", cache_dir) == path
+    with Image.open(path) as preview:
+        assert preview.convert("RGB").getpixel((0, 0))[2] > 200
@@ -0,0 +1,84 @@
+import hashlib
+import logging
+import os
+
+import pytest
+from PIL import Image
+
+from src import ad_generator
+from src.circuit_breaker import CircuitOpen
+from src.fallback_render import get_fallback_pool, shutdown_fallback_pool
+from src.outputs import write_image_bytes
+
+
+@pytest.fixture
+def product_image(tmp_path):
+    path = tmp_path / "product.png"
+    Image.new("RGB", (64, 64), (200, 30, 30)).save(path)
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def fallback_pool():
+    yield
+    shutdown_fallback_pool()
+
+
+@pytest.fixture
+def image_api_down(monkeypatch):
+    def edit(*args, **kwargs):
+        raise CircuitOpen("images.edit", 30.0)
+
+    async def async_edit(*args, **kwargs):
+        edit()
+
+    monkeypatch.setattr(ad_generator, "edit_image_with_openai", edit)
+    monkeypatch.setattr(ad_generator, "async_edit_image_with_openai", async_edit)
+
+
+def test_write_image_bytes_is_atomic(tmp_path):
+    target = tmp_path / "ad.png"
+    saved = write_image_bytes(b"encoded image", str(target))
+
+    assert target.read_bytes() == b"encoded image"
+    assert saved.size == len(b"encoded image")
+    assert saved.sha256 == hashlib.sha256(b"encoded image").hexdigest()
+    assert os.listdir(tmp_path) == ["ad.png"]
+
+
+def test_color_variants_fall_back_per_output(tmp_path, product_image, image_api_down):
+    outputs = [str(tmp_path / "red.png"), str(tmp_path / "blue.png")]
+    results = ad_generator.generate_ad_variants(
+        "Mug", "Brand", product_image, outputs, color_variants=[["red"], ["blue"]], client=object(),
+        use_cache=False
+    )
+
+    assert [result["fallback"] for result in results] == [True, True]
+    assert [result["colors_used"] for result in results] == [["red"], ["blue"]]
+    for output in outputs:
+        with Image.open(output) as image:
+            assert image.size == (1024, 1024)
+
+
+@pytest.mark.anyio
+async def test_async_shared_prompt_variants_fall_back(tmp_path, product_image, image_api_down):
+    outputs = [str(tmp_path / "first.jpg"), str(tmp_path / "second.jpg")]
+    results = await ad_generator.async_generate_ad_variants(
+        "Mug", "Brand", product_image, outputs, colors="red, blue", client=object(), use_cache=False
+    )
+
+    assert [result["output_filename"] for result in results] == outputs
+    assert all(result["fallback"] and result["colors_used"] == ["red", "blue"] for result in results)
+    assert all(os.path.getsize(output) == result["output_size"] for output, result in zip(outputs, results))
+
+
+def test_renderer_processes_keep_their_log_records(tmp_path, monkeypatch):
+    log_file = tmp_path / "renderer.log"
+    monkeypatch.setenv("LOG_FILE", str(log_file))
+    shutdown_fallback_pool()
+
+    logger = logging.getLogger("src.fallback_render")
+    get_fallback_pool().submit(logger.warning, "Font not found, using the default font").result()
+    shutdown_fallback_pool()
+
+    assert "Font not found, using the default font" in log_file.read_text()
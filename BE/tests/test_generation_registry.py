@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from src.generation_registry import GenerationRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = GenerationRegistry(str(tmp_path / "generations.sqlite3"))
+    yield registry
+    registry.close()
+
+
+def test_write_behind_applies_writes_in_order(registry):
+    registry.write_behind(registry.register, "gen", "file")
+    registry.write_behind(registry.update_stage, "gen", "edit")
+    registry.write_behind(registry.finish, "gen")
+    # A late stage update must not resurrect the finished row
+    registry.write_behind(registry.update_stage, "gen", "save").result(timeout=5)
+    assert registry.get("gen") is None
+
+    registry.write_behind(registry.register, "other", "file").result(timeout=5)
+    assert registry.get("other").stage == "starting"
+
+
+def test_cancel_request_is_kept_when_the_stage_changes(registry):
+    registry.register("gen", "file")
+    assert registry.request_cancel(file_id="file") == 1
+    registry.register("gen", "file", stage="edit")
+    assert registry.get("gen").cancel_requested
+    assert registry.pending_cancellations() == ["gen"]
+
+
+@pytest.mark.anyio
+async def test_watch_reports_each_cancellation_once(registry):
+    registry.register("gen", "file")
+    registry.request_cancel(generation_id="gen")
+    cancelled = []
+
+    watcher = asyncio.create_task(registry.watch(cancelled.append, interval=0.01))
+    await asyncio.sleep(0.2)
+    watcher.cancel()
+    await asyncio.gather(watcher, return_exceptions=True)
+    assert cancelled == ["gen"]
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from src.jobs import JOB_CANCELLED, JOB_RUNNING, JOB_SUCCEEDED, JobManager, QueueFullError
+
+pytestmark = pytest.mark.anyio
+
+
+async def wait_for_status(manager, job, status, timeout=2.0):
+    async with asyncio.timeout(timeout):
+        while manager.get(job.job_id).status != status:
+            await asyncio.sleep(0.01)
+
+
+async def test_job_runs_to_completion():
+    async def runner(params, progress_callback):
+        progress_callback("edit")
+        return {"output_filename": params["name"]}
+
+    manager = JobManager(runner, num_workers=1)
+    await manager.start()
+    try:
+        job = manager.submit({"name": "ad.png"})
+        await wait_for_status(manager, job, JOB_SUCCEEDED)
+        assert job.result == {"output_filename": "ad.png"}
+    finally:
+        await manager.stop()
+
+
+async def test_cancel_running_job_keeps_worker_alive():
+    started = asyncio.Event()
+
+    async def runner(params, progress_callback):
+        if params.get("block"):
+            started.set()
+            await asyncio.sleep(60)
+        return params
+
+    manager = JobManager(runner, num_workers=1)
+    await manager.start()
+    try:
+        blocked = manager.submit({"block": True})
+        await started.wait()
+        assert manager.cancel(blocked.job_id)
+        assert blocked.status == JOB_CANCELLED
+
+        # The same worker picks up the next job
+        job = manager.submit({"block": False})
+        await wait_for_status(manager, job, JOB_SUCCEEDED)
+    finally:
+        await manager.stop()
+
+
+async def test_cancel_queued_job_skips_it():
+    release = asyncio.Event()
+
+    async def runner(params, progress_callback):
+        await release.wait()
+        return params
+
+    manager = JobManager(runner, num_workers=1)
+    await manager.start()
+    try:
+        first = manager.submit({})
+        await wait_for_status(manager, first, JOB_RUNNING)
+        queued = manager.submit({})
+        assert manager.cancel(queued.job_id)
+        release.set()
+        await wait_for_status(manager, first, JOB_SUCCEEDED)
+        assert queued.status == JOB_CANCELLED
+        assert queued.started_at is None
+    finally:
+        await manager.stop()
+
+
+async def test_stop_returns_while_a_job_is_running():
+    started = asyncio.Event()
+
+    async def runner(params, progress_callback):
+        started.set()
+        await asyncio.sleep(60)
+
+    manager = JobManager(runner, num_workers=2)
+    await manager.start()
+    job = manager.submit({})
+    await started.wait()
+
+    async with asyncio.timeout(2):
+        await manager.stop()
+    assert job.status == JOB_CANCELLED
+
+
+async def test_cancelled_queued_jobs_free_their_slots():
+    release = asyncio.Event()
+
+    async def runner(params, progress_callback):
+        await release.wait()
+        return params
+
+    manager = JobManager(runner, num_workers=1, max_queue_size=1)
+    await manager.start()
+    try:
+        running = manager.submit({})
+        await wait_for_status(manager, running, JOB_RUNNING)
+        queued = manager.submit({})
+        with pytest.raises(QueueFullError):
+            manager.submit({})
+
+        assert manager.cancel(queued.job_id)
+        assert manager.stats()["queue_depth"] == 0
+        replacement = manager.submit({})
+        release.set()
+        await wait_for_status(manager, replacement, JOB_SUCCEEDED)
+    finally:
+        await manager.stop()
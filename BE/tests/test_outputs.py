@@ -0,0 +1,30 @@
+import base64
+import hashlib
+import os
+import threading
+
+import pytest
+
+from src.cancellation import GenerationCancelled
+from src.outputs import write_base64_image
+
+IMAGE = os.urandom(10_000)
+
+
+def test_base64_image_is_decoded_in_chunks(tmp_path):
+    target = tmp_path / "ad.png"
+    saved = write_base64_image(base64.b64encode(IMAGE).decode("ascii"), str(target), chunk_chars=400)
+
+    assert target.read_bytes() == IMAGE
+    assert saved.size == len(IMAGE)
+    assert saved.sha256 == hashlib.sha256(IMAGE).hexdigest()
+    assert os.listdir(tmp_path) == ["ad.png"]
+
+
+def test_cancelled_write_leaves_nothing_behind(tmp_path):
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    with pytest.raises(GenerationCancelled):
+        write_base64_image(base64.b64encode(IMAGE).decode("ascii"), str(tmp_path / "ad.png"), cancel_event)
+    assert os.listdir(tmp_path) == []
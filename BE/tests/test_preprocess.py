@@ -0,0 +1,44 @@
+import random
+
+import pytest
+from PIL import Image
+
+from src.preprocess import prepare_image
+
+GPS_IFD = 0x8825
+MAKE_TAG = 0x010F
+
+
+@pytest.fixture
+def noisy_image():
+    # Small, heavily compressed noise: the JPEG beats any re-encode in size
+    rng = random.Random(1)
+    image = Image.new("RGB", (64, 64))
+    image.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(64 * 64)])
+    return image
+
+
+def test_small_original_without_metadata_is_sent_as_is(tmp_path, noisy_image):
+    source = tmp_path / "product.jpg"
+    noisy_image.save(source, quality=30)
+
+    prepared = prepare_image(str(source), cache_dir=str(tmp_path / "prepared"))
+
+    assert prepared.edit_path == str(source)
+    assert prepared.edit_mime == "image/jpeg"
+
+
+def test_original_with_metadata_is_never_sent(tmp_path, noisy_image):
+    source = tmp_path / "product.jpg"
+    exif = Image.Exif()
+    exif[MAKE_TAG] = "Camera"
+    exif[GPS_IFD] = {2: (52.0, 31.0, 12.0)}
+    noisy_image.save(source, quality=30, exif=exif)
+
+    prepared = prepare_image(str(source), cache_dir=str(tmp_path / "prepared"))
+
+    assert prepared.edit_path != str(source)
+    assert prepared.edit_mime == "image/webp"
+    with Image.open(prepared.edit_path) as sent:
+        assert not sent.getexif()
+        assert "icc_profile" not in sent.info
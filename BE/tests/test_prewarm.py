@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from src.prewarm import PREWARM_CANCELLED, Prewarmer
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def slow_prewarm(monkeypatch):
+    started = asyncio.Event()
+
+    async def warm(self, state):
+        state.prepared.set()
+        started.set()
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(Prewarmer, "_warm", warm)
+    return started
+
+
+async def test_wait_returns_when_the_prewarm_is_cancelled(slow_prewarm):
+    prewarmer = Prewarmer(timeout=5)
+    state = prewarmer.schedule("file", "image.png", product_name="perfume")
+    await slow_prewarm.wait()
+
+    waiter = asyncio.create_task(prewarmer.wait("file", "perfume"))
+    await asyncio.sleep(0)
+    prewarmer.cancel("file")
+    async with asyncio.timeout(1):
+        await waiter
+    assert state.status == PREWARM_CANCELLED
+
+
+async def test_caller_cancellation_is_not_swallowed_with_the_prewarm(slow_prewarm):
+    prewarmer = Prewarmer(timeout=5)
+    state = prewarmer.schedule("file", "image.png", product_name="perfume")
+    await slow_prewarm.wait()
+
+    waiter = asyncio.create_task(prewarmer.wait("file", "perfume"))
+    await asyncio.sleep(0)
+    # The request is cancelled right as its prewarm finishes cancelling
+    prewarmer.cancel("file")
+    while not state.task.done():
+        await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    await prewarmer.stop()
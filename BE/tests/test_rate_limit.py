@@ -0,0 +1,84 @@
+import time
+
+import httpx
+import openai
+import pytest
+
+from src.circuit_breaker import CircuitBreaker
+from src.deadlines import Deadline, DeadlineExceeded
+from src.rate_limit import ModelRateLimiter, async_call_with_rate_limit, call_with_rate_limit
+
+
+@pytest.fixture(autouse=True)
+def quick_retries(monkeypatch):
+    monkeypatch.setenv("OPENAI_RETRY_MAX_ATTEMPTS", "3")
+    monkeypatch.setenv("OPENAI_RETRY_MAX_WAIT", "0.01")
+
+
+def server_error():
+    request = httpx.Request("POST", "https://api.openai.com/v1/images/edits")
+    return openai.InternalServerError("down", response=httpx.Response(500, request=request), body=None)
+
+
+def exhausted_limiter():
+    limiter = ModelRateLimiter("gpt-image-1", requests_per_minute=1)
+    limiter.acquire()
+    limiter.release()
+    return limiter
+
+
+def test_sync_limiter_wait_is_bounded_by_the_deadline():
+    limiter = exhausted_limiter()
+    breaker = CircuitBreaker("edits", minimum_calls=1)
+    calls = []
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        call_with_rate_limit(limiter, lambda: calls.append(1), breaker=breaker, deadline=Deadline("edit", 1))
+    # The next token is a minute away, so there is no point waiting for the deadline
+    assert time.monotonic() - started < 0.5
+    assert calls == []
+    # Our own backlog is not an upstream failure
+    assert breaker.stats()["failures"] == 0
+    assert limiter.stats()["in_flight"] == 0
+
+
+@pytest.mark.anyio
+async def test_async_limiter_wait_is_bounded_by_the_deadline():
+    limiter = exhausted_limiter()
+
+    async def call():
+        return "never"
+
+    with pytest.raises(DeadlineExceeded):
+        await async_call_with_rate_limit(limiter, call, deadline=Deadline("edit", 1))
+
+
+def test_server_errors_are_retried_and_counted_by_the_breaker():
+    limiter = ModelRateLimiter("gpt-image-1")
+    breaker = CircuitBreaker("edits", minimum_calls=10)
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise server_error()
+        return "image"
+
+    assert call_with_rate_limit(limiter, call, breaker=breaker) == "image"
+    stats = breaker.stats()
+    assert (stats["failures"], stats["successes"]) == (2, 1)
+    assert limiter.stats()["retries"] == 2
+
+
+def test_retries_stop_before_the_deadline():
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        time.sleep(0.3)
+        raise server_error()
+
+    with pytest.raises((openai.InternalServerError, DeadlineExceeded)):
+        call_with_rate_limit(ModelRateLimiter("gpt-image-1"), call, deadline=Deadline("edit", 0.5))
+    assert len(attempts) <= 2
@@ -0,0 +1,80 @@
+import os
+
+from src.result_cache import ResultCache, make_cache_key
+
+
+def generated(tmp_path, name, size=100):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_entries=2)
+    cache.put("aa1", generated(tmp_path, "first.jpg"))
+    cache.put("bb2", generated(tmp_path, "second.jpg"))
+    # Reading the first entry makes the second the least recently used
+    assert cache.get("aa1") is not None
+
+    cache.put("cc3", generated(tmp_path, "third.jpg"))
+
+    assert cache.get("bb2") is None
+    assert cache.get("aa1") is not None
+    assert cache.get("cc3") is not None
+    assert not os.path.exists(os.path.join(str(tmp_path / "cache"), "bb", "bb2"))
+    assert cache.stats()["evictions"] == 1
+
+
+def test_total_size_limit_evicts_entries(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=250)
+    for index in range(3):
+        cache.put(f"k{index}", generated(tmp_path, f"{index}.jpg"))
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] == 200
+    assert cache.get("k0") is None
+
+
+def test_cache_survives_restarts_and_copies_hits(tmp_path):
+    key = make_cache_key("image-hash", "prompt", {"model": "gpt-image-1"})
+    ResultCache(str(tmp_path / "cache")).put(key, generated(tmp_path, "ad.jpg", size=10))
+
+    cache = ResultCache(str(tmp_path / "cache"))
+    output = str(tmp_path / "copy.jpg")
+    assert cache.copy_to(key, output)
+    assert open(output, "rb").read() == b"x" * 10
+    assert not cache.copy_to("missing", output)
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_hits_never_touch_outputs_already_served(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    cache.put("aa1", generated(tmp_path, "ad.jpg"))
+    first = str(tmp_path / "first.jpg")
+    assert cache.copy_to("aa1", first)
+    served = os.stat(first)
+    os.utime(first, ns=(served.st_atime_ns, served.st_mtime_ns - 10_000_000_000))
+    served = os.stat(first)
+
+    assert cache.copy_to("aa1", str(tmp_path / "second.jpg"))
+
+    assert os.stat(first).st_mtime_ns == served.st_mtime_ns
+    assert os.stat(first).st_ino != os.stat(cache.get("aa1")).st_ino
+
+
+def test_entry_evicted_during_a_hit_counts_as_a_miss(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path / "cache"))
+    cache.put("aa1", generated(tmp_path, "ad.jpg"))
+    lookup = cache.get
+
+    def get_then_evict(key):
+        path = lookup(key)
+        os.remove(path)
+        return path
+
+    monkeypatch.setattr(cache, "get", get_then_evict)
+    assert not cache.copy_to("aa1", str(tmp_path / "copy.jpg"))
+    assert not os.path.exists(tmp_path / "copy.jpg")
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (0, 0, 1)
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import urllib.parse
+
+import pytest
+
+from src.storage import LocalStorage, S3Storage, Storage, output_key
+
+
+@pytest.fixture
+def source_file(tmp_path):
+    path = tmp_path / "ad.jpg"
+    path.write_bytes(b"0123456789" * 1000)
+    return path
+
+
+def test_local_storage_shards_objects_by_name_hash(tmp_path, source_file):
+    storage = LocalStorage(str(tmp_path / "storage"))
+    key = output_key(str(source_file))
+    storage.put_file(key, str(source_file))
+
+    shard = hashlib.sha256(b"ad.jpg").hexdigest()
+    expected = tmp_path / "storage" / "outputs" / shard[:2] / shard[2:4] / "ad.jpg"
+    assert storage.local_path(key) == str(expected)
+    assert expected.read_bytes() == source_file.read_bytes()
+    # No temporary files are left next to the object
+    assert os.listdir(expected.parent) == ["ad.jpg"]
+
+
+def test_local_storage_round_trip(tmp_path, source_file):
+    storage = LocalStorage(str(tmp_path / "storage"))
+    storage.put_file("outputs/ad.jpg", str(source_file))
+
+    assert storage.exists("outputs/ad.jpg")
+    assert storage.stat("outputs/ad.jpg").size == 10000
+    assert b"".join(storage.iter_bytes("outputs/ad.jpg", start=5, end=14)) == b"5678901234"
+    fetched = storage.fetch("outputs/ad.jpg", str(tmp_path / "copy.jpg"))
+    assert open(fetched, "rb").read() == source_file.read_bytes()
+
+    storage.delete("outputs/ad.jpg")
+    storage.delete("outputs/ad.jpg")
+    assert not storage.exists("outputs/ad.jpg")
+    with pytest.raises(FileNotFoundError):
+        storage.fetch("outputs/ad.jpg", str(tmp_path / "missing.jpg"))
+
+
+@pytest.mark.parametrize("key", ["", "/etc/passwd", "outputs/../secret", "outputs//ad.jpg"])
+def test_local_storage_rejects_unsafe_keys(tmp_path, key):
+    with pytest.raises(ValueError):
+        LocalStorage(str(tmp_path)).stat(key)
+
+
+@pytest.fixture
+def s3_storage(monkeypatch):
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    for name, value in (("AWS_ACCESS_KEY_ID", "test"), ("AWS_SECRET_ACCESS_KEY", "test"),
+                        ("AWS_DEFAULT_REGION", "us-east-1")):
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="ads")
+        yield S3Storage("ads", prefix="adai", region="us-east-1", presign_downloads=True, presign_expiry=600)
+
+
+def test_s3_storage_round_trip(s3_storage, source_file, tmp_path):
+    s3_storage.put_file("outputs/ad.jpg", str(source_file), content_type="image/jpeg")
+
+    assert s3_storage.exists("outputs/ad.jpg")
+    stored = s3_storage.stat("outputs/ad.jpg")
+    assert (stored.size, stored.content_type) == (10000, "image/jpeg")
+    assert b"".join(s3_storage.iter_bytes("outputs/ad.jpg")) == source_file.read_bytes()
+    assert b"".join(s3_storage.iter_bytes("outputs/ad.jpg", start=5, end=14)) == b"5678901234"
+
+    fetched = s3_storage.fetch("outputs/ad.jpg", str(tmp_path / "copy.jpg"))
+    assert open(fetched, "rb").read() == source_file.read_bytes()
+
+    s3_storage.delete("outputs/ad.jpg")
+    assert not s3_storage.exists("outputs/ad.jpg")
+    with pytest.raises(FileNotFoundError):
+        s3_storage.fetch("outputs/ad.jpg", str(tmp_path / "missing.jpg"))
+    assert not os.path.exists(tmp_path / "missing.jpg")
+
+
+def test_s3_storage_presigned_url(s3_storage, source_file):
+    s3_storage.put_file("outputs/ad.jpg", str(source_file))
+    url = urllib.parse.urlsplit(s3_storage.presigned_url("outputs/ad.jpg", filename="ad.jpg"))
+    query = urllib.parse.parse_qs(url.query)
+
+    assert url.path.endswith("/ads/adai/outputs/ad.jpg")
+    assert query["response-content-disposition"] == ['attachment; filename="ad.jpg"']
+    assert "Signature" in query or "X-Amz-Signature" in query
+
+
+def test_incomplete_backend_fails_on_creation():
+    class ReadOnlyStorage(Storage):
+        def stat(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        ReadOnlyStorage()
@@ -0,0 +1,58 @@
+import contextlib
+import json
+
+import pytest
+
+from src import ad_generator
+from src.deadlines import Deadline
+
+
+class FakeStreamResponse:
+    def __init__(self, events):
+        self.events = events
+
+    async def iter_lines(self):
+        for event in self.events:
+            yield f"data: {json.dumps(event)}"
+
+
+class FakeStreamingImages:
+    def __init__(self, events):
+        self.events = events
+
+    @contextlib.asynccontextmanager
+    async def edit(self, **params):
+        yield FakeStreamResponse(self.events)
+
+
+class FakeStreamingClient:
+    def __init__(self, events):
+        self.options = []
+        self.images = type("Images", (), {"with_streaming_response": FakeStreamingImages(events)})()
+
+    def with_options(self, **options):
+        self.options.append(options)
+        return self
+
+
+@pytest.mark.anyio
+async def test_streamed_edit_forwards_partials_and_honors_the_deadline():
+    client = FakeStreamingClient([
+        {"type": "image_edit.partial_image", "partial_image_index": 0, "b64_json": "cGFydGlhbA=="},
+        {"type": "image_edit.completed", "b64_json": "ZmluYWw=", "size": "1024x1024"},
+    ])
+    partials = []
+
+    async def on_partial_image(image_base64, index):
+        partials.append((index, image_base64))
+
+    result = await ad_generator.async_stream_image_edit(
+        client, ("mug.png", b"png", "image/png"), "prompt", on_partial_image, deadline=Deadline("edit", 30.0)
+    )
+
+    assert partials == [(0, "cGFydGlhbA==")]
+    assert [image.b64_json for image in result.data] == ["ZmluYWw="]
+    assert result.size == "1024x1024"
+    # The request itself is bounded by the time left of the stage
+    assert client.options[0]["max_retries"] == 0
+    assert 0 < client.options[0]["timeout"] <= 30.0
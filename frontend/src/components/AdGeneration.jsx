@@ -1,10 +1,26 @@
 import React, { useState, useEffect, useRef } from 'react'
 import { ArrowLeft, Download, RefreshCw, Zap, CheckCircle, Loader, RotateCcw } from 'lucide-react'
-import { generateAd, downloadAd, cleanupFiles, cancelGeneration } from '../services/api'
+import { streamAd, downloadAd, cleanupFiles, cancelGeneration } from '../services/api'
 import { motion } from 'framer-motion'
 
+// Progress shown when the backend enters each pipeline stage
+const STAGE_PROGRESS = {
+  colors: 20,
+  prompt: 40,
+  validate: 45,
+  preprocess: 55,
+  edit: 60,
+  fallback: 85,
+  save: 95
+}
+
+// Progress of each partial preview received while the image is rendered
+const PREVIEW_PROGRESS = [70, 80, 90]
+
 const AdGeneration = ({ formData, updateFormData, onPrev, onReset, isGenerating, setIsGenerating, abortController, setAbortController }) => {
   const [progress, setProgress] = useState(0)
+  const [stage, setStage] = useState(null)
+  const [previewImage, setPreviewImage] = useState(null)
   const [error, setError] = useState('')
   const [isDownloading, setIsDownloading] = useState(false)
   const hasGeneratedRef = useRef(false)
@@ -106,31 +122,25 @@ const AdGeneration = ({ formData, updateFormData, onPrev, onReset, isGenerating,
     setIsGenerating(true)
     setError('')
     setProgress(0)
+    setStage(null)
+    setPreviewImage(null)
     hasGeneratedRef.current = true
 
-    // Simulate progress
-    const progressSteps = [
-      { progress: 15, delay: 500, message: "Initializing AI..." },
-      { progress: 25, delay: 800, message: "Analyzing product..." },
-      { progress: 45, delay: 1200, message: "Selecting colors..." },
-      { progress: 65, delay: 2000, message: "Generating ad..." },
-      { progress: 85, delay: 1500, message: "Enhancing quality..." },
-      { progress: 95, delay: 1000, message: "Final processing..." }
-    ]
-    
-    let stepIndex = 0
-    const progressInterval = setInterval(() => {
-      if (stepIndex < progressSteps.length) {
-        const currentStep = progressSteps[stepIndex]
-        setProgress(currentStep.progress)
-        stepIndex++
-        
-        // Clear interval if this was the last step
-        if (stepIndex >= progressSteps.length) {
-          clearInterval(progressInterval)
+    // Follow the real pipeline stages and partial previews streamed by the backend
+    let previewCount = 0
+    const handleEvent = (event, data) => {
+      if (event === 'stage') {
+        setStage(data.stage)
+        if (STAGE_PROGRESS[data.stage] !== undefined) {
+          setProgress((current) => Math.max(current, STAGE_PROGRESS[data.stage]))
         }
+      } else if (event === 'preview') {
+        setPreviewImage(data.image)
+        const previewProgress = PREVIEW_PROGRESS[Math.min(previewCount, PREVIEW_PROGRESS.length - 1)]
+        previewCount++
+        setProgress((current) => Math.max(current, previewProgress))
       }
-    }, 800) // Update every 800ms
+    }
 
     try {
       const adData = {
@@ -142,7 +152,7 @@ const AdGeneration = ({ formData, updateFormData, onPrev, onReset, isGenerating,
         colors: formData.colors,
       }
 
-      const response = await generateAd(adData, controller.signal)
+      const response = await streamAd(adData, controller.signal, handleEvent)
       
       // Extract colors from the response if they were generated by AI
       const generatedColors = response.colors_used || []
@@ -161,11 +171,10 @@ const AdGeneration = ({ formData, updateFormData, onPrev, onReset, isGenerating,
       }
       setError(err.message)
       hasGeneratedRef.current = false // Reset on error to allow retry
-      clearInterval(progressInterval)
     } finally {
       setIsGenerating(false)
       setAbortController(null)
-      clearInterval(progressInterval)
+      setPreviewImage(null)
     }
   }
 
@@ -331,6 +340,22 @@ const AdGeneration = ({ formData, updateFormData, onPrev, onReset, isGenerating,
           {isGenerating ? (
             <div className="bg-gradient-to-br from-blue-50 to-purple-50 rounded-xl p-8">
               <div className="text-center">
+                {/* Partial preview streamed while the image is rendered */}
+                {previewImage && !error && (
+                  <img
+                    src={previewImage}
+                    alt="Advertisement preview"
+                    style={{
+                      width: '100%',
+                      maxWidth: '320px',
+                      borderRadius: '12px',
+                      boxShadow: '0 10px 25px rgba(0, 0, 0, 0.15)',
+                      margin: '0 auto 1.5rem',
+                      display: 'block'
+                    }}
+                  />
+                )}
+
                 {/* Progress Circle */}
                 <div className="relative w-24 h-24 mx-auto mb-6">
                   <svg className="w-24 h-24 transform -rotate-90" viewBox="0 0 100 100">
@@ -376,11 +401,12 @@ const AdGeneration = ({ formData, updateFormData, onPrev, onReset, isGenerating,
                 <div className="mb-6">
                   <h4 className={`text-xl font-semibold mb-2 ${error ? 'text-red-600' : 'text-gray-800'}`}>
                     {error ? '❌ Generation Failed' :
-                     progress < 20 ? '🚀 Initializing AI...' :
-                     progress < 40 ? '🎨 Analyzing your product...' :
-                     progress < 60 ? '🌈 Selecting optimal colors...' :
-                     progress < 80 ? '✨ Generating advertisement...' :
-                     progress < 95 ? '🎯 Finalizing details...' :
+                     stage === null ? '🚀 Initializing AI...' :
+                     stage === 'colors' ? '🎨 Analyzing your product...' :
+                     stage === 'prompt' ? '🌈 Applying your colors...' :
+                     stage === 'validate' || stage === 'preprocess' ? '🖼️ Preparing your image...' :
+                     stage === 'edit' && previewImage ? '🎯 Refining details...' :
+                     stage === 'edit' ? '✨ Generating advertisement...' :
                      '✅ Almost ready!'}
                   </h4>
                   <p className={error ? 'text-red-500' : 'text-gray-600'}>
@@ -444,7 +470,7 @@ const AdGeneration = ({ formData, updateFormData, onPrev, onReset, isGenerating,
                   <div className={`flex items-center justify-center ${
                     error ? 'text-red-500' : progress >= 80 ? 'text-green-600 font-medium' : 'text-gray-500'
                   }`}>
-                    {error ? '✗' : progress >= 80 ? '✓' : '○'} Quality enhancement
+                    {error ? '✗' : progress >= 80 ? '✓' : '○'} Live preview
                   </div>
                   <div className={`flex items-center justify-center ${
                     error ? 'text-red-500' : progress >= 95 ? 'text-green-600 font-medium' : 'text-gray-500'
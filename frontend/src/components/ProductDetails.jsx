@@ -1,5 +1,6 @@
 import React, { useState } from 'react'
 import { ArrowLeft, ArrowRight, Package, Building2 } from 'lucide-react'
+import { prewarmUpload } from '../services/api'
 
 const ProductDetails = ({ formData, updateFormData, onNext, onPrev }) => {
   const [errors, setErrors] = useState({})
@@ -34,6 +35,10 @@ const ProductDetails = ({ formData, updateFormData, onNext, onPrev }) => {
 
   const handleNext = () => {
     if (validateForm()) {
+      // Start the color analysis for this product while the user picks colors
+      if (formData.fileId) {
+        prewarmUpload(formData.fileId, formData.productName.trim())
+      }
       onNext()
     }
   }
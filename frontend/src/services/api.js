@@ -28,6 +28,25 @@ export const uploadImage = async (file) => {
   }
 }
 
+// Start speculative color analysis of an upload once the product name is known
+export const prewarmUpload = async (fileId, productName) => {
+  try {
+    const formData = new FormData()
+    formData.append('product_name', productName)
+    
+    const response = await api.post(`/prewarm/${fileId}`, formData, {
+      headers: {
+        'Content-Type': 'multipart/form-data',
+      },
+    })
+    
+    return response.data
+  } catch (error) {
+    console.error('Prewarm error:', error)
+    // Don't throw: prewarming only makes the next steps faster
+  }
+}
+
 // Get AI color recommendations
 export const getColorRecommendations = async (productName, fileId) => {
   try {
@@ -48,8 +67,26 @@ export const getColorRecommendations = async (productName, fileId) => {
   }
 }
 
-// Generate advertisement
-export const generateAd = async (adData, signal) => {
+const JOB_POLL_INTERVAL_MS = 1500
+
+const abortError = () => new DOMException('Generation was cancelled', 'AbortError')
+
+// Wait between job status polls, stopping early if the request is aborted
+const wait = (ms, signal) => new Promise((resolve, reject) => {
+  if (signal?.aborted) {
+    reject(abortError())
+    return
+  }
+  const timer = setTimeout(resolve, ms)
+  signal?.addEventListener('abort', () => {
+    clearTimeout(timer)
+    reject(abortError())
+  }, { once: true })
+})
+
+// Generate advertisement: queue a job, then poll until it finishes
+export const generateAd = async (adData, signal, onProgress) => {
+  let jobId = null
   try {
     const formData = new FormData()
     formData.append('product_name', adData.productName)
@@ -64,22 +101,123 @@ export const generateAd = async (adData, signal) => {
       }
     }
     
-    const response = await api.post('/generate-ad', formData, {
+    const submitResponse = await api.post('/jobs/generate-ad', formData, {
       headers: {
         'Content-Type': 'multipart/form-data',
       },
       signal: signal, // Add signal for cancellation
-      timeout: 120000 // 2 minute timeout
     })
+    jobId = submitResponse.data.job_id
     
-    return response.data
+    while (true) {
+      await wait(JOB_POLL_INTERVAL_MS, signal)
+      const statusResponse = await api.get(`/jobs/${jobId}`, { signal })
+      const job = statusResponse.data
+      
+      if (onProgress) {
+        onProgress(job)
+      }
+      
+      if (job.status === 'succeeded') {
+        const resultResponse = await api.get(`/jobs/${jobId}/result`, { signal })
+        return resultResponse.data
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Failed to generate advertisement')
+      }
+      if (job.status === 'cancelled') {
+        throw abortError()
+      }
+    }
   } catch (error) {
-    if (error.name === 'AbortError') {
-      throw error // Re-throw abort errors
+    if (signal?.aborted || error.name === 'AbortError' || error.name === 'CanceledError') {
+      if (jobId) {
+        // The job keeps running server-side unless we cancel it explicitly
+        api.delete(`/jobs/${jobId}`).catch(() => {})
+      }
+      throw abortError() // Re-throw abort errors
     }
     console.error('Ad generation error:', error)
-    throw new Error(error.response?.data?.detail || 'Failed to generate advertisement')
+    throw new Error(error.response?.data?.detail || error.message || 'Failed to generate advertisement')
+  }
+}
+
+// Parse the server-sent events of a fetch response, calling onEvent(event, data) for each one
+const readServerSentEvents = async (response, onEvent) => {
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    
+    let boundary
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+      let event = 'message'
+      const data = []
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim()
+        else if (line.startsWith('data:')) data.push(line.slice(5).trim())
+      }
+      // Lines starting with ':' are keep-alive comments
+      if (data.length > 0) onEvent(event, JSON.parse(data.join('\n')))
+    }
+  }
+}
+
+// Generate advertisement, following its stages and partial previews as they stream in
+export const streamAd = async (adData, signal, onEvent) => {
+  const formData = new FormData()
+  formData.append('product_name', adData.productName)
+  formData.append('brand_name', adData.brandName)
+  formData.append('file_id', adData.fileId)
+  formData.append('use_smart_colors', adData.useSmartColors)
+  
+  if (!adData.useSmartColors) {
+    formData.append('number_of_colors', adData.numberOfColors)
+    if (adData.colors && adData.colors.length > 0) {
+      formData.append('colors', adData.colors.join(','))
+    }
+  }
+  
+  let response
+  try {
+    response = await fetch(`${API_BASE_URL}/generate-ad/stream`, { method: 'POST', body: formData, signal })
+  } catch (error) {
+    if (error.name === 'AbortError') throw abortError()
+    throw new Error('Failed to generate advertisement')
+  }
+  if (!response.ok) {
+    const body = await response.json().catch(() => ({}))
+    throw new Error(body.detail || 'Failed to generate advertisement')
+  }
+  
+  let result = null
+  let failure = null
+  try {
+    await readServerSentEvents(response, (event, data) => {
+      if (event === 'result') result = data
+      else if (event === 'error') failure = data
+      else if (onEvent) onEvent(event, data)
+    })
+  } catch (error) {
+    // Aborting the fetch also stops the generation server-side
+    if (signal?.aborted || error.name === 'AbortError') throw abortError()
+    throw error
+  }
+  
+  if (failure) {
+    if (failure.status === 499) throw abortError()
+    throw new Error(failure.detail || 'Failed to generate advertisement')
+  }
+  if (!result) {
+    throw new Error('Generation stream ended without a result')
   }
+  return result
 }
 
 // Download generated ad